@@ -0,0 +1,324 @@
+'''
+Benchmarks the TreeLoader stages on synthetic trees
+
+Generates balanced, caterpillar, star and random coalescent trees, writes
+them as GML, Newick and edge CSV, and reports the wall time, peak memory
+growth and node throughput of each loader stage, and of the streamed
+transform and load that the loader runs. Indexing is stubbed out,
+so no Elasticsearch instance is needed.
+
+Every case runs in a fresh process, so peak memory of one case does not
+hide the next.
+
+Usage: python tree_benchmark.py --sizes 1000 100000 --shapes star balanced
+
+'''
+
+import os
+import sys
+import csv
+import json
+import time
+import random
+import shutil
+import logging
+import argparse
+import resource
+import tempfile
+import multiprocessing
+from array import array
+from prettytable import PrettyTable
+from elasticsearch import helpers
+sys.path.append(os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+from common.tree_loader import TreeLoader
+from common.utils.es_utils import ElasticSearchTools
+
+
+SHAPES = ['balanced', 'caterpillar', 'star', 'coalescent']
+
+FORMATS = ['gml', 'newick', 'csv']
+
+SIZES = [1000, 10000, 100000, 1000000]
+
+class NullElasticSearchTools(ElasticSearchTools):
+
+    '''
+    Stands in for Elasticsearch during benchmarks. Documents are still
+    expanded and serialized as they would be for a bulk request.
+    '''
+
+    def exists_index(self):
+        return False
+
+    def create_index(self, mappings, index_sort=None):
+        return True
+
+    def put_settings(self, body=None):
+        return True
+
+    def forcemerge(self):
+        return True
+
+    def submit_data_to_es(self, data):
+        for document in data:
+            for line in helpers.expand_action(document):
+                json.dumps(line)
+
+
+
+def get_tree_parents(shape, num_nodes, seed=0):
+    '''
+    Returns the parent of every node in a tree of the given shape, with -1
+    for the root (node 0). Coalescent trees are binary, so they have the
+    largest odd number of nodes up to num_nodes.
+    '''
+    parents = array('i', [-1]) * num_nodes
+
+    if shape == 'balanced':
+        for node in xrange(1, num_nodes):
+            parents[node] = (node - 1) // 2
+
+    elif shape == 'caterpillar':
+        # a spine of internal nodes with one leaf hanging off each
+        for node in xrange(1, num_nodes):
+            parents[node] = node - 1 if node % 2 == 1 else node - 2
+
+    elif shape == 'star':
+        for node in xrange(1, num_nodes):
+            parents[node] = 0
+
+    elif shape == 'coalescent':
+        num_leafs = (num_nodes + 1) // 2
+        num_nodes = 2 * num_leafs - 1
+        parents = parents[:num_nodes]
+        rand = random.Random(seed)
+
+        # merge two random lineages at a time, the last merge is the root
+        lineages = range(num_nodes - num_leafs, num_nodes)
+        next_node = num_nodes - num_leafs - 1
+
+        while len(lineages) > 1:
+            for _ in range(2):
+                index = rand.randrange(len(lineages))
+                lineages[index], lineages[-1] = lineages[-1], lineages[index]
+                parents[lineages.pop()] = next_node
+
+            lineages.append(next_node)
+            next_node -= 1
+
+    else:
+        raise ValueError('Unknown tree shape %s' % shape)
+
+    return parents
+
+
+def get_node_names(parents):
+    is_leaf = [True] * len(parents)
+    for parent in parents:
+        if parent != -1:
+            is_leaf[parent] = False
+
+    return ['root' if node == 0 else ('CELL%d' if is_leaf[node] else 'LOCI%d') % node for node in xrange(len(parents))]
+
+
+def write_tree(tree_format, tree_path, parents):
+    names = get_node_names(parents)
+
+    with open(tree_path, 'w') as tree_out:
+        if tree_format == 'gml':
+            _write_gml(tree_out, names, parents)
+
+        elif tree_format == 'newick':
+            _write_newick(tree_out, names, parents)
+
+        elif tree_format == 'csv':
+            csv_writer = csv.writer(tree_out)
+            csv_writer.writerow(['source', 'target'])
+            csv_writer.writerows((names[parent], names[node]) for node, parent in enumerate(parents) if parent != -1)
+
+        else:
+            raise ValueError('Unknown tree format %s' % tree_format)
+
+
+def _write_gml(tree_out, names, parents):
+    tree_out.write('graph [\n  directed 1\n')
+
+    for node, name in enumerate(names):
+        tree_out.write('  node [\n    id %d\n    label "%s"\n  ]\n' % (node, name))
+
+    for node, parent in enumerate(parents):
+        if parent != -1:
+            tree_out.write('  edge [\n    source %d\n    target %d\n  ]\n' % (parent, node))
+
+    tree_out.write(']\n')
+
+
+def _write_newick(tree_out, names, parents):
+    children = [[] for _ in names]
+    for node, parent in enumerate(parents):
+        if parent != -1:
+            children[parent].append(node)
+
+    # strings on the stack are written out as is, node ids are expanded
+    todo_list = [0]
+
+    while todo_list:
+        item = todo_list.pop()
+
+        if isinstance(item, str):
+            tree_out.write(item)
+
+        elif children[item]:
+            tree_out.write('(')
+            todo_list.append(')' + names[item])
+
+            for index, child in enumerate(reversed(children[item])):
+                if index > 0:
+                    todo_list.append(',')
+                todo_list.append(child)
+
+        else:
+            tree_out.write(names[item])
+
+    tree_out.write(';\n')
+
+
+
+def run_case(tree_format, tree_path, num_nodes):
+    '''
+    Runs every loader stage once on the tree file, returns a row per stage
+    '''
+    tree_loader = TreeLoader(es_doc_type='benchmark', es_index='benchmark', es_host='localhost', es_port=9200)
+    tree_loader.es_tools = NullElasticSearchTools('benchmark', 'benchmark')
+
+    tree_args = {'tree_edges': tree_path} if tree_format == 'csv' else {'analysis_file': tree_path}
+    results = []
+
+    def run_stage(stage, stage_fn):
+        start_memory = _get_peak_memory()
+        start_time = time.time()
+        result = stage_fn()
+        seconds = time.time() - start_time
+
+        results.append({
+            'stage': stage,
+            'seconds': seconds,
+            'memory': _get_peak_memory() - start_memory,
+            'nodes_per_second': num_nodes / seconds if seconds > 0 else float('inf')
+        })
+        return result
+
+    tree = run_stage('_get_rooted_tree', lambda: tree_loader._get_rooted_tree(**tree_args))
+    tree_root = tree_loader._get_tree_root(tree)
+    ordering = run_stage('_get_tree_ordering', lambda: tree_loader._get_tree_ordering(tree=tree, tree_root=tree_root))
+    # the streamed load is how the loader indexes records, it runs before the
+    # records are materialized so its peak memory growth is not hidden
+    run_stage('streamed load', lambda: tree_loader._load_tree_data(tree_loader._transform_data(tree, tree_root, ordering)))
+    # the materialized stages time the transform and the indexing apart
+    records = run_stage('_transform_data', lambda: list(tree_loader._transform_data(tree, tree_root, ordering)))
+    run_stage('_load_tree_data', lambda: tree_loader._load_tree_data(records))
+
+    return results
+
+
+def _get_peak_memory():
+    ''' Peak resident memory of this process so far, in MB (Linux reports KB) '''
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+
+def _run_case_in_process(case):
+    return run_case(*case)
+
+
+
+def run_benchmarks(shapes, sizes, formats, tree_dir):
+    table = PrettyTable(['shape', 'format', 'nodes', 'stage', 'seconds', 'peak memory growth (MB)', 'nodes/s'])
+    table.align = 'r'
+
+    for shape in shapes:
+        for size in sizes:
+            parents = get_tree_parents(shape, size)
+
+            for tree_format in formats:
+                tree_path = os.path.join(tree_dir, '%s_%d.%s' % (shape, size, tree_format))
+                write_tree(tree_format, tree_path, parents)
+                logging.info('Running %s', tree_path)
+
+                # a new process per case, so each starts from a low memory peak
+                pool = multiprocessing.Pool(processes=1)
+                try:
+                    results = pool.apply(_run_case_in_process, [(tree_format, tree_path, len(parents))])
+                finally:
+                    pool.terminate()
+
+                for result in results:
+                    table.add_row([
+                        shape,
+                        tree_format,
+                        len(parents),
+                        result['stage'],
+                        '%.3f' % result['seconds'],
+                        '%.1f' % result['memory'],
+                        '%.0f' % result['nodes_per_second']
+                    ])
+
+                os.remove(tree_path)
+
+    return table
+
+
+
+def get_args():
+    '''
+    Argument parser
+    '''
+    parser = argparse.ArgumentParser(
+        description=('Benchmarks the tree loader stages on synthetic trees, without Elasticsearch')
+    )
+    parser.add_argument(
+        '-s',
+        '--shapes',
+        dest='shapes',
+        nargs='+',
+        choices=SHAPES,
+        help='Tree shapes to benchmark',
+        default=SHAPES)
+    parser.add_argument(
+        '-n',
+        '--sizes',
+        dest='sizes',
+        nargs='+',
+        help='Number of tree nodes to benchmark',
+        type=int,
+        default=SIZES)
+    parser.add_argument(
+        '-f',
+        '--formats',
+        dest='formats',
+        nargs='+',
+        choices=FORMATS,
+        help='Tree file formats to benchmark',
+        default=FORMATS)
+    parser.add_argument(
+        '-d',
+        '--tree-dir',
+        dest='tree_dir',
+        action='store',
+        help='Directory for the generated tree files, a temporary directory by default',
+        type=str)
+    return parser.parse_args()
+
+def main():
+    args = get_args()
+    logging.basicConfig(format='%(levelname)s: %(message)s', stream=sys.stdout, level=logging.INFO)
+
+    tree_dir = args.tree_dir if args.tree_dir is not None else tempfile.mkdtemp(prefix='tree_benchmark')
+    try:
+        print(run_benchmarks(args.shapes, args.sizes, args.formats, tree_dir))
+    finally:
+        if args.tree_dir is None:
+            shutil.rmtree(tree_dir)
+
+
+if __name__ == '__main__':
+    main()
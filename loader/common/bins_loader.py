@@ -17,7 +17,39 @@ import os
 import math
 import pandas as pd
 import __builtin__
-from utils.analysis_loader import AnalysisLoader
+from utils.analysis_loader import AnalysisLoader, CELL_POSITION_SORT
+from utils.es_utils import BULK_CHUNK_SIZE
+from utils.column_normalizer import ColumnNormalizer
+from utils.table_reader import read_table, read_table_chunks, is_grouped_by, DEFAULT_CHUNK_SIZE
+
+
+# csv column types, so no column is inferred. Integer columns that may be
+# empty are read as floats and coerced to int64 by the normalizer.
+CSV_DTYPES = {
+    "chr": str,
+    "start": "int64",
+    "end": "int64",
+    "width": "float64",
+    "reads": "float64",
+    "copy": "float64",
+    "state": "float64",
+    "integer_copy_number": "float64",
+    "cell_id": str
+}
+
+# bin sizes of the pyramid levels, 0 for the level with one bin per chromosome
+PYRAMID_BIN_SIZES = [1000000, 5000000, 20000000, 0]
+
+PYRAMID_KEYS = ["bin_size", "cell_id", "chrom_number", "window"]
+
+# how the per state counts of a window are combined
+PYRAMID_AGGREGATIONS = {
+    "num_bins": "sum",
+    "copy_sum": "sum",
+    "copy_count": "sum",
+    "start": "min",
+    "end": "max"
+}
 
 
 class BinsLoader(AnalysisLoader):
@@ -41,6 +73,57 @@ class BinsLoader(AnalysisLoader):
         "cell_id"
     ]
 
+    __dtypes__ = {
+        "start": "int64",
+        "end": "int64",
+        "width": "int64",
+        "reads": "int64",
+        "copy": "float64",
+        "state": "int64"
+    }
+
+    # only the positions, states and cells are searched or aggregated on
+    __mappings__ = {
+        "dynamic": False,
+        "properties": {
+            "chrom_number": {"type": "keyword"},
+            "start": {"type": "integer"},
+            "end": {"type": "integer"},
+            "width": {"type": "integer", "index": False, "doc_values": False},
+            "reads": {"type": "integer", "index": False, "doc_values": False},
+            "copy": {"type": "scaled_float", "scaling_factor": 1000, "index": False},
+            "state": {"type": "byte"},
+            "cell_id": {"type": "keyword"}
+        }
+    }
+
+    __index_sort__ = CELL_POSITION_SORT
+
+
+    # coarser bins of each cell, with the modal state and mean copy number of
+    # the bins they cover
+    __pyramid_mappings__ = {
+        "dynamic": False,
+        "properties": {
+            "bin_size": {"type": "integer"},
+            "cell_id": {"type": "keyword"},
+            "chrom_number": {"type": "keyword"},
+            "start": {"type": "integer"},
+            "end": {"type": "integer"},
+            "state": {"type": "byte"},
+            "copy": {"type": "scaled_float", "scaling_factor": 1000, "index": False},
+            "num_bins": {"type": "integer", "index": False, "doc_values": False}
+        }
+    }
+
+    # every read is for a single level
+    __pyramid_index_sort__ = [
+        ("bin_size", "asc"),
+        ("cell_id", "asc"),
+        ("chrom_number", "asc"),
+        ("start", "asc")
+    ]
+
 
     def __init__(
             self,
@@ -50,7 +133,16 @@ class BinsLoader(AnalysisLoader):
             es_port=None,
             use_ssl=False,
             http_auth=None,
-            timeout=None):
+            timeout=None,
+            bulk_workers=None,
+            bulk_chunk_size=None,
+            pyramid=False,
+            pyramid_index=None):
+        '''
+        pyramid: the index holds pyramid levels, for the loader that writes them
+        pyramid_index: also index the coarser pyramid levels of the loaded
+        bins into this index, built from the same chunks
+        '''
         super(BinsLoader, self).__init__(
             es_doc_type=es_doc_type,
             es_index=es_index,
@@ -58,30 +150,67 @@ class BinsLoader(AnalysisLoader):
             es_port=es_port,
             use_ssl=use_ssl,
             http_auth=http_auth,
-            timeout=timeout)
-
+            timeout=timeout,
+            bulk_workers=bulk_workers,
+            bulk_chunk_size=bulk_chunk_size)
+
+        self.__normalizer__ = ColumnNormalizer(self.__field_mapping__, self.__fields__, self.__dtypes__)
+
+        self.pyramid = pyramid
+        if pyramid:
+            self.__mappings__ = self.__pyramid_mappings__
+            self.__index_sort__ = self.__pyramid_index_sort__
+
+        self.pyramid_loader = None
+        if pyramid_index is not None:
+            self.pyramid_loader = BinsLoader(
+                es_doc_type=pyramid_index,
+                es_index=pyramid_index,
+                es_host=es_host,
+                es_port=es_port,
+                use_ssl=use_ssl,
+                http_auth=http_auth,
+                timeout=timeout,
+                bulk_workers=bulk_workers,
+                bulk_chunk_size=bulk_chunk_size,
+                pyramid=True)
+
+
+    def load_file(self, analysis_file=None, subpath=None, chunksize=None):
+        '''
+        Loads the file in one go, or chunksize rows at a time so memory use
+        is bounded by the chunk size. With a pyramid index, files whose
+        cells are not grouped together are loaded in one go, as the levels
+        of a cell are written once its last bin has been read.
+        '''
+        if chunksize is not None and self.pyramid_loader is not None and not is_grouped_by(analysis_file, 'cell_id', subpath, CSV_DTYPES, chunksize):
+            logging.info('Cells of %s are not grouped together, loading the whole file at once', analysis_file)
+            chunksize = None
 
+        if chunksize is None:
+            data = self._read_file(analysis_file, subpath)
+            data = self._transform_data(data)
 
+        else:
+            data = (self._transform_data(chunk) for chunk in self._read_file_chunks(analysis_file, subpath, chunksize))
 
-    def load_file(self, analysis_file=None, subpath=None):
-        data = self._read_file(analysis_file, subpath)
-        data = self._transform_data(data)
-        self._load_bin_data(data)
+        if self.pyramid_loader is None:
+            self._load_bin_data(data)
+        else:
+            self._load_bin_and_pyramid_data([data] if isinstance(data, pd.DataFrame) else data)
 
 
-    def _read_file(self, file, subpath):
-        if file.endswith('.csv'):
-            return pd.read_csv(file)
+    def _read_file(self, file, subpath=None):
+        return read_table(file, subpath, self.__normalizer__.get_input_columns(), CSV_DTYPES)
 
-        elif file.endswith('.h5'):
-            hdf = pd.HDFStore(file, 'r')
-            return hdf.get(subpath)
+    def _read_file_chunks(self, file, subpath=None, chunksize=DEFAULT_CHUNK_SIZE):
+        '''
+        Yields the file as data frames of up to chunksize rows
+        '''
+        return read_table_chunks(file, subpath, self.__normalizer__.get_input_columns(), CSV_DTYPES, chunksize)
 
     def _transform_data(self, data):
-        data.columns = self._update_columns(data.columns.values)
-        data['chrom_number'] = data['chrom_number'].apply(_format_chrom_number)
-        data = data.loc[:, self.__fields__]
-        return data
+        return self.__normalizer__.normalize(data)
 
 
 
@@ -92,16 +221,34 @@ class BinsLoader(AnalysisLoader):
             self.create_index()
 
         self.disable_index_refresh()
-        self.es_tools.submit_data_to_es(data)
-        self.enable_index_refresh()
 
+        if isinstance(data, pd.DataFrame):
+            self.es_tools.submit_data_to_es(data)
+        else:
+            for chunk in data:
+                self.es_tools.submit_data_to_es(chunk)
 
-    def _update_columns(self, columns):
+        self.enable_index_refresh()
+
+    def _load_bin_and_pyramid_data(self, chunks):
         '''
-        Renames columns attributes as specified in the
-        '__field_mapping__' reference
+        Indexes the bin chunks, and the pyramid levels of each cell as soon
+        as its last bin has been read
         '''
-        return [self.__field_mapping__[key] if key in self.__field_mapping__.keys() else key for key in columns]
+        if not self.es_tools.exists_index():
+            self.create_index()
+
+        self.disable_index_refresh()
+
+        def index_chunks():
+            for chunk in chunks:
+                self.es_tools.submit_data_to_es(chunk)
+                yield chunk
+
+        self.pyramid_loader._load_bin_data(_get_pyramid_chunks(index_chunks(), PYRAMID_BIN_SIZES))
+
+        self.enable_index_refresh()
+
 
     def _update_record_keys(self, index_record):
         '''
@@ -120,19 +267,103 @@ class BinsLoader(AnalysisLoader):
 
 
 
-def _format_chrom_number(chrom_number):
+def get_pyramid_bins(chunks, bin_sizes=PYRAMID_BIN_SIZES):
     '''
-    Formats the index record chrom_number field
+    Returns the pyramid levels of the bins in the data frame chunks. Each
+    level merges the bins of a cell into windows of bin_size bases, with the
+    state covering most of the window's bins (the lowest one on ties) and
+    their mean copy number. A cell's bins may span chunks, but must be
+    grouped together.
     '''
-    convert_chrom = {"23": 'X', "24": 'Y'}
+    levels = list(_get_pyramid_chunks(chunks, bin_sizes))
 
-    if str(chrom_number) in convert_chrom.keys():
-        return convert_chrom[str(chrom_number)]
+    if not levels:
+        return _get_pyramid_levels(None)
 
-    if re.match(r'^\d{1,2}$', chrom_number):
-        return chrom_number.zfill(2)
+    pyramid = pd.concat(levels, ignore_index=True)
+    return pyramid.sort_values(["bin_size", "cell_id", "chrom_number", "start"]).reset_index(drop=True)
+
+
+def _get_pyramid_chunks(chunks, bin_sizes):
+    '''
+    Yields the pyramid levels of the cells of each chunk. Only the counts of
+    the last cell read are held back, until a later chunk starts another
+    cell, so memory is bounded by the chunk size. Raises ValueError if a
+    cell comes back after its levels were yielded.
+    '''
+    pending = None
+    finished_cells = set()
 
-    return chrom_number.upper()
+    for chunk in chunks:
+        if len(chunk) == 0:
+            continue
+
+        counts = _get_pyramid_counts(chunk, bin_sizes)
+        if pending is not None:
+            counts = _combine_pyramid_counts(pd.concat([pending, counts], ignore_index=True))
+
+        is_last_cell = (counts["cell_id"] == chunk["cell_id"].iloc[-1]).values
+        pending = counts[is_last_cell]
+
+        if not is_last_cell.all():
+            yield _get_new_cell_levels(counts[~is_last_cell], finished_cells)
+
+    if pending is not None and len(pending):
+        yield _get_new_cell_levels(pending, finished_cells)
+
+
+def _get_new_cell_levels(counts, finished_cells):
+    repeated_cells = finished_cells.intersection(counts["cell_id"])
+    if repeated_cells:
+        raise ValueError(
+            'Bins of cell(s) %s are not grouped together, sort the file by cell_id or load it unchunked'
+            % ', '.join(sorted(repeated_cells)))
+
+    finished_cells.update(counts["cell_id"])
+    return _get_pyramid_levels(counts)
+
+
+def _get_pyramid_levels(counts):
+    '''
+    Returns the pyramid levels of the counts, with the modal state and mean
+    copy number of each window
+    '''
+    if counts is None or len(counts) == 0:
+        return pd.DataFrame(columns=["bin_size", "cell_id", "chrom_number", "start", "end", "state", "copy", "num_bins"])
+
+    counts = counts.sort_values(PYRAMID_KEYS + ["num_bins", "state"], ascending=[True] * len(PYRAMID_KEYS) + [False, True])
+    modes = counts.drop_duplicates(PYRAMID_KEYS).set_index(PYRAMID_KEYS)["state"]
+
+    pyramid = counts.groupby(PYRAMID_KEYS, sort=False).agg(PYRAMID_AGGREGATIONS)
+    pyramid["state"] = modes
+    pyramid["copy"] = pyramid["copy_sum"] / pyramid["copy_count"].where(pyramid["copy_count"] > 0)
+
+    pyramid = pyramid.reset_index().sort_values(["bin_size", "cell_id", "chrom_number", "start"])
+    return pyramid.loc[:, ["bin_size", "cell_id", "chrom_number", "start", "end", "state", "copy", "num_bins"]].reset_index(drop=True)
+
+
+def _get_pyramid_counts(data, bin_sizes):
+    '''
+    Returns the number of bins per state in each window of each level, with
+    the sum and count of their copy numbers and the extent of the window
+    '''
+    data = data.loc[:, ["cell_id", "chrom_number", "start", "end", "state", "copy"]]
+    data["num_bins"] = 1
+    data["copy_sum"] = data["copy"].fillna(0)
+    data["copy_count"] = data["copy"].notnull().astype(int)
+
+    levels = []
+    for bin_size in bin_sizes:
+        level = data.copy()
+        level["bin_size"] = bin_size
+        level["window"] = (level["start"] - 1) // bin_size if bin_size else 0
+        levels.append(level)
+
+    return _combine_pyramid_counts(pd.concat(levels, ignore_index=True))
+
+
+def _combine_pyramid_counts(counts):
+    return counts.groupby(PYRAMID_KEYS + ["state"], sort=False).agg(PYRAMID_AGGREGATIONS).reset_index()
 
 
 
@@ -166,6 +397,34 @@ def get_args():
         action='store',
         help='Path to bin file within h5',
         type=str)
+    parser.add_argument(
+        '-c',
+        '--chunksize',
+        dest='chunksize',
+        action='store',
+        help='Number of rows to read and index at a time, 0 to load the whole file at once',
+        type=int,
+        default=DEFAULT_CHUNK_SIZE)
+    parser.add_argument(
+        '--pyramid-index',
+        dest='pyramid_index',
+        action='store',
+        help='Also index the 1Mb, 5Mb, 20Mb and whole chromosome pyramid levels of the bins into this index',
+        type=str)
+    parser.add_argument(
+        '--bulk-workers',
+        dest='bulk_workers',
+        action='store',
+        help='Number of bulk requests to keep in flight at once',
+        type=int,
+        default=1)
+    parser.add_argument(
+        '--bulk-chunk-size',
+        dest='bulk_chunk_size',
+        action='store',
+        help='Number of documents per bulk request',
+        type=int,
+        default=BULK_CHUNK_SIZE)
     parser.add_argument(
         '-H',
         '--host',
@@ -233,9 +492,12 @@ def main():
         es_doc_type=args.index,
         es_index=args.index,
         es_host=args.host,
-        es_port=args.port)
+        es_port=args.port,
+        bulk_workers=args.bulk_workers,
+        bulk_chunk_size=args.bulk_chunk_size,
+        pyramid_index=args.pyramid_index)
 
-    es_loader.load_file(analysis_file=args.bin_file, subpath=args.subpath)
+    es_loader.load_file(analysis_file=args.bin_file, subpath=args.subpath, chunksize=args.chunksize or None)
 
 
 
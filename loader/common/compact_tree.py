@@ -0,0 +1,178 @@
+'''
+Compact array-backed representation of a rooted tree
+
+Nodes are integer ids into an interned name table. The tree is stored as a
+parent array plus CSR-style child lists: the children of node i are
+children[child_offsets[i]:child_offsets[i + 1]], in display order.
+
+'''
+
+from array import array
+import networkx as nx
+
+
+class CompactTree(object):
+
+    ''' Class CompactTree '''
+
+    def __init__(self, names, parents, child_order=None, root=None):
+        '''
+        names: list of node names, indexed by node id
+        parents: array of parent ids, -1 for parentless nodes
+        child_order: node ids in the order siblings should appear,
+            defaults to node id order
+        root: root id, defaults to the only parentless node if there is one
+        '''
+        self.names = names
+        self.parents = parents
+        self.child_offsets, self.children = _index_children(parents, child_order)
+        self.root = root if root is not None else _find_root(parents)
+        self._node_ids = None
+
+    @classmethod
+    def from_edges(cls, edges, nodes=()):
+        '''
+        Builds a tree from an iterable of (parent name, child name) pairs and
+        an optional list of node names, which take the first ids. Siblings
+        keep the order their edges were given in.
+        '''
+        node_ids = {}
+        names = []
+        parents = array('i')
+        child_order = array('i')
+
+        def intern_name(name):
+            try:
+                return node_ids[name]
+            except KeyError:
+                node_ids[name] = len(names)
+                names.append(name)
+                parents.append(-1)
+                return node_ids[name]
+
+        for node in nodes:
+            intern_name(node)
+
+        for parent, child in edges:
+            parent_id = intern_name(parent)
+            child_id = intern_name(child)
+
+            if parents[child_id] != -1:
+                raise ValueError('Node %s has more than one parent' % child)
+
+            parents[child_id] = parent_id
+            child_order.append(child_id)
+
+        return cls(names, parents, child_order)
+
+    @classmethod
+    def from_networkx(cls, graph):
+        ''' Builds a tree from a networkx DiGraph '''
+        return cls.from_edges(graph.edges(), graph.nodes)
+
+    def to_networkx(self):
+        ''' Returns the tree as a networkx DiGraph '''
+        graph = nx.DiGraph()
+        graph.add_nodes_from(self.names)
+
+        for node in xrange(len(self)):
+            graph.add_edges_from((self.names[node], self.names[child]) for child in self.get_children(node))
+
+        return graph
+
+    def with_child_order(self, key):
+        '''
+        Returns a tree sharing this tree's nodes with every child list
+        stably sorted by key(child id)
+        '''
+        child_order = array('i')
+
+        for node in xrange(len(self)):
+            child_order.extend(sorted(self.get_children(node), key=key))
+
+        tree = CompactTree(self.names, self.parents, child_order, self.root)
+        tree._node_ids = self._node_ids
+        return tree
+
+    def __len__(self):
+        return len(self.names)
+
+    def get_node_ids(self):
+        ''' Returns the name to node id lookup, built on first use '''
+        if self._node_ids is None:
+            self._node_ids = dict((name, node) for node, name in enumerate(self.names))
+
+        return self._node_ids
+
+    def node_id(self, name):
+        # the root is looked up often, so spare building the full lookup for it
+        if self.root is not None and self.names[self.root] == name:
+            return self.root
+
+        return self.get_node_ids()[name]
+
+    def get_children(self, node):
+        return self.children[self.child_offsets[node]:self.child_offsets[node + 1]]
+
+    def get_child_names(self, node):
+        return [self.names[child] for child in self.get_children(node)]
+
+    def num_children(self, node):
+        return self.child_offsets[node + 1] - self.child_offsets[node]
+
+    def is_leaf(self, node):
+        return self.child_offsets[node + 1] == self.child_offsets[node]
+
+    def preorder(self, node=None):
+        '''
+        Returns the ids of the subtree below node (the root by default) in
+        pre-order, visiting children in display order
+        '''
+        if node is None:
+            node = self.root
+
+        order = array('i')
+        todo_list = [node]
+
+        while todo_list:
+            curr_node = todo_list.pop()
+            order.append(curr_node)
+            todo_list.extend(reversed(self.get_children(curr_node)))
+
+        return order
+
+
+
+def _index_children(parents, child_order=None):
+    '''
+    Counting sort of the nodes by parent id, returns the CSR offsets and
+    the child array
+    '''
+    num_nodes = len(parents)
+    child_offsets = array('i', [0]) * (num_nodes + 1)
+
+    for parent in parents:
+        if parent != -1:
+            child_offsets[parent + 1] += 1
+
+    for node in xrange(num_nodes):
+        child_offsets[node + 1] += child_offsets[node]
+
+    if child_order is None:
+        child_order = xrange(num_nodes)
+
+    children = array('i', [0]) * child_offsets[num_nodes]
+    next_slot = child_offsets[:-1]
+
+    for child in child_order:
+        parent = parents[child]
+        if parent != -1:
+            children[next_slot[parent]] = child
+            next_slot[parent] += 1
+
+    return child_offsets, children
+
+
+def _find_root(parents):
+    roots = [node for node, parent in enumerate(parents) if parent == -1]
+    return roots[0] if len(roots) == 1 else None
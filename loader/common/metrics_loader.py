@@ -15,6 +15,16 @@ import math
 import pandas as pd
 import __builtin__
 from utils.analysis_loader import AnalysisLoader
+from utils.es_utils import BULK_CHUNK_SIZE
+from utils.column_normalizer import ColumnNormalizer
+from utils.table_reader import read_table
+
+
+# csv column types, state_mode may be empty so it is read as a float
+CSV_DTYPES = {
+    "cell_id": str,
+    "state_mode": "float64"
+}
 
 
 class MetricsLoader(AnalysisLoader):
@@ -28,6 +38,18 @@ class MetricsLoader(AnalysisLoader):
         'state_mode'
     ]
 
+    __dtypes__ = {
+        'state_mode': 'int64'
+    }
+
+    __mappings__ = {
+        "dynamic": False,
+        "properties": {
+            "cell_id": {"type": "keyword"},
+            "state_mode": {"type": "byte"}
+        }
+    }
+
 
     def __init__(
             self,
@@ -37,7 +59,9 @@ class MetricsLoader(AnalysisLoader):
             es_port=None,
             use_ssl=False,
             http_auth=None,
-            timeout=None):
+            timeout=None,
+            bulk_workers=None,
+            bulk_chunk_size=None):
         super(MetricsLoader, self).__init__(
             es_doc_type=es_doc_type,
             es_index=es_index,
@@ -45,8 +69,11 @@ class MetricsLoader(AnalysisLoader):
             es_port=es_port,
             use_ssl=use_ssl,
             http_auth=http_auth,
-            timeout=timeout)
+            timeout=timeout,
+            bulk_workers=bulk_workers,
+            bulk_chunk_size=bulk_chunk_size)
 
+        self.__normalizer__ = ColumnNormalizer(self.__field_mapping__, self.__fields__, self.__dtypes__)
 
 
     def load_file(self, analysis_file=None, subpath=None):
@@ -56,18 +83,10 @@ class MetricsLoader(AnalysisLoader):
 
 
     def _read_file(self, file, subpath):
-        if file.endswith('.csv'):
-            return pd.read_csv(file)
-
-        elif file.endswith('.h5'):
-            hdf = pd.HDFStore(file, 'r')
-            return hdf.get(subpath)
+        return read_table(file, subpath, self.__normalizer__.get_input_columns(), CSV_DTYPES)
 
     def _transform_data(self, data):
-        data.columns = self._update_columns(data.columns.values)
-        data = data.loc[:, self.__fields__]
-
-        return data
+        return self.__normalizer__.normalize(data)
 
 
     def _load_metrics_table(self, data):
@@ -80,13 +99,6 @@ class MetricsLoader(AnalysisLoader):
         self.enable_index_refresh()
 
 
-    def _update_columns(self, columns):
-        '''
-        Renames columns attributes as specified in the
-        '__field_mapping__' reference
-        '''
-        return [self.__field_mapping__[key] if key in self.__field_mapping__.keys() else key for key in columns]
-
 
 
 def get_args():
@@ -118,6 +130,20 @@ def get_args():
         action='store',
         help='Path to metrics file within h5',
         type=str)
+    parser.add_argument(
+        '--bulk-workers',
+        dest='bulk_workers',
+        action='store',
+        help='Number of bulk requests to keep in flight at once',
+        type=int,
+        default=1)
+    parser.add_argument(
+        '--bulk-chunk-size',
+        dest='bulk_chunk_size',
+        action='store',
+        help='Number of documents per bulk request',
+        type=int,
+        default=BULK_CHUNK_SIZE)
     parser.add_argument(
         '-H',
         '--host',
@@ -185,7 +211,9 @@ def main():
         es_doc_type=args.index,
         es_index=args.index,
         es_host=args.host,
-        es_port=args.port)
+        es_port=args.port,
+        bulk_workers=args.bulk_workers,
+        bulk_chunk_size=args.bulk_chunk_size)
 
     es_loader.load_file(analysis_file=args.metrics_file, subpath=args.subpath)
 
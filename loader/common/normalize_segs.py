@@ -6,6 +6,7 @@ import pandas as pd
 
 from bins_loader import BinsLoader
 from segs_loader import SegsLoader
+from utils.es_utils import BULK_CHUNK_SIZE
 
 
 def normalize_segs(bin_index, norm_segs_loader):
@@ -191,7 +192,12 @@ def _get_cell_bins(bin_index, cell_id):
               }
             }
         },
+        # matches the index sort, so the cell's bins are read in index order
         "sort": [{
+            "cell_id": {
+                "order": "asc"
+            }
+        }, {
             "chrom_number": {
                 "order": "asc"
             }
@@ -238,6 +244,26 @@ def get_args():
         action='store',
         help='Name of index to load segment data in',
         type=str)
+    parser.add_argument(
+        '--packed',
+        dest='packed',
+        action='store_true',
+        help='Index one document per cell, holding all its normalized segments, for analyses loaded with packed segs',
+        default=False)
+    parser.add_argument(
+        '--bulk-workers',
+        dest='bulk_workers',
+        action='store',
+        help='Number of bulk requests to keep in flight at once',
+        type=int,
+        default=1)
+    parser.add_argument(
+        '--bulk-chunk-size',
+        dest='bulk_chunk_size',
+        action='store',
+        help='Number of documents per bulk request',
+        type=int,
+        default=BULK_CHUNK_SIZE)
     parser.add_argument(
         '-H',
         '--host',
@@ -304,14 +330,19 @@ def main():
         es_doc_type=args.bin_index,
         es_index=args.bin_index,
         es_host=args.host,
-        es_port=args.port
+        es_port=args.port,
+        bulk_workers=args.bulk_workers,
+        bulk_chunk_size=args.bulk_chunk_size
     )
 
     segs_loader = SegsLoader(
         es_doc_type=args.segs_index,
         es_index=args.segs_index,
         es_host=args.host,
-        es_port=args.port
+        es_port=args.port,
+        bulk_workers=args.bulk_workers,
+        bulk_chunk_size=args.bulk_chunk_size,
+        packed=args.packed
     )
     normalize_segs(bin_loader, segs_loader)
 
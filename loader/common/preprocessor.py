@@ -21,6 +21,21 @@ class Preprocessor(object):
         newick_string = re.sub('(SA[0-9]+)[a-z]', r'\1', newick_string)
         return newick_string
 
+    def preprocess_name(self, name, is_root=False):
+        '''
+        Applies the same operations as preprocess to a single node name, so
+        trees can be preprocessed while they are being read
+        '''
+        name = self.trim_prefixes(name)
+
+        if is_root:
+            name = self.add_root(name + ';')[:-1]
+
+        if self.matching_required:
+            name = self.match_ids(name)
+
+        return name
+
     def preprocess(self):
         with open(self.newick_file, 'r+') as newick_file:
             newick_string = newick_file.read().replace('\n', '')
@@ -1,5 +1,5 @@
 '''
-Parser/Indexer for segment data in csv or h5 format
+Parser/Indexer for segment data in csv, h5, Parquet or Arrow format
 
 '''
 
@@ -14,8 +14,21 @@ import os
 import math
 import __builtin__
 import networkx as nx
+import numpy as np
 import pandas as pd
-from utils.analysis_loader import AnalysisLoader
+from utils.analysis_loader import AnalysisLoader, CELL_POSITION_SORT
+from utils.es_utils import BULK_CHUNK_SIZE
+from utils.column_normalizer import ColumnNormalizer
+from utils.table_reader import read_table, read_table_chunks, is_grouped_by, DEFAULT_CHUNK_SIZE
+
+
+# read as strings, so chunks of numbered chromosomes are formatted like the rest
+CSV_DTYPES = {
+    "chr": str
+}
+
+# fields held as parallel arrays by packed segment documents, in segment order
+PACKED_FIELDS = ["chrom_number", "start", "end", "state"]
 
 class SegsLoader(AnalysisLoader):
 
@@ -26,6 +39,50 @@ class SegsLoader(AnalysisLoader):
         "chr": "chrom_number"
     }
 
+    __dtypes__ = {
+        "start": "int64",
+        "end": "int64",
+        "state": "int64"
+    }
+
+    # segment tables have pipeline specific extra columns, only the ones
+    # that are displayed are kept
+    __mappings__ = {
+        "dynamic": False,
+        "_source": {
+            "includes": ["cell_id", "chrom_number", "start", "end", "state"]
+        },
+        "properties": {
+            "cell_id": {"type": "keyword"},
+            "chrom_number": {"type": "keyword"},
+            "start": {"type": "integer"},
+            "end": {"type": "integer"},
+            "state": {"type": "byte"}
+        }
+    }
+
+    __index_sort__ = CELL_POSITION_SORT
+
+    # packed documents hold all segments of a cell, which are only looked up
+    # by the cell. Chromosome and start keep their doc values, so per cell
+    # reads can sort the same way on either layout. The layout is marked in
+    # _meta, so readers can tell the two apart from the mapping
+    __packed_mappings__ = {
+        "dynamic": False,
+        "_meta": {"layout": "packed"},
+        "properties": {
+            "cell_id": {"type": "keyword"},
+            "chrom_number": {"type": "keyword", "index": False},
+            "start": {"type": "integer", "index": False},
+            "end": {"type": "integer", "index": False, "doc_values": False},
+            "state": {"type": "byte", "index": False, "doc_values": False}
+        }
+    }
+
+    __packed_index_sort__ = [
+        ("cell_id", "asc")
+    ]
+
 
     def __init__(
             self,
@@ -35,7 +92,14 @@ class SegsLoader(AnalysisLoader):
             es_port=None,
             use_ssl=False,
             http_auth=None,
-            timeout=None):
+            timeout=None,
+            bulk_workers=None,
+            bulk_chunk_size=None,
+            packed=False):
+        '''
+        packed: index one document per cell, with its segments as parallel
+        arrays, instead of one document per segment
+        '''
         super(SegsLoader, self).__init__(
             es_doc_type=es_doc_type,
             es_index=es_index,
@@ -43,28 +107,50 @@ class SegsLoader(AnalysisLoader):
             es_port=es_port,
             use_ssl=use_ssl,
             http_auth=http_auth,
-            timeout=timeout)
+            timeout=timeout,
+            bulk_workers=bulk_workers,
+            bulk_chunk_size=bulk_chunk_size)
+
+        self.__normalizer__ = ColumnNormalizer(self.__field_mapping__, dtypes=self.__dtypes__)
 
+        self.packed = packed
+        if packed:
+            self.__mappings__ = self.__packed_mappings__
+            self.__index_sort__ = self.__packed_index_sort__
+
+
+    def load_file(self, analysis_file=None, subpath=None, chunksize=None):
+        '''
+        Loads the file in one go, or chunksize rows at a time so memory use
+        is bounded by the chunk size. Packed files whose cells are not
+        grouped together are loaded in one go, as a cell would otherwise be
+        split over several documents.
+        '''
+        if chunksize is not None and self.packed and not is_grouped_by(analysis_file, 'cell_id', subpath, CSV_DTYPES, chunksize):
+            logging.info('Cells of %s are not grouped together, packing the whole file at once', analysis_file)
+            chunksize = None
+
+        if chunksize is None:
+            data = self._read_file(analysis_file, subpath)
+            data = self._transform_data(data)
+
+        else:
+            data = (self._transform_data(chunk) for chunk in self._read_file_chunks(analysis_file, subpath, chunksize))
 
-    def load_file(self, analysis_file=None, subpath=None):
-        data = self._read_file(analysis_file, subpath)
-        data = self._transform_data(data)
         self._load_segs_table(data)
 
 
     def _read_file(self, file, subpath=None):
-        if file.endswith('.csv'):
-            return pd.read_csv(file)
+        return read_table(file, subpath, self.__normalizer__.get_input_columns(), CSV_DTYPES)
 
-        elif file.endswith('.h5'):
-            with pd.HDFStore(file, 'r') as hdf:
-                return hdf.get(subpath)
+    def _read_file_chunks(self, file, subpath=None, chunksize=DEFAULT_CHUNK_SIZE):
+        '''
+        Yields the file as data frames of up to chunksize rows
+        '''
+        return read_table_chunks(file, subpath, self.__normalizer__.get_input_columns(), CSV_DTYPES, chunksize)
 
     def _transform_data(self, data):
-        data.columns = self._update_columns(data.columns.values)
-        data['chrom_number'] = data['chrom_number'].apply(_format_chrom_number)
-
-        return data
+        return self.__normalizer__.normalize(data)
 
 
 
@@ -72,32 +158,81 @@ class SegsLoader(AnalysisLoader):
         if not self.es_tools.exists_index():
             self.create_index()
 
+        if self.packed:
+            data = pack_segs(data) if isinstance(data, pd.DataFrame) else _pack_segs_chunks(data)
+
         self.disable_index_refresh()
-        self.es_tools.submit_data_to_es(data)
+
+        if isinstance(data, pd.DataFrame):
+            self.es_tools.submit_data_to_es(data)
+        else:
+            for chunk in data:
+                self.es_tools.submit_data_to_es(chunk)
+
         self.enable_index_refresh()
 
 
-    def _update_columns(self, columns):
-        '''
-        Renames columns attributes as specified in the
-        '__field_mapping__' reference
-        '''
-        return [self.__field_mapping__[key] if key in self.__field_mapping__.keys() else key for key in columns]
 
-def _format_chrom_number(chrom_number):
+
+def pack_segs(data):
     '''
-    Formats the index record chrom_number field
+    Returns a data frame with a row per cell, holding the cell's segments
+    as parallel arrays sorted by chromosome and start
     '''
-    chrom_number = str(chrom_number)
-    convert_chrom = {"23": 'X', "24": 'Y'}
+    if len(data) == 0:
+        return pd.DataFrame(columns=["cell_id"] + PACKED_FIELDS)
+
+    data = data.sort_values(["cell_id", "chrom_number", "start"], kind="mergesort")
+    cell_ids = data["cell_id"].values
+
+    # positions where a new cell starts
+    boundaries = np.flatnonzero(cell_ids[1:] != cell_ids[:-1]) + 1
+
+    packed = pd.DataFrame({"cell_id": cell_ids[np.r_[0, boundaries]]})
+    for field in PACKED_FIELDS:
+        packed[field] = [values.tolist() for values in np.split(data[field].values, boundaries)]
+
+    return packed
+
+
+def _pack_segs_chunks(chunks):
+    '''
+    Yields packed chunks. The segments of the last cell of a chunk are held
+    back until the next one, so cells whose rows are grouped together get a
+    single document even if they span chunks. Raises ValueError if a cell
+    comes back after it was packed, as it would get a second document.
+    '''
+    pending = None
+    packed_cells = set()
+
+    for chunk in chunks:
+        if pending is not None:
+            chunk = pd.concat([pending, chunk], ignore_index=True)
+
+        if len(chunk) == 0:
+            continue
+
+        is_last_cell = (chunk["cell_id"] == chunk["cell_id"].iloc[-1]).values
+        pending = chunk[is_last_cell]
 
-    if str(chrom_number) in convert_chrom.keys():
-        return convert_chrom[str(chrom_number)]
+        if not is_last_cell.all():
+            yield _pack_new_cells(chunk[~is_last_cell], packed_cells)
 
-    if re.match(r'^\d{1,2}$', chrom_number):
-        return chrom_number.zfill(2)
+    if pending is not None and len(pending):
+        yield _pack_new_cells(pending, packed_cells)
 
-    return chrom_number.upper()
+
+def _pack_new_cells(data, packed_cells):
+    packed = pack_segs(data)
+
+    repeated_cells = packed_cells.intersection(packed["cell_id"])
+    if repeated_cells:
+        raise ValueError(
+            'Segments of cell(s) %s are not grouped together, sort the file by cell_id or load it unchunked'
+            % ', '.join(sorted(repeated_cells)))
+
+    packed_cells.update(packed["cell_id"])
+    return packed
 
 
 
@@ -130,6 +265,34 @@ def get_args():
         action='store',
         help='Path to segs file within h5',
         type=str)
+    parser.add_argument(
+        '-c',
+        '--chunksize',
+        dest='chunksize',
+        action='store',
+        help='Number of rows to read and index at a time, 0 to load the whole file at once',
+        type=int,
+        default=DEFAULT_CHUNK_SIZE)
+    parser.add_argument(
+        '--packed',
+        dest='packed',
+        action='store_true',
+        help='Index one document per cell, holding all its segments',
+        default=False)
+    parser.add_argument(
+        '--bulk-workers',
+        dest='bulk_workers',
+        action='store',
+        help='Number of bulk requests to keep in flight at once',
+        type=int,
+        default=1)
+    parser.add_argument(
+        '--bulk-chunk-size',
+        dest='bulk_chunk_size',
+        action='store',
+        help='Number of documents per bulk request',
+        type=int,
+        default=BULK_CHUNK_SIZE)
     parser.add_argument(
         '-H',
         '--host',
@@ -197,9 +360,12 @@ def main():
         es_doc_type=args.index,
         es_index=args.index,
         es_host=args.host,
-        es_port=args.port)
+        es_port=args.port,
+        bulk_workers=args.bulk_workers,
+        bulk_chunk_size=args.bulk_chunk_size,
+        packed=args.packed)
 
-    es_loader.load_file(analysis_file=args.segs_file, subpath=args.subpath)
+    es_loader.load_file(analysis_file=args.segs_file, subpath=args.subpath, chunksize=args.chunksize or None)
 
 
 if __name__ == '__main__':
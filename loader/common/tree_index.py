@@ -0,0 +1,170 @@
+'''
+Euler tour index of a tree, for lowest common ancestor and clade
+membership queries without a round trip per parent
+
+The index is saved as a numpy .npz file next to the tree index. Nodes are
+keyed by unmerged id, so unary chains are collapsed the same way as in the
+tree index.
+
+Only the parents, depths, Euler tour and first visits are saved. The sparse
+table is O(n log n), so it is rebuilt from the tour depths on load instead
+of being stored. There are no per-leaf ancestor arrays, whose total size is
+O(leaves * depth): ancestors are read from the parent array in O(depth).
+
+'''
+
+from array import array
+import numpy as np
+
+
+class TreeIndex(object):
+
+    ''' Class TreeIndex '''
+
+    def __init__(self, names, parents, depths, euler_tour, first_visits):
+        '''
+        names: unmerged id of each node, indexed by node id
+        parents: parent id of each node, -1 for the root
+        depths: depth of each node, 0 for the root
+        euler_tour: node ids in the order an Euler tour visits them
+        first_visits: position of each node's first visit in euler_tour
+        '''
+        self.names = names
+        self.parents = np.asarray(parents, dtype=np.int32)
+        self.depths = np.asarray(depths, dtype=np.int32)
+        self.euler_tour = np.asarray(euler_tour, dtype=np.int32)
+        self.first_visits = np.asarray(first_visits, dtype=np.int32)
+        self._node_ids = dict((name, node) for node, name in enumerate(names))
+        self._sparse_table = _build_sparse_table(self.depths[self.euler_tour])
+
+    @classmethod
+    def from_records(cls, tree_records):
+        '''
+        Builds the index in one pass over the tree index records, given in
+        pre-order (as emitted by TreeLoader)
+        '''
+        index_builder = TreeIndexBuilder()
+
+        for tree_record in tree_records:
+            index_builder.add(tree_record)
+
+        return index_builder.finish()
+
+    @classmethod
+    def load(cls, index_file):
+        with np.load(index_file) as index_data:
+            return cls(
+                index_data['names'].tolist(),
+                index_data['parents'],
+                index_data['depths'],
+                index_data['euler_tour'],
+                index_data['first_visits']
+            )
+
+    def save(self, index_file):
+        np.savez_compressed(
+            index_file,
+            names=np.array(self.names),
+            parents=self.parents,
+            depths=self.depths,
+            euler_tour=self.euler_tour,
+            first_visits=self.first_visits
+        )
+
+    def __len__(self):
+        return len(self.names)
+
+    def get_lca(self, names):
+        '''
+        Returns the lowest common ancestor of the given nodes, with one range
+        minimum query over the Euler tour
+        '''
+        first_visits = [self.first_visits[self._node_ids[name]] for name in names]
+        position = self._get_min_depth_position(min(first_visits), max(first_visits))
+        return self.names[self.euler_tour[position]]
+
+    def get_ancestors(self, name):
+        '''
+        Returns the clades that contain the node, from its parent up to the
+        root, by following the parent array in O(depth)
+        '''
+        ancestors = []
+        node = self.parents[self._node_ids[name]]
+
+        while node != -1:
+            ancestors.append(self.names[node])
+            node = self.parents[node]
+
+        return ancestors
+
+    def is_in_clade(self, name, clade):
+        ''' Returns whether the node is in the clade rooted at clade (including itself) '''
+        return self.get_lca([name, clade]) == clade
+
+    def _get_min_depth_position(self, start, end):
+        level = int(end - start + 1).bit_length() - 1
+        left = self._sparse_table[level][start]
+        right = self._sparse_table[level][end - (1 << level) + 1]
+        tour_depths = self.depths[self.euler_tour[[left, right]]]
+        return left if tour_depths[0] <= tour_depths[1] else right
+
+
+
+class TreeIndexBuilder(object):
+
+    ''' Builds a TreeIndex, one tree record at a time '''
+
+    def __init__(self):
+        self.names = []
+        self.parents = array('i')
+        self.depths = array('i')
+        self.euler_tour = array('i')
+        self.first_visits = array('i')
+        self.todo_list = []
+
+    def add(self, tree_record):
+        ''' Adds the next tree record in pre-order, the root first '''
+        todo_list = self.todo_list
+
+        # a record outside the heatmap range of the node on top is not below it
+        while todo_list and todo_list[-1][1] < tree_record['min_index']:
+            self._leave_node()
+
+        node = len(self.names)
+        self.names.append(tree_record['unmerged_id'])
+        self.parents.append(todo_list[-1][0] if todo_list else -1)
+        self.depths.append(len(todo_list))
+        self.first_visits.append(len(self.euler_tour))
+        self.euler_tour.append(node)
+        todo_list.append((node, tree_record['max_index']))
+
+    def finish(self):
+        ''' Returns the index, once every tree record is added '''
+        while self.todo_list:
+            self._leave_node()
+
+        return TreeIndex(self.names, self.parents, self.depths, self.euler_tour, self.first_visits)
+
+    def _leave_node(self):
+        self.todo_list.pop()
+        if self.todo_list:
+            self.euler_tour.append(self.todo_list[-1][0])
+
+
+
+def _build_sparse_table(tour_depths):
+    '''
+    Level k holds, for every start position, the Euler tour position with
+    the minimum depth in the 2 ** k positions from there
+    '''
+    sparse_table = [np.arange(len(tour_depths), dtype=np.int32)]
+    span = 1
+
+    while 2 * span <= len(tour_depths):
+        prev_level = sparse_table[-1]
+        left = prev_level[:-span]
+        right = prev_level[span:]
+        sparse_table.append(np.where(tour_depths[left] <= tour_depths[right], left, right))
+        span *= 2
+
+    return sparse_table
@@ -19,19 +19,60 @@ import os
 import sys
 import math
 import __builtin__
-import networkx as nx
 import pandas as pd
 import json
 
-from Bio import Phylo
-from networkx.algorithms.traversal.depth_first_search import dfs_tree
+from array import array
+from collections import deque
+from compact_tree import CompactTree
+from tree_readers import read_newick_edges, read_gml_edges, read_csv_edges, root_edges
+from tree_lod import LodBuilder
+from tree_index import TreeIndexBuilder
 from utils.analysis_loader import AnalysisLoader
+from utils.es_utils import BULK_CHUNK_SIZE
+from utils.record_cache import RecordCache, DEFAULT_CACHE_DIR
 
 
 class TreeLoader(AnalysisLoader):
 
     ''' Class TreeLoader '''
 
+    # part of the record cache key: bump it with any change to the tree readers or
+    # transforms that changes the emitted records, so cached records are not reused
+    __loader_version__ = "3"
+
+    # nodes are looked up by id and heatmap position, everything else is
+    # only read back from _source
+    __mappings__ = {
+        "dynamic": False,
+        "properties": {
+            "cell_id": {"type": "keyword", "index": False, "doc_values": False},
+            "unmerged_id": {"type": "keyword"},
+            "parent": {"type": "keyword", "index": False, "doc_values": False},
+            "children": {"type": "keyword", "index": False, "doc_values": False},
+            "child_summaries": {"type": "object", "enabled": False},
+            "max_height": {"type": "integer", "index": False, "doc_values": False},
+            "min_index": {"type": "integer"},
+            "max_index": {"type": "integer"},
+            "heatmap_order": {"type": "integer"}
+        }
+    }
+
+    __lod_mappings__ = {
+        "dynamic": False,
+        "properties": {
+            "level": {"type": "byte"},
+            "leafs_per_row": {"type": "integer", "index": False, "doc_values": False},
+            "cell_id": {"type": "keyword", "index": False, "doc_values": False},
+            "unmerged_id": {"type": "keyword", "index": False, "doc_values": False},
+            "min_index": {"type": "integer"},
+            "max_index": {"type": "integer"},
+            "max_height": {"type": "integer", "index": False, "doc_values": False},
+            "num_leafs": {"type": "integer", "index": False, "doc_values": False},
+            "num_clades": {"type": "integer", "index": False, "doc_values": False}
+        }
+    }
+
     def __init__(
             self,
             es_doc_type=None,
@@ -40,7 +81,11 @@ class TreeLoader(AnalysisLoader):
             es_port=None,
             use_ssl=False,
             http_auth=None,
-            timeout=None):
+            timeout=None,
+            bulk_workers=None,
+            bulk_chunk_size=None,
+            cache_dir=None,
+            max_cache_size=None):
         super(TreeLoader, self).__init__(
             es_doc_type=es_doc_type,
             es_index=es_index,
@@ -48,82 +93,189 @@ class TreeLoader(AnalysisLoader):
             es_port=es_port,
             use_ssl=use_ssl,
             http_auth=http_auth,
-            timeout=timeout)
-
-    def load_file(self, analysis_file=None, ordering_file=None, root_id=None, tree_edges=None):
-        [tree, tree_root, ordering] = self._extract_file_to_data(analysis_file, ordering_file, root_id, tree_edges)
-        data = self._transform_data(tree, tree_root, ordering)
-        self._load_tree_data(data)
-
-    def load_file_as_json(self,  analysis_file=None, ordering_file=None, root_id=None, tree_edges=None):
-        [tree, tree_root, ordering] = self._extract_file_to_data(analysis_file, ordering_file, root_id, tree_edges)
-        data = self._transform_data(tree, tree_root, ordering)
+            timeout=timeout,
+            bulk_workers=bulk_workers,
+            bulk_chunk_size=bulk_chunk_size)
+
+        self.record_cache = None
+        if cache_dir is not None:
+            self.record_cache = RecordCache(cache_dir, max_cache_size)
+
+    def load_file(self, analysis_file=None, ordering_file=None, root_id=None, tree_edges=None, preprocessor=None, lod_loader=None, tree_index_file=None):
+        '''
+        lod_loader: also load the level-of-detail summaries of the tree into
+        the index of this loader
+        tree_index_file: also save the Euler tour index of the tree to this
+        file, for lowest common ancestor and clade membership queries
+
+        Both are built from the records as they are indexed, so the tree is
+        only read and transformed once
+        '''
+        data = self._get_records(analysis_file, ordering_file, root_id, tree_edges, preprocessor)
+        builders = []
+
+        if lod_loader is not None:
+            lod_builder = LodBuilder()
+            lod_records = []
+            builders.append(lambda tree_record: lod_records.extend(lod_builder.add(tree_record)))
+
+        if tree_index_file is not None:
+            index_builder = TreeIndexBuilder()
+            builders.append(index_builder.add)
+
+        def add_to_builders(data):
+            for tree_record in data:
+                for add in builders:
+                    add(tree_record)
+                yield tree_record
+
+        self._load_tree_data(add_to_builders(data) if builders else data)
+
+        if lod_loader is not None:
+            lod_records.extend(lod_builder.finish())
+            lod_loader._load_tree_data(lod_records, lod_loader.get_mappings(self.__lod_mappings__))
+
+        if tree_index_file is not None:
+            index_builder.finish().save(tree_index_file)
+            logging.info('Saved tree index to %s', tree_index_file)
+
+    def load_file_as_json(self,  analysis_file=None, ordering_file=None, root_id=None, tree_edges=None, preprocessor=None):
+        data = list(self._get_records(analysis_file, ordering_file, root_id, tree_edges, preprocessor))
         json_data = json.dumps(data)
         print(json_data)
         return json_data
 
 
-    def _extract_file_to_data(self, analysis_file=None, ordering_file=None, root_id=None, tree_edges=None):
-        tree = self._get_rooted_tree(analysis_file, root_id, tree_edges)
+    def _get_records(self, analysis_file=None, ordering_file=None, root_id=None, tree_edges=None, preprocessor=None):
+        '''
+        Returns the index records for the given inputs, read from the record
+        cache if these inputs were transformed before
+        '''
+        if self.record_cache is None:
+            [tree, tree_root, ordering] = self._extract_file_to_data(analysis_file, ordering_file, root_id, tree_edges, preprocessor)
+            return self._transform_data(tree, tree_root, ordering)
+
+        cache_key = self.record_cache.get_key(
+            files=[analysis_file, ordering_file, tree_edges],
+            values=[
+                root_id,
+                preprocessor.matching_required if preprocessor is not None else None,
+                self.__loader_version__
+            ]
+        )
+
+        data = self.record_cache.get(cache_key)
+        if data is not None:
+            logging.info('Using cached tree records %s', cache_key)
+            return data
+
+        [tree, tree_root, ordering] = self._extract_file_to_data(analysis_file, ordering_file, root_id, tree_edges, preprocessor)
+        return self.record_cache.put(cache_key, self._transform_data(tree, tree_root, ordering))
+
+
+    def _extract_file_to_data(self, analysis_file=None, ordering_file=None, root_id=None, tree_edges=None, preprocessor=None):
+        tree = self._get_rooted_tree(analysis_file, root_id, tree_edges, preprocessor)
         tree_root = self._get_tree_root(tree)
         ordering = self._get_tree_ordering(ordering_file, tree, tree_root)
         return [tree, tree_root, ordering]
 
     def _transform_data(self, tree, tree_root, ordering):
-        todo_list = [[tree_root, None]]
-        heatmap_index = 0
-        data = []
-
-        while todo_list != []:
-            [curr_node, curr_parent] = todo_list.pop(0)
-            unmerged_id = curr_node
-            max_height = self._get_max_height_from_node(tree, curr_node)
+        '''
+        Lazily yields one index record per node in heatmap order, so records
+        can be indexed while the tree is still being traversed
+        '''
+        root = ordering.node_id(tree_root)
+        annotations = self._annotate_tree(root, ordering)
+        chain_ends, merged_ids = self._collapse_unary_chains(root, ordering)
+        names = ordering.names
+        todo_list = deque([(root, None)])
+
+        while todo_list:
+            curr_node, curr_parent = todo_list.pop()
+            unmerged_id = names[curr_node]
+            max_height = annotations['max_height'][curr_node]
 
             if max_height != 0:
 
-                num_leaf_descendants = self._get_number_of_leaf_descendants(curr_node, tree)
-                curr_node, ordering = self._merge_if_child_is_single_internal_node(curr_node, ordering)
-                curr_children = ordering[curr_node]
+                node_id = merged_ids.get(curr_node, unmerged_id)
+                curr_children = ordering.get_children(chain_ends[curr_node])
 
                 index_record = self._create_index_record(
-                    node_id=curr_node,
+                    node_id=node_id,
                     unmerged_id=unmerged_id,
-                    heatmap_index=heatmap_index,
+                    heatmap_index=annotations['min_index'][curr_node],
                     parent=curr_parent,
-                    children=curr_children,
+                    children=[names[child] for child in curr_children],
+                    child_summaries=[
+                        self._create_child_summary(child, annotations, merged_ids.get(child, names[child]), names[child])
+                        for child in curr_children
+                    ],
                     max_height=max_height,
-                    num_leafs=num_leaf_descendants,
+                    num_leafs=annotations['num_leafs'][curr_node],
                     is_leaf=False
                 )
 
-                data = data + [index_record]
-                todo_list = [[child, curr_node] for child in curr_children] + todo_list
+                todo_list.extend((child, node_id) for child in reversed(curr_children))
 
 
             else: #is leaf node]
                 index_record = self._create_index_record(
-                    node_id=curr_node,
+                    node_id=unmerged_id,
                     unmerged_id=unmerged_id,
-                    heatmap_index=heatmap_index,
+                    heatmap_index=annotations['min_index'][curr_node],
                     parent=curr_parent,
                     max_height=max_height
                 )
 
-                data = data + [index_record]
-                heatmap_index += 1
-
 
             logging.debug(index_record)
+            yield index_record
+
+    def _annotate_tree(self, root, ordering):
+        '''
+        Computes the max height, number of leaf descendants and heatmap index
+        range of every node below root in linear time. Returns one array per
+        annotation, indexed by node id.
+        '''
+        num_nodes = len(ordering)
+        max_heights = array('i', [0]) * num_nodes
+        num_leafs = array('i', [1]) * num_nodes
+        min_indices = array('i', [0]) * num_nodes
+        max_indices = array('i', [0]) * num_nodes
+        preorder = ordering.preorder(root)
+        heatmap_index = 0
 
-        return data
+        for node in preorder:
+            if ordering.is_leaf(node):
+                min_indices[node] = heatmap_index
+                max_indices[node] = heatmap_index
+                heatmap_index += 1
+
+        # children come after their parent in pre-order, so the reverse is a valid post-order
+        for node in reversed(preorder):
+            children = ordering.get_children(node)
+
+            if children:
+                max_heights[node] = max(max_heights[child] for child in children) + 1
+                num_leafs[node] = sum(num_leafs[child] for child in children)
+                min_indices[node] = min_indices[children[0]]
+                max_indices[node] = max_indices[children[-1]]
+
+        return {
+            'max_height': max_heights,
+            'num_leafs': num_leafs,
+            'min_index': min_indices,
+            'max_index': max_indices
+        }
 
-    def _create_index_record(self, node_id, unmerged_id, heatmap_index, max_height, parent, children=[], num_leafs=1, is_leaf=True):
+    def _create_index_record(self, node_id, unmerged_id, heatmap_index, max_height, parent, children=[], child_summaries=[], num_leafs=1, is_leaf=True):
 
         index_record = {
             'cell_id': node_id,
             'unmerged_id': unmerged_id,
             'parent': parent,
             'children': children,
+            'child_summaries': child_summaries,
             'max_height': max_height,
             'min_index': heatmap_index,
             'max_index': heatmap_index + num_leafs - 1
@@ -134,138 +286,132 @@ class TreeLoader(AnalysisLoader):
 
         return index_record
 
-    def _load_tree_data(self, data):
+    def _create_child_summary(self, child, annotations, node_id, unmerged_id):
+        '''
+        Returns the fields of a child's own record that are needed to display
+        it, so a node and its children can be read with a single fetch
+        '''
+        return {
+            'cell_id': node_id,
+            'unmerged_id': unmerged_id,
+            'min_index': annotations['min_index'][child],
+            'max_index': annotations['max_index'][child],
+            'max_height': annotations['max_height'][child]
+        }
+
+    def _load_tree_data(self, data, mappings=None):
         if self.es_tools.exists_index():
             logging.info('Tree data for analysis already exists - will delete old index')
             self.es_tools.delete_index()
 
-        self.create_index()
+        self.create_index(mappings)
 
         self.disable_index_refresh()
         self.es_tools.submit_data_to_es(data)
         self.enable_index_refresh()
 
 
-    def _get_rooted_tree(self, analysis_file=None, root_id=None, tree_edges=None):
+    def _get_rooted_tree(self, analysis_file=None, root_id=None, tree_edges=None, preprocessor=None):
         # load graph from newick
-        if analysis_file.endswith('.newick'):
-            newick_tree = Phylo.read(analysis_file, 'newick')
-            graph = Phylo.to_networkx(newick_tree)
-
-            new_graph = nx.Graph()
-            for edge in graph.edges():
-                new_graph.add_edge(format_name(str(edge[0]).strip()), format_name(str(edge[1]).strip()))
+        if analysis_file is not None and analysis_file.endswith('.newick'):
+            tree = CompactTree.from_edges(read_newick_edges(analysis_file, format_name, preprocessor))
 
-            tree = nx.dfs_tree(new_graph, 'root')
 
-
-        # GML with root name
+        # GML with root name, preprocessed like the node names
         elif root_id is not None:
-            graph = nx.read_gml(analysis_file)
-            new_graph = nx.Graph()
+            root_id = root_id.strip()
+            if preprocessor is not None:
+                root_id = preprocessor.preprocess_name(root_id).strip()
 
-            for edge in graph.edges():
-                new_graph.add_edge(edge[0], edge[1])
+            tree = CompactTree.from_edges(root_edges(read_gml_edges(analysis_file, preprocessor), root_id))
 
-            tree = nx.dfs_tree(new_graph, root_id)
         # already rooted GML
         elif analysis_file is not None:
-            original_tree = nx.read_gml(analysis_file)
-            tree = nx.DiGraph()
-
-            for edge in original_tree.edges():
-                tree.add_edge(str(edge[0]).strip(), str(edge[1]).strip())
+            tree = CompactTree.from_edges(read_gml_edges(analysis_file, preprocessor))
 
         # tree edges
         else:
-            tree = nx.DiGraph()
-
-            with open(tree_edges) as csv_in:
-                csv_reader = csv.DictReader(csv_in)
-                for row in csv_reader:
-                    tree.add_edge(row['source'].strip(), row['target'].strip())
+            tree = CompactTree.from_edges(read_csv_edges(tree_edges, preprocessor))
 
         return tree
 
 
     def _get_tree_root(self, tree):
-        all_nodes = list(tree.nodes)
-        [tree_root] = [n for n in all_nodes if tree.in_degree(n)==0]
+        if tree.root is None:
+            raise ValueError('Tree does not have exactly one root')
 
-        return tree_root
+        return tree.names[tree.root]
 
 
 
 
     def _get_tree_ordering(self, ordering_file=None, tree=None, tree_root=None):
 
-
-        def _count_descendents(node):
-            try:
-                descendent_count = len(nx.descendants(tree, node)) + 1
-                return descendent_count
-            except KeyError:
-                return 0
-
-        ordering = {}
-
         if ordering_file is not None:
             with open(ordering_file) as tsv_in:
                 tsv_in = csv.reader(tsv_in, delimiter='\t')
 
-                for row in tsv_in:
-                    ordering[row[0].strip()] = [child.strip() for child in row[1].split(',')]
+                ordering = CompactTree.from_edges(
+                    (row[0].strip(), child.strip()) for row in tsv_in for child in row[1].split(',')
+                )
 
         else:
-            todo_list = [tree_root]
+            subtree_sizes = self._get_subtree_sizes(tree, tree.node_id(tree_root))
 
-            while todo_list != []:
-                curr_node = todo_list.pop(0)
+            # stable sort, so equally sized subtrees keep the tree's order
+            ordering = tree.with_child_order(key=subtree_sizes.__getitem__)
 
-                curr_children = nx.dfs_successors(tree, curr_node, 1)
+        return ordering
 
-                if curr_children != {}:
-                    curr_children = curr_children[curr_node]
-                    curr_children.sort(key=_count_descendents)
-                    ordering[curr_node.strip()] = [child.strip() for child in curr_children]
 
-                    todo_list = curr_children + todo_list
+    def _get_subtree_sizes(self, tree, root):
+        '''
+        Returns the number of nodes in the subtree of every node below root
+        (including the node itself), computed bottom-up in one pass
+        '''
+        subtree_sizes = array('i', [0]) * len(tree)
 
-        return ordering
+        for node in reversed(tree.preorder(root)):
+            subtree_sizes[node] = sum(subtree_sizes[child] for child in tree.get_children(node)) + 1
 
+        return subtree_sizes
 
-    def _get_max_height_from_node(self, tree, node):
-        path_lengths = nx.shortest_path_length(tree, source=node)
-        node_with_longest_path = max(path_lengths.keys(), key=lambda key: path_lengths[key])
 
-        return path_lengths[node_with_longest_path]
+    def _collapse_unary_chains(self, root, ordering):
+        '''
+        Collapses every chain of internal nodes that have a single internal
+        child into its first node. Returns the last node of the chain started
+        by each node (the node itself if there is none), and the merged ids
+        ("LOCI2, LOCI1") of the nodes that start a chain.
+        '''
+        names = ordering.names
+        chain_ends = array('i', xrange(len(ordering)))
+        merged_ids = {}
+        preorder = ordering.preorder(root)
 
+        for node in reversed(preorder):
+            if ordering.num_children(node) == 1:
+                [child] = ordering.get_children(node)
 
+                if not ordering.is_leaf(child):
+                    chain_ends[node] = chain_ends[child]
 
+        for node in preorder:
+            parent = ordering.parents[node]
+            is_merged_into_parent = node != root and chain_ends[parent] == chain_ends[node]
 
-    def _merge_if_child_is_single_internal_node(self, curr_node, ordering):
-        curr_children = ordering[curr_node]
+            if chain_ends[node] != node and not is_merged_into_parent:
+                chain = [node]
 
-        # if only one child
-        if len(curr_children) == 1:
-            try:
-                # check if child is a leaf node
-                curr_gchildren = ordering[curr_children[0]]
-                # if not, merge node and its single child
-                curr_node = curr_node + ", " + curr_children[0]
-                ordering[curr_node] = curr_gchildren
-                return self._merge_if_child_is_single_internal_node(curr_node, ordering)
-            except KeyError:
-                return (curr_node, ordering)
-        else:
-            return (curr_node, ordering)
+                while chain[-1] != chain_ends[node]:
+                    [child] = ordering.get_children(chain[-1])
+                    chain.append(child)
 
+                merged_ids[node] = ", ".join(names[chain_node] for chain_node in chain)
 
+        return chain_ends, merged_ids
 
 
-    def _get_number_of_leaf_descendants(self, curr_node, tree):
-        sub_nodes = list(nx.descendants(tree, curr_node))
-        return len([n for n in sub_nodes if tree.out_degree(n)==0])
 
 
 
@@ -322,6 +468,46 @@ def get_args():
         action='store',
         help='CSV file of tree edges',
         type=str)
+    parser.add_argument(
+        '--tree-index',
+        dest='tree_index',
+        action='store',
+        help='Also save the Euler tour index of the tree to this .npz file',
+        type=str)
+    parser.add_argument(
+        '--cache-dir',
+        dest='cache_dir',
+        action='store',
+        help=('Cache transformed tree records in this directory, for example %s. ' % DEFAULT_CACHE_DIR +
+              'Off unless set, the cache grows up to --cache-size'),
+        type=str,
+        default=None)
+    parser.add_argument(
+        '--cache-size',
+        dest='cache_size',
+        action='store',
+        help='Maximum size of the tree record cache in bytes, 2GB by default',
+        type=int)
+    parser.add_argument(
+        '--no-cache',
+        dest='cache_dir',
+        action='store_const',
+        const=None,
+        help='Do not read or write cached tree records, the default')
+    parser.add_argument(
+        '--bulk-workers',
+        dest='bulk_workers',
+        action='store',
+        help='Number of bulk requests to keep in flight at once',
+        type=int,
+        default=1)
+    parser.add_argument(
+        '--bulk-chunk-size',
+        dest='bulk_chunk_size',
+        action='store',
+        help='Number of documents per bulk request',
+        type=int,
+        default=BULK_CHUNK_SIZE)
     parser.add_argument(
         '-H',
         '--host',
@@ -388,9 +574,13 @@ def main():
         es_doc_type=args.index,
         es_index=args.index,
         es_host=args.host,
-        es_port=args.port)
+        es_port=args.port,
+        cache_dir=args.cache_dir,
+        max_cache_size=args.cache_size,
+        bulk_workers=args.bulk_workers,
+        bulk_chunk_size=args.bulk_chunk_size)
 
-    es_loader.load_file(analysis_file=args.gml_file, ordering_file=args.ordering_file, root_id=args.root_id, tree_edges=args.tree_edges)
+    es_loader.load_file(analysis_file=args.gml_file, ordering_file=args.ordering_file, root_id=args.root_id, tree_edges=args.tree_edges, tree_index_file=args.tree_index)
 
 
 
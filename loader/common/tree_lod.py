@@ -0,0 +1,140 @@
+'''
+Level-of-detail summaries of an indexed tree
+
+Level k summarizes the heatmap at up to LOD_FACTOR ** k leaves per row.
+Each level covers the heatmap with the largest clades that fit in a row,
+then packs adjacent clades into rows in heatmap order. Any two adjacent
+rows hold more than a row's worth of leaves between them, so a level has
+at most 2 * num_leafs / LOD_FACTOR ** k + 1 rows.
+
+'''
+
+LOD_FACTOR = 4
+
+
+def get_lod_records(tree_records, lod_factor=LOD_FACTOR):
+    '''
+    Lazily yields level-of-detail records for every level, given the tree
+    index records in pre-order (as emitted by TreeLoader)
+    '''
+    lod_builder = LodBuilder(lod_factor)
+
+    for tree_record in tree_records:
+        for lod_record in lod_builder.add(tree_record):
+            yield lod_record
+
+    for lod_record in lod_builder.finish():
+        yield lod_record
+
+
+class LodBuilder(object):
+
+    ''' Builds the level-of-detail records of a tree, one tree record at a time '''
+
+    def __init__(self, lod_factor=LOD_FACTOR):
+        self.lod_factor = lod_factor
+        self.levels = None
+
+    def add(self, tree_record):
+        '''
+        Adds the next tree record in pre-order, the root first. Returns the
+        level-of-detail records that are complete.
+        '''
+        if self.levels is None:
+            self.levels = _get_levels(_get_num_leafs(tree_record), self.lod_factor)
+
+        return [lod_record for lod_record in (level.add(tree_record) for level in self.levels) if lod_record is not None]
+
+    def finish(self):
+        ''' Returns the remaining level-of-detail records, once every tree record is added '''
+        return [lod_record for lod_record in (level.finish() for level in self.levels or []) if lod_record is not None]
+
+
+def _get_levels(num_leafs, lod_factor):
+    levels = []
+    leafs_per_row = lod_factor
+
+    # stop at the first level that fits the whole tree into a single row
+    while True:
+        levels.append(_LevelBuilder(len(levels) + 1, leafs_per_row))
+        if leafs_per_row >= num_leafs:
+            break
+        leafs_per_row *= lod_factor
+
+    return levels
+
+
+class _LevelBuilder(object):
+
+    ''' Packs the clades of one level into rows '''
+
+    def __init__(self, level, leafs_per_row):
+        self.level = level
+        self.leafs_per_row = leafs_per_row
+        self.covered_index = -1
+        self.row = None
+        self.representative_leafs = 0
+
+    def add(self, tree_record):
+        '''
+        Adds the record if it is the largest clade that fits into a row.
+        Returns the previous row if it is full.
+        '''
+        num_leafs = _get_num_leafs(tree_record)
+
+        # in pre-order, any record inside an added clade directly follows it
+        if tree_record['min_index'] <= self.covered_index or num_leafs > self.leafs_per_row:
+            return None
+
+        self.covered_index = tree_record['max_index']
+        full_row = None
+
+        if self.row is not None and self.row['num_leafs'] + num_leafs > self.leafs_per_row:
+            full_row = self.finish()
+
+        if self.row is None:
+            self.row = self._create_row(tree_record)
+        else:
+            self._add_to_row(tree_record)
+
+        return full_row
+
+    def finish(self):
+        row = self.row
+        self.row = None
+        return row
+
+    def _create_row(self, tree_record):
+        self.representative_leafs = _get_num_leafs(tree_record)
+
+        return {
+            'level': self.level,
+            'leafs_per_row': self.leafs_per_row,
+            'cell_id': tree_record['cell_id'],
+            'unmerged_id': tree_record['unmerged_id'],
+            'min_index': tree_record['min_index'],
+            'max_index': tree_record['max_index'],
+            'max_height': tree_record['max_height'],
+            'num_leafs': _get_num_leafs(tree_record),
+            'num_clades': 1
+        }
+
+    def _add_to_row(self, tree_record):
+        row = self.row
+        num_leafs = _get_num_leafs(tree_record)
+
+        # the largest clade in the row represents it
+        if num_leafs > self.representative_leafs:
+            row['cell_id'] = tree_record['cell_id']
+            row['unmerged_id'] = tree_record['unmerged_id']
+            self.representative_leafs = num_leafs
+
+        row['max_index'] = tree_record['max_index']
+        row['max_height'] = max(row['max_height'], tree_record['max_height'])
+        row['num_leafs'] += num_leafs
+        row['num_clades'] += 1
+
+
+def _get_num_leafs(record):
+    return record['max_index'] - record['min_index'] + 1
+
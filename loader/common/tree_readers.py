@@ -0,0 +1,237 @@
+'''
+Streaming readers for tree files
+
+Each reader yields (parent, child) edges in a single pass over the input
+file, without building an intermediate graph. Children of the same parent
+are always yielded in the order they appear in the file.
+
+'''
+
+import re
+import csv
+from collections import defaultdict
+
+
+CHUNK_SIZE = 1 << 16
+
+NEWICK_TOKEN = re.compile(r"""
+    [(),;]                  # structure
+    | :[^,();\[]*           # branch length
+    | \[[^\]]*\]?           # comment
+    | '(?:[^']|'')*'?       # quoted label
+    | [^,();:\[\]']+        # unquoted label
+""", re.VERBOSE)
+
+GML_TOKEN = re.compile(r"""
+    \#[^\n]*                # comment
+    | "[^"]*"?              # string
+    | [\[\]]                # list
+    | [^\s\[\]"]+           # key or number
+""", re.VERBOSE)
+
+GML_KEYS = {
+    'node': ('id', 'label'),
+    'edge': ('source', 'target')
+}
+
+
+def read_newick_edges(newick_file, format_name=None, preprocessor=None):
+    '''
+    Yields the (parent, child) edges of a Newick tree.
+
+    Labels are stripped and, if given, passed through the preprocessor and
+    format_name before being yielded. An unnamed root is called 'root' and
+    other unnamed nodes get a generated 'internal_<n>' name.
+    '''
+    # one list of finished child names per open '('
+    stack = []
+    curr_label = ''
+    curr_children = None
+    num_unnamed = 0
+
+    for token in _tokenize(newick_file, NEWICK_TOKEN):
+        if token == '(':
+            stack.append([])
+            curr_label = ''
+
+        elif token in (',', ')', ';'):
+            is_root = token == ';'
+            name = curr_label.strip()
+
+            if preprocessor is not None:
+                name = preprocessor.preprocess_name(name, is_root=is_root).strip()
+
+            if name == '':
+                if is_root:
+                    name = 'root'
+                else:
+                    num_unnamed += 1
+                    name = 'internal_%d' % num_unnamed
+
+            elif format_name is not None:
+                name = format_name(name)
+
+            if curr_children is not None:
+                for child in curr_children:
+                    yield (name, child)
+
+            curr_label = ''
+            curr_children = None
+
+            if is_root:
+                return
+
+            stack[-1].append(name)
+
+            if token == ')':
+                curr_children = stack.pop()
+
+        elif token[0] == "'":
+            curr_label += token[1:-1].replace("''", "'")
+
+        elif token[0] not in ':[':
+            curr_label += token
+
+
+def read_gml_edges(gml_file, preprocessor=None):
+    '''
+    Yields the (source, target) edges of a GML graph, with nodes named by
+    their stripped label (or id, if they have none), passed through the
+    preprocessor if given.
+
+    Only the ids and labels of nodes and the endpoints of edges are read,
+    all other attributes are skipped. Edges are yielded as soon as both
+    endpoints have been declared.
+    '''
+    node_names = {}
+    pending_edges = []
+    # keys of the lists that are currently open, e.g. ['graph', 'node']
+    path = []
+    key = None
+    curr_item = None
+
+    for token in _tokenize(gml_file, GML_TOKEN):
+        if token[0] == '#':
+            continue
+
+        if key is None:
+            if token != ']':
+                key = token
+                continue
+
+            item_type = path.pop()
+
+            if curr_item is not None and len(path) == 1:
+                if item_type == 'node':
+                    node_id = curr_item.get('id')
+                    node_names[node_id] = _preprocess_name(curr_item.get('label', node_id), preprocessor)
+
+                # once an edge has to wait for its nodes, later ones wait too to keep their order
+                elif not pending_edges and curr_item.get('source') in node_names and curr_item.get('target') in node_names:
+                    yield (node_names[curr_item['source']], node_names[curr_item['target']])
+
+                else:
+                    pending_edges.append((curr_item.get('source'), curr_item.get('target')))
+
+                curr_item = None
+
+        elif token == '[':
+            path.append(key)
+            key = None
+
+            if len(path) == 2 and path[0] == 'graph' and path[1] in GML_KEYS:
+                curr_item = {}
+
+        else:
+            if curr_item is not None and len(path) == 2 and key in GML_KEYS[path[1]]:
+                curr_item[key] = token.strip('"').strip()
+
+            key = None
+
+    for source, target in pending_edges:
+        if source not in node_names or target not in node_names:
+            raise ValueError('Edge %s -> %s refers to an undeclared node' % (source, target))
+
+        yield (node_names[source], node_names[target])
+
+
+def read_csv_edges(csv_file, preprocessor=None):
+    '''
+    Yields the stripped (source, target) edges of a CSV file with source and
+    target columns, passed through the preprocessor if given
+    '''
+    with open(csv_file) as csv_in:
+        csv_reader = csv.reader(csv_in)
+        header = next(csv_reader)
+        source_index = header.index('source')
+        target_index = header.index('target')
+
+        for row in csv_reader:
+            # blank lines are skipped, like csv.DictReader does
+            if not row:
+                continue
+
+            yield (_preprocess_name(row[source_index].strip(), preprocessor), _preprocess_name(row[target_index].strip(), preprocessor))
+
+
+def root_edges(edges, root):
+    '''
+    Yields the edges of an undirected tree as (parent, child) pairs directed
+    away from root. Children keep the order their edges were given in.
+    '''
+    neighbours = defaultdict(list)
+
+    for node, other_node in edges:
+        neighbours[node].append(other_node)
+        neighbours[other_node].append(node)
+
+    if root not in neighbours:
+        raise ValueError('Root %s is not in the tree' % root)
+
+    todo_list = [(root, None)]
+
+    while todo_list:
+        curr_node, curr_parent = todo_list.pop()
+        curr_neighbours = neighbours.pop(curr_node, None)
+
+        if curr_neighbours is None:
+            raise ValueError('Tree has a cycle through %s' % curr_node)
+
+        curr_children = [node for node in curr_neighbours if node != curr_parent]
+
+        for child in curr_children:
+            yield (curr_node, child)
+
+        todo_list.extend((child, curr_node) for child in reversed(curr_children))
+
+
+def _preprocess_name(name, preprocessor):
+    if preprocessor is None or name is None:
+        return name
+
+    return preprocessor.preprocess_name(name).strip()
+
+
+def _tokenize(tree_file, token_pattern):
+    '''
+    Yields the tokens of a file, reading it in fixed size chunks. A token
+    that touches the end of a chunk is held back until the next one, since
+    it may continue there.
+    '''
+    with open(tree_file, 'r') as tree_in:
+        pending = ''
+
+        while True:
+            chunk = tree_in.read(CHUNK_SIZE)
+            text = pending + chunk
+            pending = ''
+
+            for match in token_pattern.finditer(text):
+                if chunk and match.end() == len(text):
+                    pending = text[match.start():]
+                    break
+
+                yield match.group()
+
+            if not chunk:
+                return
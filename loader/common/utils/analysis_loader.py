@@ -20,6 +20,15 @@ from es_settings import YAML_INDEX
 from elasticsearch.exceptions import NotFoundError
 
 
+# index sort of per cell tables, whose reads filter on a cell and sort by
+# position, so they read one contiguous run of documents
+CELL_POSITION_SORT = [
+    ("cell_id", "asc"),
+    ("chrom_number", "asc"),
+    ("start", "asc")
+]
+
+
 class AnalysisLoader(object):
 
     '''
@@ -32,6 +41,11 @@ class AnalysisLoader(object):
     record_attributes = []
     __load_id__ = ''
     __paired_record_attributes__ = None
+    # explicit mappings of the loader's document type, merged over the
+    # default ones when the index is created
+    __mappings__ = None
+    # (field, order) pairs the index keeps its documents sorted by
+    __index_sort__ = None
 
     #
     # ABSTRACT METHODS TO IMPLEMENT
@@ -185,7 +199,8 @@ class AnalysisLoader(object):
     def __init__(self, es_doc_type=None,
                  es_index=None, es_host=None,
                  es_port=None, timeout=None,
-                 use_ssl=False, http_auth=None):
+                 use_ssl=False, http_auth=None,
+                 bulk_workers=None, bulk_chunk_size=None):
         '''
         sets up Elastic search connection parameters
         '''
@@ -197,6 +212,9 @@ class AnalysisLoader(object):
             timeout=timeout,
             use_ssl=use_ssl,
             http_auth=http_auth)
+        self.es_tools.set_bulk_options(
+            workers=bulk_workers,
+            chunk_size=bulk_chunk_size)
 
     def convert_to_number(self, number):
         '''
@@ -561,6 +579,22 @@ class AnalysisLoader(object):
 
         return mappings
 
+    def get_mappings(self, type_mappings=None):
+        '''
+        returns the default mapping configuration with the given document
+        type mappings, or the loader's __mappings__, merged over it
+        '''
+        mappings = self.get_default_mappings()
+
+        if type_mappings is None:
+            type_mappings = self.__mappings__
+
+        if type_mappings is not None:
+            document_type = self.es_tools.get_doc_type()
+            mappings['mappings'][document_type].update(copy.deepcopy(type_mappings))
+
+        return mappings
+
     def create_index(self, mappings=None):
         '''
         a wrapper method which invokes the corresponding es_utils method.
@@ -568,9 +602,9 @@ class AnalysisLoader(object):
         document type only
         '''
         if not mappings:
-            mappings = self.get_default_mappings()
+            mappings = self.get_mappings()
 
-        return self.es_tools.create_index(mappings)
+        return self.es_tools.create_index(mappings, index_sort=self.__index_sort__)
 
     def get_reference_data(self, index, sample_data):
         ''' searches the provided index for sample related data '''
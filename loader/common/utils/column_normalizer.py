@@ -0,0 +1,98 @@
+'''
+Vectorized normalization of loader data frames
+
+Renames columns, canonicalizes chromosome names, projects the indexed
+fields and coerces their dtypes. Integer fields with missing values are
+left as floats, so the missing values are indexed as null. Works the same
+on a whole table or on one chunk of it.
+
+'''
+
+import re
+import numpy as np
+import pandas as pd
+
+
+CHROM_NAMES = {
+    "23": "X",
+    "24": "Y"
+}
+
+
+class ColumnNormalizer(object):
+
+    ''' Class ColumnNormalizer '''
+
+    def __init__(self, field_mapping=None, fields=None, dtypes=None):
+        '''
+        field_mapping: input column name to indexed field name
+        fields: indexed fields in output order, all columns if None
+        dtypes: field name to dtype, for the fields that need coercing
+        '''
+        self.field_mapping = field_mapping if field_mapping is not None else {}
+        self.fields = fields
+        self.dtypes = dtypes if dtypes is not None else {}
+
+    def get_input_columns(self):
+        '''
+        Returns the input columns that end up in the indexed fields, or None
+        if all columns are kept
+        '''
+        if self.fields is None:
+            return None
+
+        input_columns = []
+        for field in self.fields:
+            input_columns.append(field)
+            input_columns.extend(column for column, mapped_field in sorted(self.field_mapping.items()) if mapped_field == field)
+
+        return input_columns
+
+    def normalize(self, data):
+        data = data.rename(columns=self.field_mapping, copy=False)
+
+        if 'chrom_number' in data.columns:
+            data['chrom_number'] = format_chrom_numbers(data['chrom_number'])
+
+        if self.fields is not None:
+            data = data.loc[:, self.fields]
+
+        dtypes = dict(
+            (field, dtype) for field, dtype in self.dtypes.items()
+            if field in data.columns and not (np.issubdtype(np.dtype(dtype), np.integer) and data[field].isnull().any())
+        )
+        if dtypes:
+            data = data.astype(dtypes, copy=False)
+
+        return data
+
+
+
+def format_chrom_number(chrom_number):
+    '''
+    Formats one chromosome name: 23 and 24 become X and Y, other numbers are
+    zero padded to two digits and names are upper cased
+    '''
+    chrom_number = str(chrom_number)
+
+    if chrom_number in CHROM_NAMES:
+        return CHROM_NAMES[chrom_number]
+
+    if re.match(r'^\d{1,2}$', chrom_number):
+        return chrom_number.zfill(2)
+
+    return chrom_number.upper()
+
+
+def format_chrom_numbers(chrom_numbers):
+    '''
+    Formats a column of chromosome names. Each distinct name is formatted
+    once and mapped back through the factorized codes, missing names stay
+    missing.
+    '''
+    codes, uniques = pd.factorize(chrom_numbers)
+
+    # code -1 (missing) takes the trailing NaN
+    formatted = np.array([format_chrom_number(chrom_number) for chrom_number in uniques] + [np.nan], dtype=object)
+
+    return pd.Series(formatted.take(codes), index=chrom_numbers.index, name=chrom_numbers.name)
@@ -19,10 +19,17 @@ import json
 import pandas as pd
 
 import time
+import Queue
+import threading
 import pprint as pp
 
 TIMEOUT = 300
 
+BULK_CHUNK_SIZE = 500
+
+# the index and doc type are given in the bulk request URL
+BULK_INDEX_ACTION = '{"index":{}}\n'
+
 class ElasticSearchTools(object):
 
     ''' Initializes the Elasticsearch api '''
@@ -37,10 +44,23 @@ class ElasticSearchTools(object):
     __slow_query__ = 3.0    #query is slow if it runs longer than this
     __log_interval__ = 10.0 #interval to print logging information
 
+    bulk_workers = 1
+    bulk_chunk_size = BULK_CHUNK_SIZE
+
     def __init__(self, es_doc_type=None, es_index=None):
         self.__es_doc_type__ = es_doc_type
         self.__es_index__ = es_index
 
+    def set_bulk_options(self, workers=None, chunk_size=None):
+        '''
+        Sets the number of bulk requests kept in flight at once, and the
+        number of documents per bulk request
+        '''
+        if workers is not None:
+            self.bulk_workers = workers
+        if chunk_size is not None:
+            self.bulk_chunk_size = chunk_size
+
     def logerr(self,msg):
         logging.error("%s; %s\n%s",time.strftime("%Y-%m-%d %H:%M:%S",time.localtime()),msg,pp.pformat(traceback.format_list(traceback.extract_stack())))
 
@@ -57,8 +77,11 @@ class ElasticSearchTools(object):
                          ,index,doc_type
                          ,query,t1-t0)
 
-    def create_index(self, mappings):
-        ''' Creates a new index using the provided mapping '''
+    def create_index(self, mappings, index_sort=None):
+        '''
+        Creates a new index using the provided mapping. index_sort is a list
+        of (field, order) pairs to sort the documents of each segment by
+        '''
         try:
             num_nodes = self.es.cluster.health()["number_of_data_nodes"]
             settings = {
@@ -70,6 +93,9 @@ class ElasticSearchTools(object):
                     }
                 }
             }
+            if index_sort:
+                settings["settings"]["index"]["sort.field"] = [field for field, _ in index_sort]
+                settings["settings"]["index"]["sort.order"] = [order for _, order in index_sort]
             settings.update(mappings)
             #print("Creating index: %s;",{"index":self.__es_index__,"body":str(settings)}) #debug
             logging.info("Creating index: %s;",{"index":self.__es_index__,"body":str(settings)}) #debug
@@ -146,17 +172,21 @@ class ElasticSearchTools(object):
 
     def submit_data_to_es(self, data):
         '''
-        Adds the provided pandas DataFrame or list to the Elasticsearch index
+        Adds the provided pandas DataFrame, list or iterable of records to the
+        Elasticsearch index. Iterables are consumed lazily, one bulk request
+        at a time
         '''
-        if isinstance(data, pd.DataFrame):
-            documents = data.where((pd.notnull(data)), None).to_dict(orient='records')
-        elif isinstance(data, list):
-            documents = data
         try:
-            res = helpers.bulk(self.es,
-                            documents,
-                            index=self.__es_index__,
-                            doc_type=self.__es_doc_type__)
+            if isinstance(data, pd.DataFrame):
+                res = self.submit_frame_to_es(data)
+            elif self.bulk_workers > 1:
+                res = self._parallel_bulk(data)
+            else:
+                res = helpers.bulk(self.es,
+                                data,
+                                index=self.__es_index__,
+                                doc_type=self.__es_doc_type__,
+                                chunk_size=self.bulk_chunk_size)
 
             logging.info('%d records loaded', res[0])
             logging.info('%d errors', len(res[1]))
@@ -165,6 +195,127 @@ class ElasticSearchTools(object):
             logging.error(e)
 
 
+    def submit_frame_to_es(self, data, chunk_size=None):
+        '''
+        Bulk indexes the rows of a pandas DataFrame, encoded column-wise into
+        NDJSON request bodies without building a dict per row. Returns the
+        number of indexed rows and the failed items, like helpers.bulk.
+        '''
+        if chunk_size is None:
+            chunk_size = self.bulk_chunk_size
+
+        bodies = encode_bulk_bodies(data, chunk_size)
+
+        if self.bulk_workers > 1:
+            results = self._send_bulk_bodies_parallel(bodies)
+        else:
+            results = (self._send_bulk_body(body) for body in bodies)
+
+        num_success = 0
+        errors = []
+
+        for body_success, body_errors in results:
+            num_success += body_success
+            errors.extend(body_errors)
+
+            if errors:
+                raise helpers.BulkIndexError('%i document(s) failed to index.' % len(errors), errors)
+
+        return num_success, errors
+
+
+    def _send_bulk_body(self, body):
+        '''
+        Sends one encoded bulk request, returns the number of indexed
+        documents and the failed items
+        '''
+        res = self.es.bulk(
+            body=body,
+            index=self.__es_index__,
+            doc_type=self.__es_doc_type__,
+            request_timeout=TIMEOUT)
+
+        num_success = 0
+        errors = []
+
+        for item in res['items']:
+            if 200 <= item['index'].get('status', 500) < 300:
+                num_success += 1
+            else:
+                errors.append(item)
+
+        return num_success, errors
+
+
+    def _send_bulk_bodies_parallel(self, bodies):
+        '''
+        Sends the bulk bodies from bulk_workers threads and returns their
+        results. Bodies are encoded at most one queue length ahead of the
+        requests in flight, so a slow cluster holds back the encoding rather
+        than filling memory.
+        '''
+        body_queue = Queue.Queue(maxsize=self.bulk_workers)
+        results = []
+        failures = []
+
+        def send_bodies():
+            while True:
+                body = body_queue.get()
+                if body is None:
+                    return
+
+                try:
+                    results.append(self._send_bulk_body(body))
+                except Exception as e:
+                    failures.append(e)
+
+        workers = [threading.Thread(target=send_bodies) for _ in range(self.bulk_workers)]
+        for worker in workers:
+            worker.daemon = True
+            worker.start()
+
+        try:
+            for body in bodies:
+                if failures:
+                    break
+                body_queue.put(body)
+
+        finally:
+            for _ in workers:
+                body_queue.put(None)
+            for worker in workers:
+                worker.join()
+
+        if failures:
+            raise failures[0]
+
+        return results
+
+
+    def _parallel_bulk(self, documents):
+        '''
+        Indexes an iterable of documents with bulk_workers requests in
+        flight, returns the number of indexed documents and the failed items
+        '''
+        num_success = 0
+        errors = []
+
+        for ok, item in helpers.parallel_bulk(
+                self.es,
+                documents,
+                thread_count=self.bulk_workers,
+                chunk_size=self.bulk_chunk_size,
+                queue_size=self.bulk_workers,
+                index=self.__es_index__,
+                doc_type=self.__es_doc_type__):
+            if ok:
+                num_success += 1
+            else:
+                errors.append(item)
+
+        return num_success, errors
+
+
     def submit_bulk_to_es(self, records_to_insert):
         '''
         Adds a group of records to the Elasticsearch index
@@ -340,6 +491,26 @@ class ElasticSearchTools(object):
                                 ,query=search_query,tmout=1.0)
             return rc
 
+    def get_write_capacity(self):
+        '''
+        Returns the number of write threads across the cluster nodes, or
+        None if the thread pools can not be read
+        '''
+        try:
+            nodes = self.es.nodes.info(metric='thread_pool')['nodes']
+        except Exception as e:
+            self.logerr("Noncritical; " + str(e))
+            return None
+
+        capacity = 0
+        for node in nodes.values():
+            thread_pools = node.get('thread_pool', {})
+            # the bulk thread pool was renamed to write in 6.3
+            thread_pool = thread_pools.get('write', thread_pools.get('bulk', {}))
+            capacity += thread_pool.get('size', thread_pool.get('max', 0))
+
+        return capacity or None
+
     def put_settings(self, body=None):
         ''' Applies the specified index settings '''
         if not isinstance(body, dict):
@@ -393,6 +564,23 @@ class ElasticSearchTools(object):
             index_name = self.__es_index__
         return self.es.indices.put_alias(name=alias_name, index=index_name)
 
+
+def encode_bulk_bodies(data, chunk_size=BULK_CHUNK_SIZE):
+    '''
+    Yields bulk request bodies for chunk_size rows of the DataFrame at a
+    time, with missing values as null
+    '''
+    for start in xrange(0, len(data), chunk_size):
+        documents = data.iloc[start:start + chunk_size].to_json(
+            orient='records',
+            lines=True,
+            double_precision=15,
+            date_format='iso')
+
+        # encoded strings escape their newlines, so every newline ends a document
+        yield BULK_INDEX_ACTION + documents.replace('\n', '\n' + BULK_INDEX_ACTION) + '\n'
+
+
 ##############################################
 ######  TESTS             ####################
 ##############################################
@@ -0,0 +1,108 @@
+'''
+Loads the input files of one index from a pool of worker processes
+
+Every worker builds its own loader, so files are parsed and indexed
+concurrently without sharing Elasticsearch connections. A failed file is
+reported with its traceback once all the other files have been loaded.
+
+Workers are forked, and a forked process inherits the locks other threads
+of its parent hold at that moment (logging handlers, urllib3 connection
+pools) without the threads that would release them. Pools are therefore
+only created from the main thread, before any other threads start. Code
+running in other threads has to be given a pool created that way.
+
+'''
+
+import logging
+import threading
+import traceback
+import multiprocessing
+
+
+class FileLoadError(Exception):
+
+    ''' Raised when one or more input files failed to load '''
+
+    def __init__(self, failures):
+        self.failures = failures
+        super(FileLoadError, self).__init__(
+            '%d file(s) failed to load: %s' % (len(failures), ', '.join(_get_file_name(file_args) for file_args, _ in failures)))
+
+
+def get_num_workers(es_tools, num_files, max_workers=None):
+    '''
+    Returns the number of worker processes for num_files files: one per
+    file, at most one per core, and no more than the cluster has write
+    threads for, given the bulk requests each worker keeps in flight
+    '''
+    num_workers = min(num_files, multiprocessing.cpu_count())
+
+    if max_workers is not None:
+        num_workers = min(num_workers, max_workers)
+
+    write_capacity = es_tools.get_write_capacity()
+    if write_capacity is not None:
+        num_workers = min(num_workers, write_capacity // es_tools.bulk_workers)
+
+    return max(num_workers, 1)
+
+
+def load_files_parallel(loader_class, loader_args, files_args, num_workers=1, pool=None):
+    '''
+    Calls load_file(**file_args) on a loader_class(**loader_args) for each
+    of files_args, from the processes of pool, or else of a pool of
+    num_workers processes created for these files. Creating a pool raises
+    RuntimeError off the main thread. The index has to exist already, so
+    workers do not race to create it. Files are loaded in any order, raises
+    FileLoadError if any of them failed.
+    '''
+    jobs = [(loader_class, loader_args, file_args) for file_args in files_args]
+
+    if pool is not None:
+        results = list(pool.imap_unordered(_load_file, jobs))
+
+    elif num_workers > 1 and len(jobs) > 1:
+        if not isinstance(threading.current_thread(), threading._MainThread):
+            raise RuntimeError('Worker processes can only be forked from the main thread, pass a pool created there')
+
+        pool = multiprocessing.Pool(processes=num_workers)
+        try:
+            results = list(pool.imap_unordered(_load_file, jobs))
+            pool.close()
+        finally:
+            pool.terminate()
+            pool.join()
+    else:
+        results = [_load_file(job) for job in jobs]
+
+    failures = [(file_args, error) for file_args, error in results if error is not None]
+
+    for file_args, error in failures:
+        logging.error('Failed to load %s\n%s', _get_file_name(file_args), error)
+
+    if failures:
+        raise FileLoadError(failures)
+
+
+def _load_file(job):
+    '''
+    Loads one file, returns its arguments and the formatted exception if
+    the load failed
+    '''
+    loader_class, loader_args, file_args = job
+
+    try:
+        loader = loader_class(**loader_args)
+        loader.load_file(**file_args)
+    except Exception:
+        return file_args, traceback.format_exc()
+
+    logging.info('Loaded %s', _get_file_name(file_args))
+    return file_args, None
+
+
+def _get_file_name(file_args):
+    if file_args.get('subpath') is not None:
+        return '%s:%s' % (file_args['analysis_file'], file_args['subpath'])
+
+    return file_args['analysis_file']
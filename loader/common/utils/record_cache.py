@@ -0,0 +1,123 @@
+'''
+Local cache for transformed index records
+
+Records are stored as gzipped JSON lines, in one file per key. The key is
+a hash of the input file contents plus any other values that affect the
+output. The cache is kept under a maximum size by evicting the least
+recently used entries. The loaders only cache records when given a
+cache directory.
+
+'''
+
+import os
+import gzip
+import json
+import hashlib
+import logging
+
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'lyra-loader')
+
+DEFAULT_MAX_SIZE = 2 * 1024 ** 3
+
+HASH_BLOCK_SIZE = 1 << 20
+
+
+class RecordCache(object):
+
+    ''' Class RecordCache '''
+
+    def __init__(self, cache_dir=None, max_size=None):
+        self.cache_dir = cache_dir if cache_dir is not None else DEFAULT_CACHE_DIR
+        self.max_size = max_size if max_size is not None else DEFAULT_MAX_SIZE
+
+        if not os.path.isdir(self.cache_dir):
+            os.makedirs(self.cache_dir)
+
+    def get_key(self, files=(), values=()):
+        '''
+        Returns the cache key for the given input files (hashed by content)
+        and values (hashed by their repr). Missing files are given as None.
+        '''
+        key_hash = hashlib.sha1()
+
+        for file_path in files:
+            key_hash.update('file:')
+            if file_path is not None:
+                with open(file_path, 'rb') as file_in:
+                    for block in iter(lambda: file_in.read(HASH_BLOCK_SIZE), b''):
+                        key_hash.update(block)
+            key_hash.update('\0')
+
+        for value in values:
+            key_hash.update('value:%r\0' % (value,))
+
+        return key_hash.hexdigest()
+
+    def get(self, key):
+        '''
+        Returns an iterator over the records cached under key, or None on a
+        cache miss
+        '''
+        cache_path = self._get_path(key)
+
+        if not os.path.exists(cache_path):
+            return None
+
+        # the modification time doubles as the last access time for eviction
+        os.utime(cache_path, None)
+        return self._read_records(cache_path)
+
+    def put(self, key, records):
+        '''
+        Passes records through while writing them to the cache. The entry
+        only becomes visible once all records have been consumed.
+        '''
+        cache_path = self._get_path(key)
+        temp_path = '%s.%d.tmp' % (cache_path, os.getpid())
+
+        try:
+            with gzip.open(temp_path, 'wb') as cache_out:
+                for record in records:
+                    cache_out.write(json.dumps(record) + '\n')
+                    yield record
+
+        except BaseException:
+            os.remove(temp_path)
+            raise
+
+        os.rename(temp_path, cache_path)
+        logging.info('Cached records under key %s', key)
+        self._evict(keep=cache_path)
+
+    def _get_path(self, key):
+        return os.path.join(self.cache_dir, key + '.json.gz')
+
+    def _read_records(self, cache_path):
+        with gzip.open(cache_path, 'rb') as cache_in:
+            for line in cache_in:
+                yield json.loads(line)
+
+    def _evict(self, keep=None):
+        '''
+        Removes the least recently used entries until the cache fits within
+        max_size, never removing keep
+        '''
+        entries = []
+
+        for file_name in os.listdir(self.cache_dir):
+            if file_name.endswith('.json.gz'):
+                cache_path = os.path.join(self.cache_dir, file_name)
+                file_stat = os.stat(cache_path)
+                entries.append((file_stat.st_mtime, file_stat.st_size, cache_path))
+
+        total_size = sum(size for _, size, _ in entries)
+
+        for _, size, cache_path in sorted(entries):
+            if total_size <= self.max_size:
+                break
+
+            if cache_path != keep:
+                logging.info('Evicting cache entry %s', cache_path)
+                os.remove(cache_path)
+                total_size -= size
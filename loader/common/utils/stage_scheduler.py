@@ -0,0 +1,133 @@
+'''
+Runs the stages of a load concurrently, in the order their dependencies allow
+
+Each stage runs in its own thread as soon as the stages it depends on have
+finished, with at most max_workers stages running at once. A stage gets the
+results of its dependencies as arguments. When a stage fails, the stages
+that depend on it are skipped and the others keep running.
+
+Stages must not fork, since a child forked from a thread inherits the
+locks the other stages hold at that moment. Worker processes are created
+before run() and handed to the stages.
+
+'''
+
+import time
+import Queue
+import logging
+import threading
+import traceback
+
+
+# how often the scheduler wakes up while waiting, so it can be interrupted
+POLL_SECONDS = 1
+
+
+class StageError(Exception):
+
+    ''' Raised when one or more stages failed '''
+
+    def __init__(self, failures, skipped):
+        self.failures = failures
+        self.skipped = skipped
+        message = 'Stage(s) failed: %s' % ', '.join(sorted(failures))
+        if skipped:
+            message += '; skipped: %s' % ', '.join(sorted(skipped))
+        super(StageError, self).__init__(message)
+
+
+class StageScheduler(object):
+
+    ''' Class StageScheduler '''
+
+    def __init__(self, max_workers=None):
+        '''
+        max_workers: number of stages to run at once, all ready stages if None
+        '''
+        self.max_workers = max_workers
+        self.stage_names = []
+        self.stages = {}
+
+    def add_stage(self, name, stage_fn, depends_on=None):
+        '''
+        Adds a stage that calls stage_fn with the results of the stages in
+        depends_on, which have to be added first. Ready stages are started
+        in the order they were added.
+        '''
+        depends_on = list(depends_on) if depends_on is not None else []
+
+        if name in self.stages:
+            raise ValueError('Stage %s was already added' % name)
+
+        for dependency in depends_on:
+            if dependency not in self.stages:
+                raise ValueError('Stage %s depends on unknown stage %s' % (name, dependency))
+
+        self.stage_names.append(name)
+        self.stages[name] = (stage_fn, depends_on)
+
+    def run(self):
+        '''
+        Runs all stages and returns their results by name. Raises StageError
+        once the stages that could run have finished, if any of them failed.
+        '''
+        results = {}
+        failures = {}
+        skipped = set()
+        pending = list(self.stage_names)
+        running = set()
+        finished = Queue.Queue()
+        max_workers = self.max_workers or len(self.stage_names)
+
+        while pending or running:
+            for name in list(pending):
+                stage_fn, depends_on = self.stages[name]
+
+                if any(dependency in failures or dependency in skipped for dependency in depends_on):
+                    logging.warn('Skipping stage %s, a stage it depends on did not finish', name)
+                    pending.remove(name)
+                    skipped.add(name)
+
+                elif len(running) < max_workers and all(dependency in results for dependency in depends_on):
+                    pending.remove(name)
+                    running.add(name)
+                    self._start_stage(name, stage_fn, [results[dependency] for dependency in depends_on], finished)
+
+            if not running:
+                break
+
+            try:
+                name, result, error = finished.get(timeout=POLL_SECONDS)
+            except Queue.Empty:
+                continue
+
+            running.remove(name)
+
+            if error is None:
+                results[name] = result
+            else:
+                logging.error('Stage %s failed\n%s', name, error)
+                failures[name] = error
+
+        if failures:
+            raise StageError(failures, skipped)
+
+        return results
+
+    def _start_stage(self, name, stage_fn, args, finished):
+        def run_stage():
+            start_time = time.time()
+            logging.info('Starting stage %s', name)
+
+            try:
+                result = stage_fn(*args)
+            except Exception:
+                finished.put((name, None, traceback.format_exc()))
+                return
+
+            logging.info('Finished stage %s in %.1fs', name, time.time() - start_time)
+            finished.put((name, result, None))
+
+        thread = threading.Thread(target=run_stage, name=name)
+        thread.daemon = True
+        thread.start()
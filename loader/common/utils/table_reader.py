@@ -0,0 +1,310 @@
+'''
+Readers for the tabular inputs of the segs, bins and metrics loaders
+
+CSV files are parsed with the loader's dtypes and only the columns it keeps,
+so unused columns are skipped and no types are inferred. HDF5 stores are
+always opened in a with block, so their handles are closed
+as soon as a read is done, or once a chunked read is consumed or dropped.
+
+Parquet, Arrow IPC and Feather files are memory mapped and read without
+parsing, only the needed columns and one row group or record batch at a
+time. Feather V1 files have no record batches, so they are read whole and
+sliced. They require pyarrow.
+
+'''
+
+import numpy as np
+import pandas as pd
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+    import pyarrow.feather
+except ImportError:
+    pyarrow = None
+
+
+PARQUET_EXTENSIONS = ('.parquet', '.pq')
+
+# Arrow IPC and Feather files, read by read_arrow_table and read_arrow_chunks
+ARROW_EXTENSIONS = ('.arrow', '.feather')
+
+# Feather V1 is not an Arrow IPC file, it is read with pyarrow.feather
+FEATHER_EXTENSIONS = ('.feather',)
+
+# rows per data frame of the chunked readers
+DEFAULT_CHUNK_SIZE = 100000
+
+
+def read_table(table_file, subpath=None, columns=None, csv_dtypes=None):
+    '''
+    Reads the given columns of a csv, h5, Parquet, Arrow IPC or Feather
+    file, with the reader for its extension. subpath is the key of the
+    table in h5 files, csv_dtypes the column types of csv files.
+    '''
+    if table_file.endswith('.csv'):
+        return read_csv_table(table_file, columns, csv_dtypes)
+
+    elif table_file.endswith('.h5'):
+        return read_hdf_table(table_file, subpath, columns)
+
+    elif table_file.endswith(PARQUET_EXTENSIONS):
+        return read_parquet_table(table_file, columns)
+
+    elif table_file.endswith(ARROW_EXTENSIONS):
+        return read_arrow_table(table_file, columns)
+
+    raise ValueError('Unsupported file format: %s' % table_file)
+
+
+def read_table_chunks(table_file, subpath=None, columns=None, csv_dtypes=None, chunksize=DEFAULT_CHUNK_SIZE):
+    '''
+    Yields the given columns of a file read_table can read, as data frames
+    of up to chunksize rows
+    '''
+    if table_file.endswith('.csv'):
+        # without a chunksize read_csv returns the whole table
+        chunks = read_csv_table(table_file, columns, csv_dtypes, chunksize) if chunksize else [read_csv_table(table_file, columns, csv_dtypes)]
+
+    elif table_file.endswith('.h5'):
+        chunks = read_hdf_chunks(table_file, subpath, columns, chunksize)
+
+    elif table_file.endswith(PARQUET_EXTENSIONS):
+        chunks = read_parquet_chunks(table_file, columns, chunksize)
+
+    elif table_file.endswith(ARROW_EXTENSIONS):
+        chunks = read_arrow_chunks(table_file, columns, chunksize)
+
+    else:
+        raise ValueError('Unsupported file format: %s' % table_file)
+
+    for chunk in chunks:
+        yield chunk
+
+
+def is_grouped_by(table_file, column, subpath=None, csv_dtypes=None, chunksize=DEFAULT_CHUNK_SIZE):
+    '''
+    Returns whether the rows of each value of column are all next to each
+    other, reading only that column chunksize rows at a time
+    '''
+    seen_values = set()
+    last_value = None
+
+    for chunk in read_table_chunks(table_file, subpath, [column], csv_dtypes, chunksize):
+        values = chunk[column].values
+        if len(values) == 0:
+            continue
+
+        # first value of each run of equal values
+        run_values = values[np.r_[0, np.flatnonzero(values[1:] != values[:-1]) + 1]].tolist()
+        if run_values[0] == last_value:
+            run_values = run_values[1:]
+
+        new_values = set(run_values)
+        if len(new_values) < len(run_values) or not seen_values.isdisjoint(new_values):
+            return False
+
+        seen_values.update(new_values)
+        last_value = values[-1]
+
+    return True
+
+
+def read_csv_table(csv_file, columns=None, dtypes=None, chunksize=None):
+    '''
+    Reads the given columns of the csv file, or all of them if None, with
+    the given dtypes. Columns the file does not have are skipped. Returns
+    a reader of data frames of up to chunksize rows if chunksize is given.
+    '''
+    usecols = set(columns).__contains__ if columns is not None else None
+
+    return pd.read_csv(csv_file, usecols=usecols, dtype=dtypes, chunksize=chunksize)
+
+
+def read_hdf_table(hdf_file, key, columns=None):
+    '''
+    Reads the table at key, only the given columns if the store is in
+    table format
+    '''
+    with pd.HDFStore(hdf_file, 'r') as hdf:
+        storer = hdf.get_storer(key)
+
+        if storer.is_table:
+            return hdf.select(key, columns=_get_table_columns(storer, columns))
+
+        return hdf.get(key)
+
+
+def read_hdf_chunks(hdf_file, key, columns=None, chunksize=None):
+    '''
+    Yields the table at key as data frames of up to chunksize rows, read by
+    row range. Only the given columns are read if the store is in table
+    format, fixed format stores can only be read a row range at a time.
+    '''
+    with pd.HDFStore(hdf_file, 'r') as hdf:
+        storer = hdf.get_storer(key)
+
+        if storer.is_table:
+            num_rows = storer.nrows
+            columns = _get_table_columns(storer, columns)
+        else:
+            num_rows = storer.shape[0]
+            columns = None
+
+        if not chunksize:
+            chunksize = max(num_rows, 1)
+
+        for start in xrange(0, num_rows, chunksize):
+            yield hdf.select(key, start=start, stop=start + chunksize, columns=columns)
+
+
+def read_parquet_table(parquet_file, columns=None):
+    '''
+    Reads the given columns of the Parquet file, or all of them if None
+    '''
+    with _memory_map(parquet_file) as source:
+        parquet = pyarrow.parquet.ParquetFile(source)
+        columns = _get_arrow_columns(parquet.schema.names, columns)
+
+        return parquet.read(columns=columns).to_pandas()
+
+
+def read_parquet_chunks(parquet_file, columns=None, chunksize=None):
+    '''
+    Yields the given columns of the Parquet file a row group at a time, as
+    data frames of up to chunksize rows
+    '''
+    with _memory_map(parquet_file) as source:
+        parquet = pyarrow.parquet.ParquetFile(source)
+        columns = _get_arrow_columns(parquet.schema.names, columns)
+
+        for index in xrange(parquet.num_row_groups):
+            for chunk in _slice_frames(parquet.read_row_group(index, columns=columns), chunksize):
+                yield chunk
+
+
+def read_arrow_table(arrow_file, columns=None):
+    '''
+    Reads the given columns of the Arrow IPC or Feather file, or all of them
+    if None
+    '''
+    if arrow_file.endswith(FEATHER_EXTENSIONS):
+        return read_feather_table(arrow_file, columns)
+
+    with _memory_map(arrow_file) as source:
+        reader = pyarrow.ipc.open_file(source)
+        columns = _get_arrow_columns(reader.schema.names, columns)
+        batches = list(_get_arrow_batches(reader, columns))
+
+        if not batches:
+            return pd.DataFrame(columns=reader.schema.names if columns is None else columns)
+
+        return pyarrow.Table.from_batches(batches).to_pandas()
+
+
+def read_arrow_chunks(arrow_file, columns=None, chunksize=None):
+    '''
+    Yields the given columns of the Arrow IPC file a record batch at a
+    time, as data frames of up to chunksize rows. Feather files are read
+    with read_feather_chunks.
+    '''
+    if arrow_file.endswith(FEATHER_EXTENSIONS):
+        for chunk in read_feather_chunks(arrow_file, columns, chunksize):
+            yield chunk
+        return
+
+    with _memory_map(arrow_file) as source:
+        reader = pyarrow.ipc.open_file(source)
+        columns = _get_arrow_columns(reader.schema.names, columns)
+
+        for batch in _get_arrow_batches(reader, columns):
+            for chunk in _slice_frames(batch, chunksize):
+                yield chunk
+
+
+def _get_arrow_batches(reader, columns):
+    '''
+    Yields the record batches of the Arrow IPC file reader, with only the
+    given columns if not None
+    '''
+    names = reader.schema.names
+
+    for index in xrange(reader.num_record_batches):
+        batch = reader.get_batch(index)
+
+        if columns is not None:
+            batch = pyarrow.RecordBatch.from_arrays([batch.column(names.index(column)) for column in columns], columns)
+
+        yield batch
+
+
+def read_feather_table(feather_file, columns=None):
+    '''
+    Reads the given columns of the Feather file, or all of them if None
+    '''
+    with _memory_map(feather_file) as source:
+        return _read_feather(source, columns).to_pandas()
+
+
+def read_feather_chunks(feather_file, columns=None, chunksize=None):
+    '''
+    Yields the given columns of the Feather file as data frames of up to
+    chunksize rows
+    '''
+    with _memory_map(feather_file) as source:
+        for chunk in _slice_frames(_read_feather(source, columns), chunksize):
+            yield chunk
+
+
+def _read_feather(source, columns):
+    ''' Reads only the given columns of the Feather file, or all of them if None '''
+    reader = pyarrow.feather.FeatherReader(source)
+    names = [reader.get_column_name(index) for index in xrange(reader.num_columns)]
+    columns = _get_arrow_columns(names, columns)
+    table = reader.read_table(columns=columns)
+
+    if columns is None:
+        return table
+
+    # the columns are read in file order, put them back in the requested one
+    return pyarrow.Table.from_arrays([table.column(table.schema.names.index(column)) for column in columns], names=columns)
+
+
+def _memory_map(arrow_file):
+    if pyarrow is None:
+        raise ImportError('Reading Parquet and Arrow files requires pyarrow')
+
+    return pyarrow.memory_map(arrow_file, 'r')
+
+
+def _slice_frames(table, chunksize):
+    '''
+    Yields an Arrow table or record batch as data frames of up to chunksize
+    rows, only converting one of them at a time
+    '''
+    if not chunksize:
+        yield table.to_pandas()
+        return
+
+    for start in xrange(0, table.num_rows, chunksize):
+        yield table.slice(start, chunksize).to_pandas()
+
+
+def _get_arrow_columns(names, columns):
+    ''' Returns the given columns that the file has '''
+    if columns is None:
+        return None
+
+    return [column for column in columns if column in names]
+
+
+def _get_table_columns(storer, columns):
+    '''
+    Returns the given columns that the table has, so that missing ones end
+    up as empty columns like they would for a full read
+    '''
+    if columns is None:
+        return None
+
+    table_columns = set(storer.non_index_axes[0][1])
+    return [column for column in columns if column in table_columns]
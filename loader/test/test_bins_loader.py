@@ -0,0 +1,217 @@
+import pytest
+import pandas as pd
+import common.bins_loader
+from common.bins_loader import BinsLoader, get_pyramid_bins
+
+
+BINS_CSV = '''chr,start,end,width,reads,copy,state,integer_copy_number,cell_id
+1,1,500000,500000,10,2.1,2,2,CELL1
+1,500001,1000000,500000,12,1.9,2,2,CELL1
+2,1,500000,500000,8,3.0,3,3,CELL1
+X,1,500000,500000,4,1.0,1,1,CELL1
+23,500001,1000000,500000,5,1.1,1,1,CELL1
+'''
+
+
+@pytest.fixture
+def bins_loader(mocker):
+    mocker.patch('common.utils.es_utils.ElasticSearchTools')
+    bins_loader = BinsLoader(es_doc_type="test_doc_type", es_index="test_index", es_host="http://localhost", es_port="9200")
+    bins_loader.es_tools = mocker.MagicMock()
+    return bins_loader
+
+@pytest.fixture
+def bins_file(tmpdir):
+    bins_file = tmpdir.join('bins.csv')
+    bins_file.write(BINS_CSV)
+    return str(bins_file)
+
+
+def test_transform_data(bins_loader, bins_file):
+    data = bins_loader._transform_data(bins_loader._read_file(bins_file, None))
+
+    assert list(data.columns) == bins_loader.__fields__
+    assert list(data['chrom_number']) == ['01', '01', '02', 'X', 'X']
+
+def test_load_file_chunked(bins_loader, bins_file):
+    bins_loader.load_file(analysis_file=bins_file)
+    [[data], _] = bins_loader.es_tools.submit_data_to_es.call_args
+    records = data.to_dict(orient='records')
+
+    bins_loader.es_tools.submit_data_to_es.reset_mock()
+    bins_loader.load_file(analysis_file=bins_file, chunksize=2)
+    chunks = [call[0][0] for call in bins_loader.es_tools.submit_data_to_es.call_args_list]
+
+    assert len(chunks) == 3
+    assert [record for chunk in chunks for record in chunk.to_dict(orient='records')] == records
+
+def test_read_file_schema(bins_loader, bins_file):
+    data = bins_loader._read_file(bins_file, None)
+
+    assert 'integer_copy_number' not in data.columns
+    assert data['chr'].dtype == object
+    assert data['start'].dtype == 'int64'
+    # nullable integer columns are declared as floats
+    assert data['state'].dtype == 'float64'
+    assert data['reads'].dtype == 'float64'
+    assert data['copy'].dtype == 'float64'
+
+def test_transform_data_dtypes(bins_loader, bins_file):
+    data = bins_loader._read_file(bins_file, None)
+    data['state'] = data['state'].astype(float)
+    data = bins_loader._transform_data(data)
+
+    assert data['state'].dtype == 'int64'
+    assert data['copy'].dtype == 'float64'
+
+def test_read_file_missing_values(bins_loader, tmpdir):
+    bins_file = tmpdir.join('bins.csv')
+    bins_file.write(BINS_CSV.replace('1,500001,1000000,500000,12,1.9,2,2,CELL1', '1,500001,1000000,500000,,1.9,,,CELL1'))
+
+    data = bins_loader._read_file(str(bins_file), None)
+
+    assert data['state'].isnull().tolist() == [False, True, False, False, False]
+    assert data['reads'].isnull().sum() == 1
+    assert data['state'].dropna().tolist() == [2, 3, 1, 1]
+
+def test_load_file_parquet(bins_loader, bins_file, tmpdir):
+    pyarrow = pytest.importorskip('pyarrow')
+    import pyarrow.parquet
+
+    parquet_file = str(tmpdir.join('bins.parquet'))
+    pyarrow.parquet.write_table(pyarrow.Table.from_pandas(pd.read_csv(bins_file, dtype={'chr': str}), preserve_index=False), parquet_file)
+
+    bins_loader.load_file(analysis_file=bins_file)
+    [[data], _] = bins_loader.es_tools.submit_data_to_es.call_args
+
+    bins_loader.es_tools.submit_data_to_es.reset_mock()
+    bins_loader.load_file(analysis_file=parquet_file, chunksize=2)
+    chunks = [call[0][0] for call in bins_loader.es_tools.submit_data_to_es.call_args_list]
+
+    assert len(chunks) == 3
+    assert pd.concat(chunks, ignore_index=True).equals(data)
+
+def test_get_mappings(bins_loader):
+    bins_loader.es_tools.get_doc_type.return_value = 'test_doc_type'
+    mappings = bins_loader.get_mappings()['mappings']['test_doc_type']
+
+    assert mappings['dynamic'] is False
+    assert sorted(mappings['properties']) == sorted(bins_loader.__fields__)
+    assert mappings['properties']['reads']['index'] is False
+    # the defaults are kept
+    assert mappings['_size'] == {'enabled': True}
+
+def test_create_index_sort(bins_loader):
+    bins_loader.es_tools.get_doc_type.return_value = 'test_doc_type'
+    bins_loader.create_index()
+
+    [_, kwargs] = bins_loader.es_tools.create_index.call_args
+    assert kwargs['index_sort'] == [('cell_id', 'asc'), ('chrom_number', 'asc'), ('start', 'asc')]
+    # sort fields need doc values
+    mappings = bins_loader.get_mappings()['mappings']['test_doc_type']['properties']
+    assert all(mappings[field].get('doc_values', True) for field, _ in kwargs['index_sort'])
+
+def test_get_pyramid_bins():
+    data = pd.DataFrame({
+        'cell_id': ['CELL1'] * 4 + ['CELL2'],
+        'chrom_number': ['01'] * 5,
+        'start': [1, 500001, 1000001, 1500001, 1],
+        'end': [500000, 1000000, 1500000, 2000000, 500000],
+        'state': [3, 2, 2, 3, 4],
+        'copy': [3.0, 2.0, None, 3.0, 4.0]
+    })
+
+    pyramid = get_pyramid_bins([data], bin_sizes=[1000000, 0])
+    cell1 = pyramid[pyramid['cell_id'] == 'CELL1']
+
+    assert list(cell1['bin_size']) == [0, 1000000, 1000000]
+    assert list(cell1['start']) == [1, 1, 1000001]
+    assert list(cell1['end']) == [2000000, 1000000, 2000000]
+    # ties go to the lowest state
+    assert list(cell1['state']) == [2, 2, 2]
+    assert list(cell1['copy']) == [8.0 / 3, 2.5, 3.0]
+    assert list(cell1['num_bins']) == [4, 2, 2]
+
+    chunked = get_pyramid_bins([data.iloc[:1], data.iloc[1:3], data.iloc[3:]], bin_sizes=[1000000, 0])
+    pd.testing.assert_frame_equal(chunked, pyramid)
+
+def test_load_file_pyramid(mocker, bins_file):
+    mocker.patch('common.utils.es_utils.ElasticSearchTools')
+    bins_loader = BinsLoader(es_doc_type="test_doc_type", es_index="test_index", es_host="http://localhost", es_port="9200", pyramid_index="test_pyramid")
+    bins_loader.es_tools = mocker.MagicMock()
+    pyramid_loader = bins_loader.pyramid_loader
+    pyramid_loader.es_tools = mocker.MagicMock()
+    pyramid_loader.es_tools.exists_index.return_value = False
+    pyramid_loader.es_tools.get_doc_type.return_value = 'test_doc_type'
+
+    read_file_chunks = mocker.spy(bins_loader, '_read_file_chunks')
+    bins_loader.load_file(analysis_file=bins_file, chunksize=2)
+
+    # the bins and the pyramid levels come from a single read of the file
+    assert read_file_chunks.call_count == 1
+    chunks = [call[0][0] for call in bins_loader.es_tools.submit_data_to_es.call_args_list]
+    assert sum(len(chunk) for chunk in chunks) == 5
+
+    [_, kwargs] = pyramid_loader.es_tools.create_index.call_args
+    assert kwargs['index_sort'][0] == ('bin_size', 'asc')
+
+    levels = [call[0][0] for call in pyramid_loader.es_tools.submit_data_to_es.call_args_list]
+    data = pd.concat(levels, ignore_index=True).sort_values(['bin_size', 'cell_id', 'chrom_number', 'start']).reset_index(drop=True)
+    assert sorted(data['bin_size'].unique()) == [0, 1000000, 5000000, 20000000]
+    # the two bins of chromosome 1 are merged from the 1Mb level up
+    assert list(data[data['chrom_number'] == '01']['num_bins']) == [2, 2, 2, 2]
+    assert data.equals(get_pyramid_bins(chunks))
+
+def test_load_file_pyramid_ungrouped(mocker, tmpdir):
+    bins_file = tmpdir.join('bins.csv')
+    bins_file.write(BINS_CSV + '1,1,500000,500000,10,2.1,2,2,CELL2\n2,1,500000,500000,9,2.0,2,2,CELL1\n')
+
+    mocker.patch('common.utils.es_utils.ElasticSearchTools')
+    bins_loader = BinsLoader(es_doc_type="test_doc_type", es_index="test_index", es_host="http://localhost", es_port="9200", pyramid_index="test_pyramid")
+    bins_loader.es_tools = mocker.MagicMock()
+    bins_loader.pyramid_loader.es_tools = mocker.MagicMock()
+
+    # checked before anything is indexed, the whole file is loaded at once
+    bins_loader.load_file(analysis_file=str(bins_file), chunksize=2)
+
+    assert bins_loader.es_tools.submit_data_to_es.call_count == 1
+    data = pd.concat([call[0][0] for call in bins_loader.pyramid_loader.es_tools.submit_data_to_es.call_args_list])
+    assert sorted(data['cell_id'].unique()) == ['CELL1', 'CELL2']
+    assert data[(data['cell_id'] == 'CELL1') & (data['bin_size'] == 0)]['num_bins'].sum() == 6
+
+def test_get_pyramid_bins_bounded(mocker):
+    data = pd.DataFrame({
+        'cell_id': ['CELL%03d' % (row // 60) for row in range(6000)],
+        'chrom_number': ['01'] * 6000,
+        'start': [(row % 60) * 500000 + 1 for row in range(6000)],
+        'end': [(row % 60 + 1) * 500000 for row in range(6000)],
+        'state': [row % 3 for row in range(6000)],
+        'copy': [float(row % 5) for row in range(6000)]
+    })
+    get_pyramid_levels = mocker.spy(common.bins_loader, '_get_pyramid_levels')
+
+    chunked = get_pyramid_bins((data.iloc[start:start + 600] for start in range(0, 6000, 600)), bin_sizes=[1000000, 0])
+
+    # each chunk writes out the cells it finished, and only the counts of
+    # the last cell are held back until the next one
+    held_cells = [call[0][0]['cell_id'].nunique() for call in get_pyramid_levels.call_args_list]
+    assert len(held_cells) == 11
+    assert max(held_cells) <= 10
+    assert chunked.equals(get_pyramid_bins([data], bin_sizes=[1000000, 0]))
+
+def test_get_pyramid_bins_ungrouped():
+    data = pd.DataFrame({
+        'cell_id': ['CELL1', 'CELL2', 'CELL1'],
+        'chrom_number': ['01'] * 3,
+        'start': [1, 1, 500001],
+        'end': [500000, 500000, 1000000],
+        'state': [2, 2, 2],
+        'copy': [2.0, 2.0, 2.0]
+    })
+
+    with pytest.raises(ValueError) as error:
+        get_pyramid_bins([data.iloc[:2], data.iloc[2:]])
+    assert 'not grouped together' in str(error.value)
+
+    # a single chunk is grouped as a whole
+    assert len(get_pyramid_bins([data])) == 2 * len(common.bins_loader.PYRAMID_BIN_SIZES)
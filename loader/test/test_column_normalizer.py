@@ -0,0 +1,60 @@
+import pytest
+import numpy as np
+import pandas as pd
+from common.utils.column_normalizer import ColumnNormalizer, format_chrom_number, format_chrom_numbers
+
+
+def test_format_chrom_number():
+    assert format_chrom_number(1) == '01'
+    assert format_chrom_number('12') == '12'
+    assert format_chrom_number('23') == 'X'
+    assert format_chrom_number(24) == 'Y'
+    assert format_chrom_number('x') == 'X'
+    assert format_chrom_number('MT') == 'MT'
+
+def test_format_chrom_numbers():
+    chrom_numbers = pd.Series(['1', 2, 'x', '23', np.nan, '1'], index=[5, 6, 7, 8, 9, 10])
+    formatted = format_chrom_numbers(chrom_numbers)
+
+    assert list(formatted.index) == [5, 6, 7, 8, 9, 10]
+    assert list(formatted[:4]) + list(formatted[5:]) == ['01', '02', 'X', 'X', '01']
+    assert pd.isnull(formatted[9])
+
+def test_normalize():
+    data = pd.DataFrame({
+        'chr': ['1', 'Y'],
+        'start': [1, 2],
+        'integer_copy_number': [2, 3],
+        'extra': ['a', 'b']
+    })
+    normalizer = ColumnNormalizer(
+        field_mapping={'chr': 'chrom_number', 'integer_copy_number': 'copy_number'},
+        fields=['chrom_number', 'start', 'copy_number'],
+        dtypes={'start': float, 'missing': int}
+    )
+    data = normalizer.normalize(data)
+
+    assert list(data.columns) == ['chrom_number', 'start', 'copy_number']
+    assert list(data['chrom_number']) == ['01', 'Y']
+    assert data['start'].dtype == np.float64
+
+def test_normalize_missing_integers():
+    data = pd.DataFrame({'start': [1.0, 2.0], 'state': [2.0, np.nan]})
+    data = ColumnNormalizer(dtypes={'start': 'int64', 'state': 'int64'}).normalize(data)
+
+    assert data['start'].dtype == np.int64
+    # missing values are kept, to be indexed as null
+    assert data['state'].dtype == np.float64
+    assert data['state'].isnull().tolist() == [False, True]
+
+def test_normalize_all_fields():
+    data = pd.DataFrame({'chr': ['1'], 'cell_id': ['CELL1']})
+    data = ColumnNormalizer({'chr': 'chrom_number'}).normalize(data)
+
+    assert sorted(data.columns) == ['cell_id', 'chrom_number']
+
+def test_get_input_columns():
+    normalizer = ColumnNormalizer({'chr': 'chrom_number', 'integer_copy_number': 'copy_number'}, ['chrom_number', 'start'])
+
+    assert normalizer.get_input_columns() == ['chrom_number', 'chr', 'start']
+    assert ColumnNormalizer({'chr': 'chrom_number'}).get_input_columns() is None
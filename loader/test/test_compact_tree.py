@@ -0,0 +1,48 @@
+import pytest
+import networkx as nx
+from common.compact_tree import CompactTree
+
+
+EDGES = [
+    ('LOCI1', 'CELL2'),
+    ('LOCI1', 'CELL3'),
+    ('ROOT', 'CELL1'),
+    ('ROOT', 'LOCI1'),
+    ('ROOT', 'CELL4')
+]
+
+
+def test_from_edges():
+    tree = CompactTree.from_edges(EDGES)
+
+    assert len(tree) == 6
+    assert tree.names[tree.root] == 'ROOT'
+    assert tree.get_child_names(tree.root) == ['CELL1', 'LOCI1', 'CELL4']
+    assert tree.get_child_names(tree.node_id('LOCI1')) == ['CELL2', 'CELL3']
+    assert tree.is_leaf(tree.node_id('CELL1'))
+    assert tree.parents[tree.node_id('CELL2')] == tree.node_id('LOCI1')
+
+def test_from_edges_multiple_parents():
+    with pytest.raises(ValueError):
+        CompactTree.from_edges(EDGES + [('CELL1', 'CELL2')])
+
+def test_preorder():
+    tree = CompactTree.from_edges(EDGES)
+    preorder = [tree.names[node] for node in tree.preorder()]
+
+    assert preorder == ['ROOT', 'CELL1', 'LOCI1', 'CELL2', 'CELL3', 'CELL4']
+
+def test_with_child_order():
+    tree = CompactTree.from_edges(EDGES)
+    ordered_tree = tree.with_child_order(key=lambda node: tree.num_children(node))
+
+    assert ordered_tree.get_child_names(ordered_tree.root) == ['CELL1', 'CELL4', 'LOCI1']
+    assert tree.get_child_names(tree.root) == ['CELL1', 'LOCI1', 'CELL4']
+
+def test_networkx_round_trip():
+    graph = nx.DiGraph()
+    graph.add_edges_from(EDGES)
+    tree = CompactTree.from_networkx(graph)
+
+    assert list(tree.to_networkx().edges()) == list(graph.edges())
+    assert list(tree.to_networkx().successors('ROOT')) == ['CELL1', 'LOCI1', 'CELL4']
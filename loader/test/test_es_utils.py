@@ -0,0 +1,138 @@
+import json
+import time
+import threading
+import pytest
+import numpy as np
+import pandas as pd
+from elasticsearch import helpers
+from common.utils.es_utils import ElasticSearchTools, encode_bulk_bodies
+
+
+DATA = pd.DataFrame({
+    'cell_id': ['CELL1', 'CELL2', None],
+    'chrom_number': ['01', 'X', '02'],
+    'state': [2, 3, 4],
+    'copy': [1.5, np.nan, 0.1234567891234],
+    'note': ['line\nbreak', u'caf\xe9', 'x']
+})
+
+
+def _parse_bodies(bodies):
+    lines = [json.loads(line) for body in bodies for line in body.splitlines()]
+    assert all(action == {'index': {}} for action in lines[::2])
+    return lines[1::2]
+
+
+def test_encode_bulk_bodies():
+    bodies = list(encode_bulk_bodies(DATA, chunk_size=2))
+
+    assert len(bodies) == 2
+    assert all(body.endswith('\n') for body in bodies)
+    assert _parse_bodies(bodies) == DATA.where(pd.notnull(DATA), None).to_dict(orient='records')
+
+def test_encode_bulk_bodies_empty():
+    assert list(encode_bulk_bodies(DATA.iloc[:0])) == []
+
+def test_submit_frame_to_es(mocker):
+    es_tools = ElasticSearchTools('test_doc_type', 'test_index')
+    es_tools.es = mocker.MagicMock()
+    es_tools.es.bulk.side_effect = lambda body, **kwargs: {
+        'items': [{'index': {'status': 201}}] * (body.count('\n') // 2)
+    }
+
+    assert es_tools.submit_data_to_es(DATA) == (3, [])
+    assert es_tools.es.bulk.call_count == 1
+    assert es_tools.es.bulk.call_args[1]['index'] == 'test_index'
+
+def test_submit_frame_to_es_errors(mocker):
+    es_tools = ElasticSearchTools('test_doc_type', 'test_index')
+    es_tools.es = mocker.MagicMock()
+    es_tools.es.bulk.return_value = {
+        'items': [{'index': {'status': 201}}, {'index': {'status': 400, 'error': 'bad'}}]
+    }
+
+    with pytest.raises(helpers.BulkIndexError):
+        es_tools.submit_frame_to_es(DATA, chunk_size=2)
+
+    assert es_tools.es.bulk.call_count == 1
+
+def test_submit_frame_to_es_parallel(mocker):
+    es_tools = ElasticSearchTools('test_doc_type', 'test_index')
+    es_tools.set_bulk_options(workers=3, chunk_size=10)
+    es_tools.es = mocker.MagicMock()
+
+    lock = threading.Lock()
+    in_flight = [0]
+    max_in_flight = [0]
+    # the first request waits for a second one, so they overlap however the threads are scheduled
+    overlapped = threading.Event()
+
+    def bulk(body, **kwargs):
+        with lock:
+            in_flight[0] += 1
+            max_in_flight[0] = max(max_in_flight[0], in_flight[0])
+            if in_flight[0] > 1:
+                overlapped.set()
+        overlapped.wait(5)
+        time.sleep(0.001)
+        with lock:
+            in_flight[0] -= 1
+        return {'items': [{'index': {'status': 201}}] * (body.count('\n') // 2)}
+
+    es_tools.es.bulk.side_effect = bulk
+    data = pd.DataFrame({'start': range(95)})
+
+    assert es_tools.submit_data_to_es(data) == (95, [])
+    assert es_tools.es.bulk.call_count == 10
+    assert 1 < max_in_flight[0] <= 3
+
+def test_submit_frame_to_es_parallel_failure(mocker):
+    es_tools = ElasticSearchTools('test_doc_type', 'test_index')
+    es_tools.set_bulk_options(workers=2, chunk_size=1)
+    es_tools.es = mocker.MagicMock()
+    es_tools.es.bulk.side_effect = ValueError('connection lost')
+
+    with pytest.raises(ValueError):
+        es_tools.submit_frame_to_es(pd.DataFrame({'start': range(50)}))
+
+    assert es_tools.es.bulk.call_count < 50
+
+def test_submit_records_parallel(mocker):
+    es_tools = ElasticSearchTools('test_doc_type', 'test_index')
+    es_tools.set_bulk_options(workers=2, chunk_size=10)
+    parallel_bulk = mocker.patch('elasticsearch.helpers.parallel_bulk', return_value=iter([(True, {})] * 25))
+
+    records = ({'cell_id': 'CELL%d' % index} for index in range(25))
+    assert es_tools.submit_data_to_es(records) == (25, [])
+    assert parallel_bulk.call_args[1]['thread_count'] == 2
+    assert parallel_bulk.call_args[1]['chunk_size'] == 10
+
+def test_get_write_capacity(mocker):
+    es_tools = ElasticSearchTools('test_doc_type', 'test_index')
+    es_tools.es = mocker.MagicMock()
+    es_tools.es.nodes.info.return_value = {'nodes': {
+        'node1': {'thread_pool': {'write': {'type': 'fixed', 'size': 4}}},
+        'node2': {'thread_pool': {'bulk': {'type': 'fixed', 'size': 8}}}
+    }}
+
+    assert es_tools.get_write_capacity() == 12
+
+    es_tools.es.nodes.info.side_effect = Exception('Forbidden')
+    assert es_tools.get_write_capacity() is None
+
+def test_create_index_sort(mocker):
+    es_tools = ElasticSearchTools('test_doc_type', 'test_index')
+    es_tools.es = mocker.MagicMock()
+    es_tools.es.cluster.health.return_value = {'number_of_data_nodes': 2}
+
+    es_tools.create_index({'mappings': {}}, index_sort=[('cell_id', 'asc'), ('start', 'desc')])
+
+    [_, kwargs] = es_tools.es.indices.create.call_args
+    index_settings = kwargs['body']['settings']['index']
+    assert index_settings['sort.field'] == ['cell_id', 'start']
+    assert index_settings['sort.order'] == ['asc', 'desc']
+
+    es_tools.create_index({'mappings': {}})
+
+    [_, kwargs] = es_tools.es.indices.create.call_args
+    assert 'sort.field' not in kwargs['body']['settings']['index']
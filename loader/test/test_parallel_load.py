@@ -0,0 +1,96 @@
+import os
+import threading
+import multiprocessing
+import pytest
+from common.utils.parallel_load import FileLoadError, get_num_workers, load_files_parallel
+
+
+class FakeLoader(object):
+
+    def __init__(self, out_dir=None):
+        self.out_dir = out_dir
+
+    def load_file(self, analysis_file=None, subpath=None):
+        if analysis_file == 'bad.csv':
+            raise ValueError('Cannot parse %s' % analysis_file)
+
+        with open(os.path.join(self.out_dir, analysis_file), 'w') as out:
+            out.write(str(os.getpid()))
+
+
+@pytest.mark.parametrize('num_workers', [1, 3])
+def test_load_files_parallel(tmpdir, num_workers):
+    files_args = [{'analysis_file': 'file%d.csv' % index} for index in range(6)]
+
+    load_files_parallel(FakeLoader, {'out_dir': str(tmpdir)}, files_args, num_workers)
+
+    assert sorted(os.listdir(str(tmpdir))) == sorted(file_args['analysis_file'] for file_args in files_args)
+
+def test_load_files_parallel_failures(tmpdir):
+    files_args = [{'analysis_file': 'file0.csv'}, {'analysis_file': 'bad.csv', 'subpath': '/bins'}, {'analysis_file': 'file1.csv'}]
+
+    with pytest.raises(FileLoadError) as error:
+        load_files_parallel(FakeLoader, {'out_dir': str(tmpdir)}, files_args, 2)
+
+    [(file_args, trace)] = error.value.failures
+    assert file_args == {'analysis_file': 'bad.csv', 'subpath': '/bins'}
+    assert 'Cannot parse bad.csv' in trace
+    assert 'bad.csv:/bins' in str(error.value)
+    assert sorted(os.listdir(str(tmpdir))) == ['file0.csv', 'file1.csv']
+
+def test_load_files_parallel_pool(tmpdir):
+    files_args = [{'analysis_file': 'file%d.csv' % index} for index in range(6)]
+    pool = multiprocessing.Pool(processes=2)
+    errors = []
+
+    # the pool is forked by the main thread, and used from another one
+    def load():
+        try:
+            load_files_parallel(FakeLoader, {'out_dir': str(tmpdir)}, files_args, pool=pool)
+        except Exception as error:
+            errors.append(error)
+
+    try:
+        thread = threading.Thread(target=load)
+        thread.start()
+        thread.join()
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
+
+    assert errors == []
+    assert sorted(os.listdir(str(tmpdir))) == sorted(file_args['analysis_file'] for file_args in files_args)
+    assert str(os.getpid()) not in set(tmpdir.join(file_args['analysis_file']).read() for file_args in files_args)
+
+def test_load_files_parallel_off_main_thread(tmpdir):
+    files_args = [{'analysis_file': 'file%d.csv' % index} for index in range(2)]
+    errors = []
+
+    def load():
+        try:
+            load_files_parallel(FakeLoader, {'out_dir': str(tmpdir)}, files_args, 2)
+        except Exception as error:
+            errors.append(error)
+
+    thread = threading.Thread(target=load)
+    thread.start()
+    thread.join()
+
+    assert [type(error) for error in errors] == [RuntimeError]
+    assert os.listdir(str(tmpdir)) == []
+
+def test_get_num_workers(mocker):
+    mocker.patch('multiprocessing.cpu_count', return_value=8)
+    es_tools = mocker.MagicMock(bulk_workers=2)
+
+    es_tools.get_write_capacity.return_value = None
+    assert get_num_workers(es_tools, 20) == 8
+    assert get_num_workers(es_tools, 3) == 3
+    assert get_num_workers(es_tools, 20, max_workers=4) == 4
+
+    es_tools.get_write_capacity.return_value = 10
+    assert get_num_workers(es_tools, 20) == 5
+
+    es_tools.get_write_capacity.return_value = 1
+    assert get_num_workers(es_tools, 20) == 1
@@ -0,0 +1,45 @@
+import os
+import pytest
+from common.utils.record_cache import RecordCache
+
+
+RECORDS = [{'cell_id': 'CELL1', 'min_index': 0}, {'cell_id': 'CELL2', 'min_index': 1}]
+
+
+def test_get_key(tmpdir):
+    record_cache = RecordCache(str(tmpdir.join('cache')))
+    input_file = tmpdir.join('tree.newick')
+    input_file.write('(A,B)root;')
+
+    key = record_cache.get_key(files=[str(input_file), None], values=['ROOT'])
+    assert key == record_cache.get_key(files=[str(input_file), None], values=['ROOT'])
+    assert key != record_cache.get_key(files=[str(input_file), None], values=[None])
+
+    input_file.write('(A,C)root;')
+    assert key != record_cache.get_key(files=[str(input_file), None], values=['ROOT'])
+
+def test_put_and_get(tmpdir):
+    record_cache = RecordCache(str(tmpdir))
+
+    assert record_cache.get('abc') is None
+    assert list(record_cache.put('abc', iter(RECORDS))) == RECORDS
+    assert list(record_cache.get('abc')) == RECORDS
+
+def test_put_not_consumed(tmpdir):
+    record_cache = RecordCache(str(tmpdir))
+
+    records = record_cache.put('abc', iter(RECORDS))
+    next(records)
+    records.close()
+
+    assert record_cache.get('abc') is None
+    assert os.listdir(str(tmpdir)) == []
+
+def test_evict_least_recently_used(tmpdir):
+    record_cache = RecordCache(str(tmpdir), max_size=1)
+
+    list(record_cache.put('abc', iter(RECORDS)))
+    list(record_cache.put('def', iter(RECORDS)))
+
+    assert record_cache.get('abc') is None
+    assert list(record_cache.get('def')) == RECORDS
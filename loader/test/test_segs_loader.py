@@ -1,7 +1,7 @@
 import pytest
 import mock
 import pandas as pd
-from common.segs_loader import SegsLoader
+from common.segs_loader import SegsLoader, pack_segs
 
 CSV_FILE = '../example/segs_data.csv'
 H5_FILE = '../example/segs_data.h5'
@@ -51,6 +51,73 @@ def test_load_segs_table(segs_loader):
     segs_loader.es_tools.exists_index.assert_called_once_with()
     segs_loader.es_tools.submit_data_to_es.assert_called_once_with(data)
 
+def test_load_file_chunked(segs_loader, mocker):
+    segs_loader.es_tools = mocker.MagicMock()
+    segs_loader.load_file(analysis_file=CSV_FILE)
+    [[data], _] = segs_loader.es_tools.submit_data_to_es.call_args
+    records = data.to_dict(orient='records')
+
+    segs_loader.es_tools.submit_data_to_es.reset_mock()
+    segs_loader.load_file(analysis_file=CSV_FILE, chunksize=10)
+    chunks = [call[0][0] for call in segs_loader.es_tools.submit_data_to_es.call_args_list]
+
+    assert len(chunks) == 8
+    assert all(len(chunk) <= 10 for chunk in chunks)
+    assert [record for chunk in chunks for record in chunk.to_dict(orient='records')] == records
+
+def test_pack_segs():
+    data = pd.DataFrame({
+        'cell_id': ['CELL2', 'CELL1', 'CELL2', 'CELL1'],
+        'chrom_number': ['01', '02', '01', '01'],
+        'start': [50, 1, 1, 1],
+        'end': [100, 10, 49, 10],
+        'state': [3, 2, 1, 4]
+    })
+    packed = pack_segs(data)
+
+    assert packed.to_dict(orient='records') == [
+        {'cell_id': 'CELL1', 'chrom_number': ['01', '02'], 'start': [1, 1], 'end': [10, 10], 'state': [4, 2]},
+        {'cell_id': 'CELL2', 'chrom_number': ['01', '01'], 'start': [1, 50], 'end': [49, 100], 'state': [1, 3]}
+    ]
+    assert len(pack_segs(data.iloc[:0])) == 0
+
+def test_load_file_packed(segs_loader, mocker):
+    segs_loader.es_tools = mocker.MagicMock()
+    segs_loader.load_file(analysis_file=CSV_FILE)
+    [[data], _] = segs_loader.es_tools.submit_data_to_es.call_args
+
+    packed_loader = SegsLoader(es_doc_type="test_doc_type", es_index="test_index", es_host="http://localhost", es_port="9200", packed=True)
+    packed_loader.es_tools = mocker.MagicMock()
+    packed_loader.es_tools.get_doc_type.return_value = 'test_doc_type'
+    packed_loader.es_tools.exists_index.return_value = False
+    packed_loader.load_file(analysis_file=CSV_FILE, chunksize=10)
+    chunks = [call[0][0] for call in packed_loader.es_tools.submit_data_to_es.call_args_list]
+    packed = pd.concat(chunks, ignore_index=True)
+
+    # one document per cell, even for cells that span chunks
+    assert sorted(packed['cell_id']) == sorted(data['cell_id'].unique())
+    assert pack_segs(data).to_dict(orient='records') == packed.sort_values('cell_id').to_dict(orient='records')
+
+    [_, kwargs] = packed_loader.es_tools.create_index.call_args
+    assert kwargs['index_sort'] == [('cell_id', 'asc')]
+    assert packed_loader.get_mappings()['mappings']['test_doc_type']['properties']['start']['index'] is False
+    assert packed_loader.get_mappings()['mappings']['test_doc_type']['_meta'] == {'layout': 'packed'}
+
+def test_load_file_packed_ungrouped(mocker, tmpdir):
+    # sorted by chromosome, so every cell comes back in each chunk
+    data = pd.read_csv(CSV_FILE, dtype={'chr': str}).sort_values(['chr', 'start', 'cell_id'])
+    segs_file = str(tmpdir.join('segs.csv'))
+    data.to_csv(segs_file, index=False)
+
+    packed_loader = SegsLoader(es_doc_type="test_doc_type", es_index="test_index", es_host="http://localhost", es_port="9200", packed=True)
+    packed_loader.es_tools = mocker.MagicMock()
+
+    # checked before anything is indexed, the whole file is packed at once
+    packed_loader.load_file(analysis_file=segs_file, chunksize=10)
+    [[packed], _] = packed_loader.es_tools.submit_data_to_es.call_args
+    assert packed_loader.es_tools.submit_data_to_es.call_count == 1
+    assert sorted(packed['cell_id']) == sorted(data['cell_id'].unique())
+
 HOST = 'localhost'
 PORT = 9200
 
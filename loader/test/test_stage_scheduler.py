@@ -0,0 +1,75 @@
+import time
+import threading
+import pytest
+from common.utils.stage_scheduler import StageScheduler, StageError
+
+
+def test_run_dependencies():
+    calls = []
+    scheduler = StageScheduler()
+    scheduler.add_stage('a', lambda: calls.append('a') or 1)
+    scheduler.add_stage('b', lambda a: calls.append('b') or a + 1, depends_on=['a'])
+    scheduler.add_stage('c', lambda: calls.append('c') or 10)
+    scheduler.add_stage('d', lambda b, c: calls.append('d') or b + c, depends_on=['b', 'c'])
+
+    assert scheduler.run() == {'a': 1, 'b': 2, 'c': 10, 'd': 12}
+    assert calls.index('a') < calls.index('b') < calls.index('d')
+    assert calls.index('c') < calls.index('d')
+
+def test_run_concurrently():
+    # each stage only sees the other's event if both run at once
+    events = {'a': threading.Event(), 'b': threading.Event()}
+
+    def stage(name, other_name):
+        events[name].set()
+        events[other_name].wait(5)
+        return events[other_name].is_set()
+
+    scheduler = StageScheduler()
+    scheduler.add_stage('a', lambda: stage('a', 'b'))
+    scheduler.add_stage('b', lambda: stage('b', 'a'))
+
+    assert scheduler.run() == {'a': True, 'b': True}
+
+def test_run_max_workers():
+    running = []
+    max_running = []
+
+    def stage():
+        running.append(1)
+        max_running.append(len(running))
+        time.sleep(0.02)
+        running.pop()
+
+    scheduler = StageScheduler(max_workers=1)
+    for name in ['a', 'b', 'c']:
+        scheduler.add_stage(name, stage)
+    scheduler.run()
+
+    assert max(max_running) == 1
+
+def test_run_failure():
+    calls = []
+
+    def fail():
+        raise ValueError('Bad bins')
+
+    scheduler = StageScheduler()
+    scheduler.add_stage('bins', fail)
+    scheduler.add_stage('normalization', lambda _: calls.append('normalization'), depends_on=['bins'])
+    scheduler.add_stage('entry', lambda _: calls.append('entry'), depends_on=['normalization'])
+    scheduler.add_stage('segs', lambda: calls.append('segs'))
+
+    with pytest.raises(StageError) as error:
+        scheduler.run()
+
+    assert calls == ['segs']
+    assert list(error.value.failures) == ['bins']
+    assert 'Bad bins' in error.value.failures['bins']
+    assert error.value.skipped == set(['normalization', 'entry'])
+
+def test_add_stage_unknown_dependency():
+    scheduler = StageScheduler()
+
+    with pytest.raises(ValueError):
+        scheduler.add_stage('a', lambda b: None, depends_on=['b'])
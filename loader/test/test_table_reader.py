@@ -0,0 +1,160 @@
+import pytest
+import pandas as pd
+from common.utils.table_reader import read_csv_table, read_hdf_table, read_hdf_chunks
+from common.utils.table_reader import read_parquet_table, read_parquet_chunks, read_arrow_table, read_arrow_chunks
+from common.utils.table_reader import read_table, read_table_chunks, is_grouped_by
+
+
+CSV_FILE = '../example/segs_data.csv'
+H5_FILE = '../example/segs_data.h5'
+H5_SUBPATH = '/example/seg/path'
+
+
+@pytest.fixture
+def fixed_file(tmpdir):
+    fixed_file = str(tmpdir.join('fixed.h5'))
+    pd.read_hdf(H5_FILE, H5_SUBPATH).to_hdf(fixed_file, 'segs', format='fixed')
+    return fixed_file
+
+
+def test_read_csv_table_columns():
+    data = read_csv_table(CSV_FILE, ['chr', 'start', 'state', 'missing'], {'chr': str, 'state': 'float64', 'missing': 'int64'})
+
+    assert sorted(data.columns) == ['chr', 'start', 'state']
+    assert data['chr'].dtype == object and data['chr'][0] == '1'
+    assert data['state'].dtype == 'float64'
+    assert len(data) == 74
+
+def test_read_csv_table_chunks():
+    chunks = list(read_csv_table(CSV_FILE, ['cell_id'], chunksize=20))
+
+    assert [len(chunk) for chunk in chunks] == [20, 20, 20, 14]
+    assert all(list(chunk.columns) == ['cell_id'] for chunk in chunks)
+
+@pytest.mark.filterwarnings("ignore:numpy.dtype size changed")
+def test_read_table():
+    columns = ['cell_id', 'state']
+
+    assert read_table(CSV_FILE, columns=columns).equals(read_csv_table(CSV_FILE, columns))
+    assert read_table(H5_FILE, H5_SUBPATH, columns).equals(read_hdf_table(H5_FILE, H5_SUBPATH, columns))
+    assert [len(chunk) for chunk in read_table_chunks(CSV_FILE, columns=columns, chunksize=20)] == [20, 20, 20, 14]
+
+    with pytest.raises(ValueError):
+        read_table('segs_data.txt')
+    with pytest.raises(ValueError):
+        list(read_table_chunks('segs_data.txt'))
+
+def test_is_grouped_by(tmpdir):
+    data = pd.read_csv(CSV_FILE, dtype={'chr': str})
+    sorted_file = str(tmpdir.join('sorted.csv'))
+    data.sort_values(['cell_id', 'chr', 'start'], kind='mergesort').to_csv(sorted_file, index=False)
+    ungrouped_file = str(tmpdir.join('ungrouped.csv'))
+    data.sort_values(['chr', 'start', 'cell_id'], kind='mergesort').to_csv(ungrouped_file, index=False)
+
+    # runs of a cell may span chunks
+    assert is_grouped_by(sorted_file, 'cell_id', chunksize=7)
+    assert not is_grouped_by(ungrouped_file, 'cell_id', chunksize=7)
+    assert not is_grouped_by(ungrouped_file, 'cell_id', chunksize=None)
+
+@pytest.mark.filterwarnings("ignore:numpy.dtype size changed")
+def test_read_hdf_table_columns(mocker):
+    close = mocker.spy(pd.HDFStore, 'close')
+    data = read_hdf_table(H5_FILE, H5_SUBPATH, ['chr', 'start', 'missing'])
+
+    assert list(data.columns) == ['chr', 'start']
+    assert len(data) == 74
+    assert close.call_count == 1
+
+@pytest.mark.filterwarnings("ignore:numpy.dtype size changed")
+def test_read_hdf_chunks(mocker):
+    close = mocker.spy(pd.HDFStore, 'close')
+    chunks = list(read_hdf_chunks(H5_FILE, H5_SUBPATH, ['cell_id', 'state'], chunksize=20))
+
+    assert [len(chunk) for chunk in chunks] == [20, 20, 20, 14]
+    assert all(list(chunk.columns) == ['cell_id', 'state'] for chunk in chunks)
+    assert pd.concat(chunks).equals(read_hdf_table(H5_FILE, H5_SUBPATH, ['cell_id', 'state']))
+    assert close.call_count == 2
+
+@pytest.mark.filterwarnings("ignore:numpy.dtype size changed")
+def test_read_hdf_chunks_closed_early(mocker):
+    close = mocker.spy(pd.HDFStore, 'close')
+    chunks = read_hdf_chunks(H5_FILE, H5_SUBPATH, chunksize=20)
+    next(chunks)
+    chunks.close()
+
+    assert close.call_count == 1
+
+@pytest.mark.filterwarnings("ignore:numpy.dtype size changed")
+def test_read_hdf_fixed(fixed_file):
+    data = read_hdf_table(fixed_file, 'segs', ['chr'])
+    chunks = list(read_hdf_chunks(fixed_file, 'segs', ['chr'], chunksize=50))
+
+    assert len(data.columns) == 8
+    assert [len(chunk) for chunk in chunks] == [50, 24]
+    assert pd.concat(chunks).equals(data)
+
+@pytest.fixture
+def segs_data():
+    return pd.read_csv(CSV_FILE, dtype={'chr': str})
+
+@pytest.fixture
+def parquet_file(tmpdir, segs_data):
+    pyarrow = pytest.importorskip('pyarrow')
+    import pyarrow.parquet
+
+    parquet_file = str(tmpdir.join('segs.parquet'))
+    pyarrow.parquet.write_table(pyarrow.Table.from_pandas(segs_data, preserve_index=False), parquet_file, row_group_size=30)
+    return parquet_file
+
+@pytest.fixture
+def arrow_file(tmpdir, segs_data):
+    pyarrow = pytest.importorskip('pyarrow')
+
+    arrow_file = str(tmpdir.join('segs.arrow'))
+    table = pyarrow.Table.from_pandas(segs_data, preserve_index=False)
+    writer = pyarrow.RecordBatchFileWriter(arrow_file, table.schema)
+    for batch in table.to_batches(30):
+        writer.write_batch(batch)
+    writer.close()
+    return arrow_file
+
+@pytest.fixture
+def feather_file(tmpdir, segs_data):
+    pytest.importorskip('pyarrow')
+    import pyarrow.feather
+
+    feather_file = str(tmpdir.join('segs.feather'))
+    pyarrow.feather.write_feather(segs_data, feather_file)
+    return feather_file
+
+
+def test_read_parquet_table(parquet_file, segs_data):
+    data = read_parquet_table(parquet_file, ['cell_id', 'state', 'missing'])
+
+    assert data.equals(segs_data[['cell_id', 'state']])
+
+def test_read_parquet_chunks(parquet_file, segs_data):
+    chunks = list(read_parquet_chunks(parquet_file, ['cell_id', 'state'], chunksize=20))
+
+    # row groups of 30, 30 and 14 rows
+    assert [len(chunk) for chunk in chunks] == [20, 10, 20, 10, 14]
+    assert pd.concat(chunks, ignore_index=True).equals(segs_data[['cell_id', 'state']])
+
+def test_read_arrow_table(arrow_file, segs_data):
+    data = read_arrow_table(arrow_file, ['state', 'chr'])
+
+    assert data.equals(segs_data[['state', 'chr']])
+
+def test_read_arrow_chunks(arrow_file, segs_data):
+    chunks = list(read_arrow_chunks(arrow_file, chunksize=None))
+
+    assert [len(chunk) for chunk in chunks] == [30, 30, 14]
+    assert pd.concat(chunks, ignore_index=True).equals(segs_data)
+
+def test_read_feather(feather_file, segs_data):
+    data = read_arrow_table(feather_file, ['state', 'chr', 'missing'])
+    chunks = list(read_arrow_chunks(feather_file, ['state', 'chr'], chunksize=30))
+
+    assert data.equals(segs_data[['state', 'chr']])
+    assert [len(chunk) for chunk in chunks] == [30, 30, 14]
+    assert pd.concat(chunks, ignore_index=True).equals(data)
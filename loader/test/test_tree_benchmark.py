@@ -0,0 +1,20 @@
+import pytest
+from benchmarks.tree_benchmark import SHAPES, FORMATS, get_tree_parents, write_tree, run_case
+
+
+@pytest.mark.parametrize('shape', SHAPES)
+def test_get_tree_parents(shape):
+    parents = get_tree_parents(shape, 101)
+
+    assert len(parents) == 101
+    assert [node for node, parent in enumerate(parents) if parent == -1] == [0]
+    assert all(parent < node for node, parent in enumerate(parents) if parent != -1)
+
+@pytest.mark.parametrize('tree_format', FORMATS)
+def test_run_case(tree_format, tmpdir):
+    tree_path = str(tmpdir.join('tree.' + tree_format))
+    parents = get_tree_parents('coalescent', 51)
+    write_tree(tree_format, tree_path, parents)
+
+    results = run_case(tree_format, tree_path, len(parents))
+    assert [result['stage'] for result in results] == ['_get_rooted_tree', '_get_tree_ordering', 'streamed load', '_transform_data', '_load_tree_data']
@@ -0,0 +1,58 @@
+import pytest
+from common.tree_loader import TreeLoader
+from common.tree_index import TreeIndex
+
+
+COMPRESS_NEWICK_FILE = '../example/tree_compress_data.newick'
+
+
+@pytest.fixture
+def tree_index(mocker):
+    mocker.patch('common.utils.es_utils.ElasticSearchTools')
+    tree_loader = TreeLoader(es_doc_type="test_doc_type", es_index="test_index", es_host="http://localhost", es_port="9200")
+    return TreeIndex.from_records(tree_loader._get_records(COMPRESS_NEWICK_FILE))
+
+
+def test_from_records(tree_index):
+    assert len(tree_index) == 6
+    assert tree_index.names[0] == 'root'
+    assert len(tree_index.euler_tour) == 2 * len(tree_index) - 1
+    assert tree_index.euler_tour[0] == tree_index.euler_tour[-1] == 0
+
+def test_get_lca(tree_index):
+    assert tree_index.get_lca(['CELL2', 'CELL3']) == 'LOCI2'
+    assert tree_index.get_lca(['CELL1', 'CELL3']) == 'root'
+    assert tree_index.get_lca(['CELL2', 'LOCI2']) == 'LOCI2'
+    assert tree_index.get_lca(['CELL4']) == 'CELL4'
+
+def test_get_ancestors(tree_index):
+    assert tree_index.get_ancestors('CELL2') == ['LOCI2', 'root']
+    assert tree_index.get_ancestors('root') == []
+
+def test_is_in_clade(tree_index):
+    assert tree_index.is_in_clade('CELL3', 'LOCI2')
+    assert tree_index.is_in_clade('LOCI2', 'LOCI2')
+    assert not tree_index.is_in_clade('CELL1', 'LOCI2')
+
+def test_save_and_load(tree_index, tmpdir):
+    index_file = str(tmpdir.join('tree_index.npz'))
+    tree_index.save(index_file)
+    loaded_index = TreeIndex.load(index_file)
+
+    assert loaded_index.names == tree_index.names
+    assert loaded_index.get_lca(['CELL2', 'CELL3']) == 'LOCI2'
+
+def test_load_file_tree_index(tree_index, mocker, tmpdir):
+    tree_loader = TreeLoader(es_doc_type="test_doc_type", es_index="test_index", es_host="http://localhost", es_port="9200")
+    tree_loader.es_tools = mocker.MagicMock()
+    tree_loader.es_tools.submit_data_to_es.side_effect = list
+    extract_file_to_data = mocker.spy(tree_loader, '_extract_file_to_data')
+
+    index_file = str(tmpdir.join('tree_index.npz'))
+    tree_loader.load_file(analysis_file=COMPRESS_NEWICK_FILE, tree_index_file=index_file)
+
+    # built from the records that are indexed, the tree is read once
+    assert extract_file_to_data.call_count == 1
+    loaded_index = TreeIndex.load(index_file)
+    assert loaded_index.names == tree_index.names
+    assert list(loaded_index.euler_tour) == list(tree_index.euler_tour)
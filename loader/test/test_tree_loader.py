@@ -1,7 +1,11 @@
 import pytest
 import mock
+import types
 import networkx as nx
 from common.tree_loader import TreeLoader
+from common.compact_tree import CompactTree
+from common.preprocessor import Preprocessor
+from common.tree_lod import get_lod_records
 
 @pytest.fixture
 def tree_loader(mocker):
@@ -22,18 +26,37 @@ TREE_ORDER_FILE = '../example/tree_order_data.tsv'
 
 def test_get_rooted_tree_newick(tree_loader):
     tree = tree_loader._get_rooted_tree(NEWICK_FILE)
-    assert isinstance(tree, nx.DiGraph)
-    assert len(list(tree.nodes)) == 6
+    assert isinstance(tree, CompactTree)
+    assert len(tree) == 6
 
 def test_get_rooted_tree_rooted_gml(tree_loader):
     tree = tree_loader._get_rooted_tree(ROOTED_GML_FILE)
-    assert isinstance(tree, nx.Graph)
-    assert len(list(tree.nodes)) == 6
+    assert isinstance(tree, CompactTree)
+    assert len(tree) == 6
+    assert tree.names[tree.root] == "ROOT"
 
 def test_get_rooted_tree_unrooted_gml(tree_loader):
-    tree = tree_loader._get_rooted_tree(analysis_file=ROOTED_GML_FILE, root_id="ROOT")
-    assert isinstance(tree, nx.Graph)
-    assert len(list(tree.nodes)) == 6
+    tree = tree_loader._get_rooted_tree(analysis_file=UNROOTED_GML_FILE, root_id="ROOT")
+    assert isinstance(tree, CompactTree)
+    assert len(tree) == 6
+    assert tree.names[tree.root] == "ROOT"
+    assert tree.names[tree.parents[tree.node_id("CELL2")]] == "LOCI1"
+
+def test_get_rooted_tree_unrooted_gml_preprocessed(tree_loader, tmpdir):
+    gml_file = tmpdir.join('tree.gml')
+    gml_file.write(open(UNROOTED_GML_FILE).read().replace('"CELL', '"cell_CELL').replace('"ROOT"', '"cell_ROOT"'))
+
+    tree = tree_loader._get_rooted_tree(analysis_file=str(gml_file), root_id="cell_ROOT", preprocessor=Preprocessor(str(gml_file)))
+    assert tree.names[tree.root] == "ROOT"
+    assert tree.names[tree.parents[tree.node_id("CELL2")]] == "LOCI1"
+
+def test_get_rooted_tree_edges(tree_loader, tmpdir):
+    edges_file = tmpdir.join('tree_edges.csv')
+    edges_file.write('source,target\nROOT,CELL1\nROOT,LOCI1\n LOCI1 , CELL2 \n')
+
+    tree = tree_loader._get_rooted_tree(tree_edges=str(edges_file))
+    assert tree.names[tree.root] == "ROOT"
+    assert tree.get_child_names(tree.node_id("LOCI1")) == ["CELL2"]
 
 def test_get_tree_root(tree_loader):
     tree = tree_loader._get_rooted_tree(NEWICK_FILE)
@@ -45,45 +68,129 @@ def test_get_tree_ordering_by_descendents(tree_loader):
     tree_root = tree_loader._get_tree_root(tree)
     tree_ordering = tree_loader._get_tree_ordering(tree=tree, tree_root=tree_root)
 
-    assert tree_ordering[tree_root] == ['CELL1','CELL4','LOCI1']
-    assert len(tree_ordering['LOCI1']) == len(['CELL2', 'CELL3'])
-    assert 'CELL1' not in tree_ordering
+    assert tree_ordering.get_child_names(tree_ordering.node_id(tree_root)) == ['CELL1','CELL4','LOCI1']
+    assert tree_ordering.num_children(tree_ordering.node_id('LOCI1')) == len(['CELL2', 'CELL3'])
+    assert tree_ordering.is_leaf(tree_ordering.node_id('CELL1'))
+
+def test_get_tree_ordering_deep_tree(tree_loader):
+    tree = nx.DiGraph()
+    for depth in range(5000):
+        tree.add_edge('LOCI%d' % depth, 'LOCI%d' % (depth + 1))
+        tree.add_edge('LOCI%d' % depth, 'CELL%d' % depth)
+    tree = CompactTree.from_networkx(tree)
+    tree_ordering = tree_loader._get_tree_ordering(tree=tree, tree_root='LOCI0')
+
+    assert tree_ordering.get_child_names(tree_ordering.node_id('LOCI0')) == ['CELL0', 'LOCI1']
+    assert tree_ordering.get_child_names(tree_ordering.node_id('LOCI4998')) == ['CELL4998', 'LOCI4999']
+    assert len([node for node in range(len(tree_ordering)) if not tree_ordering.is_leaf(node)]) == 5000
+
+def test_get_subtree_sizes(tree_loader):
+    tree = tree_loader._get_rooted_tree(NEWICK_FILE)
+    subtree_sizes = tree_loader._get_subtree_sizes(tree, tree.root)
+
+    assert subtree_sizes[tree.node_id('root')] == 6
+    assert subtree_sizes[tree.node_id('LOCI1')] == 3
+    assert subtree_sizes[tree.node_id('CELL1')] == 1
 
 def test_get_tree_ordering_by_file(tree_loader):
     tree_ordering = tree_loader._get_tree_ordering(TREE_ORDER_FILE)
 
-    assert tree_ordering['ROOT'] == ['CELL1','CELL4','LOCI1']
-    assert len(tree_ordering['LOCI1']) == len(['CELL2', 'CELL3'])
-    assert 'CELL1' not in tree_ordering
+    assert tree_ordering.get_child_names(tree_ordering.node_id('ROOT')) == ['CELL1','CELL4','LOCI1']
+    assert tree_ordering.num_children(tree_ordering.node_id('LOCI1')) == len(['CELL2', 'CELL3'])
+    assert tree_ordering.is_leaf(tree_ordering.node_id('CELL1'))
 
 
 def test_transform_data(tree_loader):
     [tree, tree_root, tree_ordering] = tree_loader._extract_file_to_data(NEWICK_FILE)
-    data = tree_loader._transform_data(tree, tree_root, tree_ordering)
-    assert isinstance(data, list)
+    data = list(tree_loader._transform_data(tree, tree_root, tree_ordering))
     assert len(data) == 6
 
 
 def test_transform_data_with_compression(tree_loader):
     [tree, tree_root, tree_ordering] = tree_loader._extract_file_to_data(COMPRESS_NEWICK_FILE)
-    data = tree_loader._transform_data(tree, tree_root, tree_ordering)
-    assert isinstance(data, list)
+    data = list(tree_loader._transform_data(tree, tree_root, tree_ordering))
     assert len(data) == 6
 
 
-def test_merge_if_child_is_single_internal_node_will_merge(tree_loader):
+def test_transform_data_is_lazy(tree_loader):
+    [tree, tree_root, tree_ordering] = tree_loader._extract_file_to_data(NEWICK_FILE)
+    data = tree_loader._transform_data(tree, tree_root, tree_ordering)
+    assert isinstance(data, types.GeneratorType)
+
+    root_record = next(data)
+    assert root_record['cell_id'] == 'root'
+    assert root_record['children'] == ['CELL1', 'CELL4', 'LOCI1']
+
+
+def test_transform_data_child_summaries(tree_loader):
     [tree, tree_root, tree_ordering] = tree_loader._extract_file_to_data(COMPRESS_NEWICK_FILE)
-    (node, new_tree_ordering) = tree_loader._merge_if_child_is_single_internal_node('LOCI2', tree_ordering)
-    assert node == 'LOCI2, LOCI1'
-    assert node in new_tree_ordering
-    assert new_tree_ordering[node] == tree_ordering['LOCI1']
+    data = list(tree_loader._transform_data(tree, tree_root, tree_ordering))
+    records = dict((record['unmerged_id'], record) for record in data)
+
+    for record in data:
+        assert [summary['unmerged_id'] for summary in record['child_summaries']] == record['children']
+
+        for summary in record['child_summaries']:
+            child_record = records[summary['unmerged_id']]
+            for field in ['cell_id', 'min_index', 'max_index', 'max_height']:
+                assert summary[field] == child_record[field]
+
+    assert records['root']['child_summaries'][2]['cell_id'] == 'LOCI2, LOCI1'
+    assert records['CELL1']['child_summaries'] == []
+
+
+def test_get_records_cached(mocker, tmpdir):
+    mocker.patch('common.utils.es_utils.ElasticSearchTools')
+    tree_loader = TreeLoader(es_doc_type="test_doc_type", es_index="test_index", es_host="http://localhost", es_port="9200", cache_dir=str(tmpdir))
+    data = list(tree_loader._get_records(COMPRESS_NEWICK_FILE))
+
+    mocker.spy(tree_loader, '_transform_data')
+    assert list(tree_loader._get_records(COMPRESS_NEWICK_FILE)) == data
+    assert tree_loader._transform_data.call_count == 0
+
+    list(tree_loader._get_records(NEWICK_FILE))
+    assert tree_loader._transform_data.call_count == 1
+
+
+def test_annotate_tree(tree_loader):
+    [tree, tree_root, tree_ordering] = tree_loader._extract_file_to_data(NEWICK_FILE)
+    annotations = tree_loader._annotate_tree(tree_ordering.node_id(tree_root), tree_ordering)
 
-def test_merge_if_child_is_single_internal_node_will_not_merge(tree_loader):
+    def get_annotation(name):
+        node = tree_ordering.node_id(name)
+        return dict((key, annotations[key][node]) for key in annotations)
+
+    assert get_annotation('root') == {'max_height': 2, 'num_leafs': 4, 'min_index': 0, 'max_index': 3}
+    assert get_annotation('LOCI1') == {'max_height': 1, 'num_leafs': 2, 'min_index': 2, 'max_index': 3}
+    assert get_annotation('CELL1') == {'max_height': 0, 'num_leafs': 1, 'min_index': 0, 'max_index': 0}
+
+
+def test_collapse_unary_chains_will_merge(tree_loader):
     [tree, tree_root, tree_ordering] = tree_loader._extract_file_to_data(COMPRESS_NEWICK_FILE)
-    (node, new_tree_ordering) = tree_loader._merge_if_child_is_single_internal_node('LOCI1', tree_ordering)
-    assert node == 'LOCI1'
-    assert node in new_tree_ordering
-    assert new_tree_ordering[node] == tree_ordering['LOCI1']
+    (chain_ends, merged_ids) = tree_loader._collapse_unary_chains(tree_ordering.root, tree_ordering)
+    node = tree_ordering.node_id('LOCI2')
+    assert merged_ids[node] == 'LOCI2, LOCI1'
+    assert chain_ends[node] == tree_ordering.node_id('LOCI1')
+
+def test_collapse_unary_chains_will_not_merge(tree_loader):
+    [tree, tree_root, tree_ordering] = tree_loader._extract_file_to_data(NEWICK_FILE)
+    (chain_ends, merged_ids) = tree_loader._collapse_unary_chains(tree_ordering.root, tree_ordering)
+    node = tree_ordering.node_id('LOCI1')
+    assert merged_ids == {}
+    assert chain_ends[node] == node
+
+def test_collapse_unary_chains_long_chain(tree_loader):
+    edges = [('LOCI%d' % depth, 'LOCI%d' % (depth + 1)) for depth in range(5000)]
+    tree_ordering = CompactTree.from_edges(edges + [('LOCI5000', 'CELL1'), ('LOCI5000', 'CELL2')])
+    (chain_ends, merged_ids) = tree_loader._collapse_unary_chains(tree_ordering.root, tree_ordering)
+
+    assert merged_ids.keys() == [tree_ordering.root]
+    assert merged_ids[tree_ordering.root] == ", ".join('LOCI%d' % depth for depth in range(5001))
+    assert chain_ends[tree_ordering.root] == tree_ordering.node_id('LOCI5000')
+
+    data = list(tree_loader._transform_data(tree_ordering, 'LOCI0', tree_ordering))
+    assert len(data) == 3
+    assert data[1]['parent'] == merged_ids[tree_ordering.root]
 
 def test_create_index_record_leaf(tree_loader):
     index_record = tree_loader._create_index_record(
@@ -126,6 +233,31 @@ def test_load_data(tree_loader):
     tree_loader.es_tools.exists_index.assert_called_once_with()
     tree_loader.es_tools.submit_data_to_es.assert_called_once_with(data)
 
+def test_get_mappings(tree_loader):
+    [tree, tree_root, tree_ordering] = tree_loader._extract_file_to_data(NEWICK_FILE)
+    records = list(tree_loader._transform_data(tree, tree_root, tree_ordering))
+
+    mappings = tree_loader.get_mappings()['mappings']['test_doc_type']
+    assert mappings['dynamic'] is False
+    assert set(field for record in records for field in record) == set(mappings['properties'])
+
+    lod_mappings = tree_loader.get_mappings(tree_loader.__lod_mappings__)['mappings']['test_doc_type']
+    assert set(field for record in get_lod_records(records, lod_factor=2) for field in record) == set(lod_mappings['properties'])
+
+def test_load_file_lod(tree_loader, mocker):
+    lod_loader = TreeLoader(es_doc_type="test_lod_doc_type", es_index="test_lod_index", es_host="http://localhost", es_port="9200")
+    lod_loader.es_tools = mocker.MagicMock()
+    tree_loader.es_tools = mocker.MagicMock()
+    tree_loader.es_tools.submit_data_to_es.side_effect = list
+    extract_file_to_data = mocker.spy(tree_loader, '_extract_file_to_data')
+
+    tree_loader.load_file(analysis_file=NEWICK_FILE, lod_loader=lod_loader)
+
+    # the tree is read once, for both indices
+    assert extract_file_to_data.call_count == 1
+    [[lod_records], _] = lod_loader.es_tools.submit_data_to_es.call_args
+    assert lod_records == list(get_lod_records(tree_loader._get_records(NEWICK_FILE)))
+
 
 HOST = 'localhost'
 PORT = 9200
@@ -0,0 +1,47 @@
+import pytest
+from common.tree_loader import TreeLoader
+from common.tree_lod import get_lod_records
+
+
+NEWICK_FILE = '../example/tree_data.newick'
+
+
+@pytest.fixture
+def tree_records(mocker):
+    mocker.patch('common.utils.es_utils.ElasticSearchTools')
+    tree_loader = TreeLoader(es_doc_type="test_doc_type", es_index="test_index", es_host="http://localhost", es_port="9200")
+    return list(tree_loader._get_records(NEWICK_FILE))
+
+
+def test_get_lod_records(tree_records):
+    lod_records = list(get_lod_records(tree_records, lod_factor=2))
+
+    assert sorted(set(record['level'] for record in lod_records)) == [1, 2]
+
+    for level in [1, 2]:
+        rows = sorted((record for record in lod_records if record['level'] == level), key=lambda record: record['min_index'])
+
+        # rows cover the heatmap in order, without overlapping
+        assert rows[0]['min_index'] == 0
+        assert rows[-1]['max_index'] == 3
+        assert all(prev['max_index'] + 1 == curr['min_index'] for prev, curr in zip(rows, rows[1:]))
+
+        assert all(row['num_leafs'] <= 2 ** level for row in rows)
+        assert all(prev['num_leafs'] + curr['num_leafs'] > 2 ** level for prev, curr in zip(rows, rows[1:]))
+
+def test_get_lod_records_top_level(tree_records):
+    [top_row] = [record for record in get_lod_records(tree_records, lod_factor=2) if record['level'] == 2]
+
+    assert top_row['cell_id'] == 'root'
+    assert top_row['num_leafs'] == 4
+    assert top_row['num_clades'] == 1
+
+def test_get_lod_records_packed_rows(tree_records):
+    rows = [record for record in get_lod_records(tree_records, lod_factor=2) if record['level'] == 1]
+
+    assert [row['cell_id'] for row in rows] == ['CELL1', 'LOCI1']
+    assert [row['num_clades'] for row in rows] == [2, 1]
+    assert [row['max_height'] for row in rows] == [0, 1]
+
+def test_get_lod_records_empty():
+    assert list(get_lod_records([])) == []
@@ -0,0 +1,138 @@
+import pytest
+import mock
+import common.tree_readers as tree_readers
+from common.tree_readers import read_newick_edges, read_gml_edges, read_csv_edges, root_edges
+from common.tree_loader import format_name
+from common.preprocessor import Preprocessor
+
+
+NEWICK_FILE = '../example/tree_data.newick'
+COMPRESS_NEWICK_FILE = '../example/tree_compress_data.newick'
+ROOTED_GML_FILE = '../example/rooted_tree_data.gml'
+UNROOTED_GML_FILE = '../example/unrooted_tree_data.gml'
+
+
+def test_read_newick_edges():
+    edges = list(read_newick_edges(NEWICK_FILE))
+    assert edges == [
+        ('LOCI1', 'CELL2'),
+        ('LOCI1', 'CELL3'),
+        ('root', 'CELL1'),
+        ('root', 'CELL4'),
+        ('root', 'LOCI1')
+    ]
+
+def test_read_newick_edges_unary_node():
+    edges = list(read_newick_edges(COMPRESS_NEWICK_FILE))
+    assert ('LOCI2', 'LOCI1') in edges
+    assert ('root', 'LOCI2') in edges
+    assert len(edges) == 6
+
+def test_read_newick_edges_lengths_comments_and_quotes(tmpdir):
+    newick_file = tmpdir.join('tree.newick')
+    newick_file.write("(cell_A:0.1,'B''s label':2[&&NHX:S=x],(C, D)[x]:1.5);\n")
+
+    edges = list(read_newick_edges(str(newick_file), format_name))
+    assert edges == [
+        ('internal_1', 'C'),
+        ('internal_1', 'D'),
+        ('root', 'A'),
+        ('root', "B's label"),
+        ('root', 'internal_1')
+    ]
+
+def test_read_newick_edges_across_chunks(mocker):
+    expected = list(read_newick_edges(NEWICK_FILE))
+
+    mocker.patch.object(tree_readers, 'CHUNK_SIZE', 3)
+    assert list(read_newick_edges(NEWICK_FILE)) == expected
+
+def test_read_newick_edges_with_preprocessor(tmpdir):
+    newick_file = tmpdir.join('tree.newick')
+    newick_file.write("((cell_SA1a,cell_SA2b)L1,C3);")
+    preprocessor = Preprocessor(str(newick_file), matching_required=True)
+
+    edges = list(read_newick_edges(str(newick_file), format_name, preprocessor))
+    assert edges == [
+        ('L1', 'SA1'),
+        ('L1', 'SA2'),
+        ('root', 'L1'),
+        ('root', 'C3')
+    ]
+
+def test_read_gml_edges():
+    edges = list(read_gml_edges(ROOTED_GML_FILE))
+    assert len(edges) == 5
+    assert ('ROOT', 'CELL1') in edges
+    assert ('LOCI1', 'CELL2') in edges
+
+def test_read_gml_edges_attributes(tmpdir):
+    gml_file = tmpdir.join('tree.gml')
+    gml_file.write('''# a comment
+graph [
+  directed 1
+  edge [ source 1 target 2 weight 0.5 ]
+  node [ id 1 label " A " graphics [ label "ignored" x 1 ] ]
+  node [ id 2 ]
+  edge [
+    source 1
+    target 3
+    label "an edge"
+  ]
+  node [ id 3 label "C [x]" ]
+]
+''')
+
+    assert list(read_gml_edges(str(gml_file))) == [('A', '2'), ('A', 'C [x]')]
+
+def test_read_gml_edges_with_preprocessor(tmpdir):
+    gml_file = tmpdir.join('tree.gml')
+    gml_file.write('graph [ node [ id 1 label "ROOT" ] node [ id 2 label "cell_SA1a" ] node [ id 3 ] edge [ source 1 target 2 ] edge [ source 1 target 3 ] ]')
+    preprocessor = Preprocessor(str(gml_file), matching_required=True)
+
+    assert list(read_gml_edges(str(gml_file), preprocessor)) == [('ROOT', 'SA1'), ('ROOT', '3')]
+
+def test_read_gml_edges_undeclared_node(tmpdir):
+    gml_file = tmpdir.join('tree.gml')
+    gml_file.write('graph [ node [ id 1 label "A" ] edge [ source 1 target 2 ] ]')
+
+    with pytest.raises(ValueError):
+        list(read_gml_edges(str(gml_file)))
+
+def test_read_gml_edges_across_chunks(mocker):
+    expected = list(read_gml_edges(ROOTED_GML_FILE))
+
+    mocker.patch.object(tree_readers, 'CHUNK_SIZE', 3)
+    assert list(read_gml_edges(ROOTED_GML_FILE)) == expected
+
+def test_read_csv_edges(tmpdir):
+    csv_file = tmpdir.join('tree_edges.csv')
+    csv_file.write('target,source\nA,root\n B ,root\n')
+
+    assert list(read_csv_edges(str(csv_file))) == [('root', 'A'), ('root', 'B')]
+
+def test_read_csv_edges_with_preprocessor(tmpdir):
+    csv_file = tmpdir.join('tree_edges.csv')
+    csv_file.write('source,target\nroot,cell_A\n')
+    preprocessor = Preprocessor(str(csv_file))
+
+    assert list(read_csv_edges(str(csv_file), preprocessor)) == [('root', 'A')]
+
+def test_read_csv_edges_blank_lines(tmpdir):
+    csv_file = tmpdir.join('tree_edges.csv')
+    csv_file.write('source,target\nroot,A\n\nroot,B\n\n')
+
+    assert list(read_csv_edges(str(csv_file))) == [('root', 'A'), ('root', 'B')]
+
+def test_root_edges():
+    edges = list(root_edges(read_gml_edges(UNROOTED_GML_FILE), 'ROOT'))
+    assert len(edges) == 5
+    assert ('ROOT', 'LOCI1') in edges
+    assert ('LOCI1', 'CELL2') in edges
+
+def test_root_edges_errors():
+    with pytest.raises(ValueError):
+        list(root_edges([('A', 'B')], 'C'))
+
+    with pytest.raises(ValueError):
+        list(root_edges([('A', 'B'), ('B', 'C'), ('C', 'A')], 'A'))
@@ -3,6 +3,7 @@ import logging
 import argparse
 import sys
 import os
+import multiprocessing
 sys.path.append(os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
 from common.analysis_entry_loader import AnalysisEntryLoader
 from common.yaml_data_parser import YamlData
@@ -12,6 +13,11 @@ from common.metrics_loader import MetricsLoader
 from common.bins_loader import BinsLoader
 from common.normalize_segs import normalize_segs
 from common.preprocessor import Preprocessor
+from common.utils.record_cache import DEFAULT_CACHE_DIR
+from common.utils.es_utils import ElasticSearchTools, BULK_CHUNK_SIZE
+from common.utils.table_reader import DEFAULT_CHUNK_SIZE
+from common.utils.parallel_load import get_num_workers, load_files_parallel
+from common.utils.stage_scheduler import StageScheduler
 
 dashboard_type = "TREE_CELLSCAPE"
 
@@ -37,6 +43,62 @@ def _set_logger_config(verbosity=None):
             logger.setLevel(logging.ERROR)
 
 
+def _get_loader_args(args, index_name):
+    return {
+        'es_doc_type': index_name,
+        'es_index': index_name,
+        'es_host': args.host,
+        'es_port': args.port,
+        'bulk_workers': args.bulk_workers,
+        'bulk_chunk_size': args.bulk_chunk_size
+    }
+
+
+def _create_file_pool(args, yaml_data):
+    '''
+    Returns a pool of as many worker processes as the segs, metrics and bins
+    files, cores and cluster allow, or None for a single worker. The pool
+    is shared by the stages and has to be created before they start their
+    threads, so no worker is forked while another thread holds a lock.
+    '''
+    num_files = sum(len(files_args) for files_args in [
+        _get_segs_files_args(args, yaml_data),
+        _get_metrics_files_args(yaml_data),
+        _get_bins_files_args(args, yaml_data)
+    ])
+
+    es_tools = ElasticSearchTools()
+    es_tools.init_host(host=args.host, port=args.port)
+    es_tools.set_bulk_options(workers=args.bulk_workers)
+
+    num_workers = get_num_workers(es_tools, num_files, args.file_workers)
+    logging.info('Loading %d files with %d workers', num_files, num_workers)
+
+    if num_workers < 2:
+        return None
+
+    return multiprocessing.Pool(processes=num_workers)
+
+
+def _load_files(loader, loader_args, files_args, pool=None):
+    '''
+    Loads the files into the index of loader, from the worker processes of
+    pool or one at a time if None. Each worker builds its own loader from
+    loader_args.
+    '''
+    if not files_args:
+        return
+
+    if not loader.es_tools.exists_index():
+        loader.create_index()
+
+    load_files_parallel(
+        type(loader),
+        loader_args,
+        files_args,
+        pool=pool)
+
+
 def load_analysis_entry(args, yaml_data):
     logging.info("")
     logging.info("")
@@ -52,7 +114,7 @@ def load_analysis_entry(args, yaml_data):
     logging.info("Analysis entry loaded")
 
 
-def load_tree_data(args, yaml_data):
+def load_tree_data(args, yaml_data, preprocessor=None):
     logging.info("")
     logging.info("")
     logging.info("==================")
@@ -64,17 +126,31 @@ def load_tree_data(args, yaml_data):
         es_doc_type=index_name,
         es_index=index_name,
         es_host=args.host,
-        es_port=args.port
+        es_port=args.port,
+        cache_dir=args.cache_dir,
+        max_cache_size=args.cache_size,
+        bulk_workers=args.bulk_workers,
+        bulk_chunk_size=args.bulk_chunk_size
     )
 
+    # the level-of-detail summaries and Euler tour index are built from the records of the tree index
+    tree_lod_loader = TreeLoader(**_get_loader_args(args, yaml_data.get_index_name(dashboard_type, "tree_lod")))
+
+    tree_index_file = None
+    if args.tree_index_dir is not None:
+        tree_index_file = os.path.join(args.tree_index_dir, index_name + '.npz')
+
     tree_loader.load_file(
         analysis_file=yaml_data.get_file_paths("tree"),
         ordering_file=yaml_data.get_file_paths("tree_order"),
         root_id=yaml_data.get_file_paths("tree_root"),
-        tree_edges=yaml_data.get_file_paths("tree_edges")
+        tree_edges=yaml_data.get_file_paths("tree_edges"),
+        preprocessor=preprocessor,
+        lod_loader=tree_lod_loader,
+        tree_index_file=tree_index_file
     )
 
-def load_segs_data(args, yaml_data):
+def load_segs_data(args, yaml_data, pool=None):
     logging.info("")
     logging.info("")
     logging.info("==================")
@@ -82,37 +158,41 @@ def load_segs_data(args, yaml_data):
     logging.info("==================")
     index_name = yaml_data.get_index_name(dashboard_type, "segs")
 
-    segs_loader = SegsLoader(
-        es_doc_type=index_name,
-        es_index=index_name,
-        es_host=args.host,
-        es_port=args.port
-    )
-
-    seg_files = yaml_data.get_file_paths("segs")
+    loader_args = dict(_get_loader_args(args, index_name), packed=args.packed_segs)
+    segs_loader = SegsLoader(**loader_args)
 
     if segs_loader.es_tools.exists_index():
         logging.info('Seg data for analysis already exists - will delete old index')
         segs_loader.es_tools.delete_index()
 
-    if seg_files is not None:
-        for seg_file in seg_files:
-            segs_loader.load_file(
-                analysis_file=seg_file
-            )
+    _load_files(segs_loader, loader_args, _get_segs_files_args(args, yaml_data), pool)
 
 
+def _get_segs_files_args(args, yaml_data):
+    seg_files = yaml_data.get_file_paths("segs")
     h5_files = yaml_data.get_file_paths('h5')
+
+    files_args = []
+
+    if seg_files is not None:
+        for seg_file in seg_files:
+            files_args.append({
+                'analysis_file': seg_file,
+                'chunksize': args.chunksize or None
+            })
+
     if h5_files is not None:
-        logging.info('Loading H5 data')
         for hdf_paths in h5_files:
-            segs_loader.load_file(
-                analysis_file=hdf_paths['base'],
-                subpath=hdf_paths['segs']
-            )
+            files_args.append({
+                'analysis_file': hdf_paths['base'],
+                'subpath': hdf_paths['segs'],
+                'chunksize': args.chunksize or None
+            })
+
+    return files_args
 
 
-def load_metrics_data(args, yaml_data):
+def load_metrics_data(args, yaml_data, pool=None):
     logging.info("")
     logging.info("")
     logging.info("==================")
@@ -120,40 +200,44 @@ def load_metrics_data(args, yaml_data):
     logging.info("==================")
     index_name = yaml_data.get_index_name(dashboard_type, "qc")
 
-    metrics_loader = MetricsLoader(
-        es_doc_type=index_name,
-        es_index=index_name,
-        es_host=args.host,
-        es_port=args.port
-    )
+    loader_args = _get_loader_args(args, index_name)
+    metrics_loader = MetricsLoader(**loader_args)
 
+    if yaml_data.get_file_paths('metrics') is not None and metrics_loader.es_tools.exists_index():
+        logging.info('Metric data for analysis already exists - will delete old index')
+        metrics_loader.es_tools.delete_index()
+
+    _load_files(metrics_loader, loader_args, _get_metrics_files_args(yaml_data), pool)
+
+
+def _get_metrics_files_args(yaml_data):
     metric_files = yaml_data.get_file_paths('metrics')
     h5_files = yaml_data.get_file_paths('h5')
 
-    if metric_files is not None:
-        if metrics_loader.es_tools.exists_index():
-            logging.info('Metric data for analysis already exists - will delete old index')
-            metrics_loader.es_tools.delete_index()
+    files_args = []
 
+    if metric_files is not None:
         for metric_file in metric_files:
-            metrics_loader.load_file(
-                analysis_file=metric_file
-            )
-
+            files_args.append({
+                'analysis_file': metric_file
+            })
 
     if h5_files is not None:
-        logging.info('Loading H5 data')
+        # not every h5 file has metrics
         for hdf_paths in h5_files:
-            try:
-                metrics_loader.load_file(
-                    analysis_file=hdf_paths['base'],
-                    subpath=hdf_paths['metrics']
-                )
-            except KeyError:
-                pass
+            if 'metrics' in hdf_paths:
+                files_args.append({
+                    'analysis_file': hdf_paths['base'],
+                    'subpath': hdf_paths['metrics']
+                })
 
+    return files_args
 
-def load_bins_data(args, yaml_data):
+
+def load_bins_data(args, yaml_data, pool=None):
+    '''
+    Loads the bin files, returns whether there were any
+    '''
     logging.info("")
     logging.info("")
     logging.info("==================")
@@ -162,64 +246,74 @@ def load_bins_data(args, yaml_data):
 
     if yaml_data.has_type('skip_bins'):
         logging.info('Skipping bin load')
-        return
+        return False
 
     index_name = yaml_data.get_index_name(dashboard_type, "bins")
 
-    bins_loader = BinsLoader(
-        es_doc_type=index_name,
-        es_index=index_name,
-        es_host=args.host,
-        es_port=args.port
-    )
+    loader_args = _get_loader_args(args, index_name)
+    if args.bins_pyramid:
+        # the levels of each file are built from its own bins, cells are not split over files
+        loader_args['pyramid_index'] = yaml_data.get_index_name(dashboard_type, "bins_pyramid")
 
-    bin_files = yaml_data.get_file_paths('bins')
-    h5_files = yaml_data.get_file_paths('h5')
+    bins_loader = BinsLoader(**loader_args)
 
+    for loader in filter(None, [bins_loader, bins_loader.pyramid_loader]):
+        if loader.es_tools.exists_index():
+            logging.info('Bin data for analysis already exists - will delete old index')
+            loader.es_tools.delete_index()
 
-    if bins_loader.es_tools.exists_index():
-        logging.info('Bin data for analysis already exists - will delete old index')
-        bins_loader.es_tools.delete_index()
+    files_args = _get_bins_files_args(args, yaml_data)
 
+    # created here, so the workers do not race to create it
+    if files_args and bins_loader.pyramid_loader is not None:
+        bins_loader.pyramid_loader.create_index()
 
-    has_bin_data = False
+    _load_files(bins_loader, loader_args, files_args, pool)
+
+    return len(files_args) > 0
+
+
+def _get_bins_files_args(args, yaml_data):
+    bin_files = yaml_data.get_file_paths('bins')
+    h5_files = yaml_data.get_file_paths('h5')
+
+    files_args = []
 
     if bin_files is not None:
-        logging.info('Loading CSV tables')
         for bin_file in bin_files:
-            bins_loader.load_file(
-                analysis_file=bin_file
-            )
-        has_bin_data = True
-
+            files_args.append({
+                'analysis_file': bin_file,
+                'chunksize': args.chunksize or None
+            })
 
     if h5_files is not None:
-        logging.info('Loading H5 data')
-        try:
-            for hdf_paths in h5_files:
-                bins_loader.load_file(
-                    analysis_file=hdf_paths['base'],
-                    subpath=hdf_paths['bins']
-                )
-            has_bin_data = True
-        except KeyError:
-            pass
-
-    if has_bin_data:
-        logging.info("")
-        logging.info("")
-        logging.info("==================")
-        logging.info("NORMALIZING SEGMENT DATA TO MODE")
-        logging.info("==================")
-        norm_segs_index = yaml_data.get_index_name(dashboard_type, "nsegs")
-        norm_segs_loader = SegsLoader(
-            es_doc_type=norm_segs_index,
-            es_index=norm_segs_index,
-            es_host=args.host,
-            es_port=args.port
-        )
-
-        normalize_segs(bins_loader, norm_segs_loader)
+        # not every h5 file has bins
+        for hdf_paths in h5_files:
+            if 'bins' in hdf_paths:
+                files_args.append({
+                    'analysis_file': hdf_paths['base'],
+                    'subpath': hdf_paths['bins'],
+                    'chunksize': args.chunksize or None
+                })
+
+    return files_args
+
+
+def normalize_segs_data(args, yaml_data, has_bin_data):
+    if not has_bin_data:
+        return
+
+    logging.info("")
+    logging.info("")
+    logging.info("==================")
+    logging.info("NORMALIZING SEGMENT DATA TO MODE")
+    logging.info("==================")
+    bins_loader = BinsLoader(**_get_loader_args(args, yaml_data.get_index_name(dashboard_type, "bins")))
+
+    norm_segs_index = yaml_data.get_index_name(dashboard_type, "nsegs")
+    norm_segs_loader = SegsLoader(packed=args.packed_segs, **_get_loader_args(args, norm_segs_index))
+
+    normalize_segs(bins_loader, norm_segs_loader)
 
 
 def run_preprocessing(args, yaml_data):
@@ -231,15 +325,16 @@ def run_preprocessing(args, yaml_data):
 
     if args.preprocessing is False:
         logging.info('Skipping preprocessing')
-        return
+        return None
 
+    # node names are preprocessed while the tree is read, the file itself is left untouched
     file_path = yaml_data.get_file_paths("tree")
     preprocessor = Preprocessor(
         newick_file=file_path,
         matching_required=args.match_id
     )
 
-    preprocessor.preprocess()
+    return preprocessor
 
 
 def get_args():
@@ -258,6 +353,78 @@ def get_args():
         action='store',
         help='Configuration file in Yaml format',
         type=str)
+    parser.add_argument(
+        '--tree-index-dir',
+        dest='tree_index_dir',
+        action='store',
+        help='Directory to save the Euler tour index of the tree to',
+        type=str)
+    parser.add_argument(
+        '--cache-dir',
+        dest='cache_dir',
+        action='store',
+        help=('Cache transformed tree records in this directory, for example %s. ' % DEFAULT_CACHE_DIR +
+              'Off unless set, the cache grows up to --cache-size'),
+        type=str,
+        default=None)
+    parser.add_argument(
+        '--cache-size',
+        dest='cache_size',
+        action='store',
+        help='Maximum size of the tree record cache in bytes, 2GB by default',
+        type=int)
+    parser.add_argument(
+        '--no-cache',
+        dest='cache_dir',
+        action='store_const',
+        const=None,
+        help='Do not read or write cached tree records, the default')
+    parser.add_argument(
+        '-c',
+        '--chunksize',
+        dest='chunksize',
+        action='store',
+        help='Number of segment and bin rows to read and index at a time, 0 to load whole files at once',
+        type=int,
+        default=DEFAULT_CHUNK_SIZE)
+    parser.add_argument(
+        '--packed-segs',
+        dest='packed_segs',
+        action='store_true',
+        help='Index segments and normalized segments as one document per cell',
+        default=False)
+    parser.add_argument(
+        '--bins-pyramid',
+        dest='bins_pyramid',
+        action='store_true',
+        help='Also index the 1Mb, 5Mb, 20Mb and whole chromosome pyramid levels of the bins, built while loading them',
+        default=False)
+    parser.add_argument(
+        '--stage-workers',
+        dest='stage_workers',
+        action='store',
+        help='Maximum number of load stages to run at once, 1 to run them one after another, all independent stages by default',
+        type=int)
+    parser.add_argument(
+        '--file-workers',
+        dest='file_workers',
+        action='store',
+        help='Maximum number of segment, metric and bin files to load at once, by default as many as the cores and cluster write threads allow',
+        type=int)
+    parser.add_argument(
+        '--bulk-workers',
+        dest='bulk_workers',
+        action='store',
+        help='Number of bulk requests to keep in flight at once',
+        type=int,
+        default=1)
+    parser.add_argument(
+        '--bulk-chunk-size',
+        dest='bulk_chunk_size',
+        action='store',
+        help='Number of documents per bulk request',
+        type=int,
+        default=BULK_CHUNK_SIZE)
     parser.add_argument(
         '-H',
         '--host',
@@ -315,13 +482,32 @@ def main():
     args = get_args()
     _set_logger_config(args.verbosity)
     yaml_data = YamlData(args.yaml_file)
-    run_preprocessing(args, yaml_data)
-    load_tree_data(args, yaml_data)
 
-    load_segs_data(args, yaml_data)
-    load_metrics_data(args, yaml_data)
-    load_bins_data(args, yaml_data)
-    load_analysis_entry(args, yaml_data)
+    # forked before the stages start their threads
+    pool = _create_file_pool(args, yaml_data)
+
+    # the tree, segs, metrics and bins are independent, the analysis entry
+    # is only written once all the data is in
+    scheduler = StageScheduler(max_workers=args.stage_workers)
+    scheduler.add_stage('preprocessing', lambda: run_preprocessing(args, yaml_data))
+    scheduler.add_stage('tree', lambda preprocessor: load_tree_data(args, yaml_data, preprocessor),
+                        depends_on=['preprocessing'])
+    scheduler.add_stage('segs', lambda: load_segs_data(args, yaml_data, pool))
+    scheduler.add_stage('metrics', lambda: load_metrics_data(args, yaml_data, pool))
+    scheduler.add_stage('bins', lambda: load_bins_data(args, yaml_data, pool))
+    scheduler.add_stage('normalization', lambda has_bin_data: normalize_segs_data(args, yaml_data, has_bin_data),
+                        depends_on=['bins'])
+    scheduler.add_stage('analysis_entry', lambda *_: load_analysis_entry(args, yaml_data),
+                        depends_on=['tree', 'segs', 'metrics', 'bins', 'normalization'])
+
+    try:
+        scheduler.run()
+        if pool is not None:
+            pool.close()
+    finally:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
 
 
 if __name__ == '__main__':
@@ -7,7 +7,7 @@ export const schema = gql`
     chromosomes(analysis: String!): [Chromosome]
     segs(analysis: String!, indices: [Int!]!, isNorm: Boolean!): [SegRow]
     modeSegs(analysis: String!): [Seg]
-    cloneSegs(analysis: String!, range: [Int!]!): [Seg]
+    cloneSegs(analysis: String!, range: [Int!]!, binSize: Int): [Seg]
   }
 
   type Chromosome {
@@ -35,8 +35,14 @@ export const schema = gql`
 export const resolvers = {
   Query: {
     async chromosomes(_, { analysis }) {
+      const index = `ce00_${analysis.toLowerCase()}_segs`;
+
+      if (await isPackedIndex(index)) {
+        return getPackedChromosomes(index);
+      }
+
       const results = await client.search({
-        index: `ce00_${analysis.toLowerCase()}_segs`,
+        index,
         body: {
           size: 0,
           aggs: {
@@ -82,19 +88,34 @@ export const resolvers = {
       return segs;
     },
 
-    async cloneSegs(_, { analysis, range }) {
+    async cloneSegs(_, { analysis, range, binSize }) {
       const idResults = await getIDsForRange(analysis, range);
       const ids = idResults.hits.hits.map(record => record["_source"].cell_id);
 
-      const cloneBins = await client.search({
-        index: `cl00_${analysis.toLowerCase()}_bins`,
-        body: getBinQuery(ids)
-      });
+      const pyramidIndex = `ce00_${analysis.toLowerCase()}_bins_pyramid`;
+      // Other bin sizes have no level, they are read from the raw bins
+      const usePyramid =
+        PYRAMID_BIN_SIZES.includes(binSize) &&
+        (await client.indices.exists({ index: pyramidIndex }));
+
+      const cloneBins = usePyramid
+        ? await client.search({
+            index: pyramidIndex,
+            body: getPyramidBinQuery(ids, binSize)
+          })
+        : await client.search({
+            index: `cl00_${analysis.toLowerCase()}_bins`,
+            body: getBinQuery(ids)
+          });
 
       const results = cloneBins.aggregations.chromosomes.buckets.reduce(
         (results, chromosome) => [
           ...results,
-          ...getSegsForChromosome(chromosome.key, chromosome.bins.buckets)
+          ...getSegsForChromosome(
+            chromosome.key,
+            chromosome.bins.buckets,
+            usePyramid ? binSize : 500000
+          )
         ],
         []
       );
@@ -198,6 +219,12 @@ async function getSegsForID(index, id) {
     index,
     body: {
       size: 50000,
+      // Same order as the index sort, so a cell's segments are read in one run
+      sort: [
+        { cell_id: { order: "asc" } },
+        { chrom_number: { order: "asc" } },
+        { start: { order: "asc" } }
+      ],
       query: {
         bool: {
           filter: [{ term: { cell_id: id } }]
@@ -206,9 +233,103 @@ async function getSegsForID(index, id) {
     }
   });
 
-  return results.hits.hits.map(seg => seg["_source"]);
+  const hits = results.hits.hits;
+  const segs = [].concat(...hits.map(hit => unpackSegs(hit["_source"])));
+
+  // Segments of a cell held by several packed documents are merged back in
+  // index order, unpacked hits are already in it
+  return hits.some(hit => Array.isArray(hit["_source"].start))
+    ? segs.sort(compareSegs)
+    : segs;
+}
+
+const compareSegs = (seg, other) =>
+  seg.chrom_number === other.chrom_number
+    ? seg.start - other.start
+    : seg.chrom_number < other.chrom_number
+    ? -1
+    : 1;
+
+// Packed indices hold one document per cell, with its segments as parallel
+// arrays. The layout is read from the mapping on every call, so it follows
+// an analysis that is reloaded with the other layout
+async function isPackedIndex(index) {
+  const results = await client.indices.getMapping({ index });
+
+  return Object.values(results).some(({ mappings }) =>
+    Object.values(mappings).some(
+      mapping => mapping._meta !== undefined && mapping._meta.layout === "packed"
+    )
+  );
+}
+
+// Chromosome extents of a packed index, read from the segment arrays of each cell
+async function getPackedChromosomes(index) {
+  const results = await client.search({
+    index,
+    body: {
+      size: 0,
+      aggs: {
+        chrom_ranges: {
+          scripted_metric: {
+            init_script: "state.ranges = [:]",
+            map_script: `
+              def source = params._source;
+              for (int i = 0; i < source.start.size(); i++) {
+                def chrom = source.chrom_number[i];
+                def range = state.ranges.get(chrom);
+                if (range == null) {
+                  state.ranges.put(chrom, [source.start[i], source.end[i]]);
+                } else {
+                  range[0] = Math.min(range[0], source.start[i]);
+                  range[1] = Math.max(range[1], source.end[i]);
+                }
+              }
+            `,
+            combine_script: "return state.ranges",
+            reduce_script: `
+              def ranges = [:];
+              for (shardRanges in states) {
+                for (entry in shardRanges.entrySet()) {
+                  def range = ranges.get(entry.getKey());
+                  if (range == null) {
+                    ranges.put(entry.getKey(), entry.getValue());
+                  } else {
+                    range[0] = Math.min(range[0], entry.getValue()[0]);
+                    range[1] = Math.max(range[1], entry.getValue()[1]);
+                  }
+                }
+              }
+              return ranges;
+            `
+          }
+        }
+      }
+    }
+  });
+
+  const ranges = results.aggregations.chrom_ranges.value;
+
+  return Object.keys(ranges)
+    .sort()
+    .map(key => ({
+      key,
+      XMin: { value: ranges[key][0] },
+      XMax: { value: ranges[key][1] }
+    }));
 }
 
+const unpackSegs = record =>
+  Array.isArray(record.start)
+    ? record.start.map((start, i) => ({
+        cell_id: record.cell_id,
+        chrom_number: record.chrom_number[i],
+        start,
+        end: record.end[i],
+        state: record.state[i]
+      }))
+    : [record];
+
 /*********
  * Clones
  **********/
@@ -285,7 +406,53 @@ const getBinQuery = ids => {
   };
 };
 
-const getSegsForChromosome = (id, bins) => {
+// Bin sizes of the pyramid levels written by the bins loader, 0 for the level
+// with one window per chromosome
+const PYRAMID_BIN_SIZES = [1000000, 5000000, 20000000, 0];
+
+// Modal state of the cells in each window of one pyramid level
+const getPyramidBinQuery = (ids, binSize) => ({
+  size: 0,
+  query: {
+    bool: {
+      filter: [{ term: { bin_size: binSize } }, { terms: { cell_id: ids } }]
+    }
+  },
+  aggs: {
+    chromosomes: {
+      terms: {
+        field: "chrom_number",
+        size: 50
+      },
+      aggs: {
+        bins: {
+          terms: {
+            field: "start",
+            size: 50000,
+            order: {
+              _key: "asc"
+            }
+          },
+          aggs: {
+            end: {
+              max: {
+                field: "end"
+              }
+            },
+            state: {
+              terms: {
+                field: "state",
+                size: 1
+              }
+            }
+          }
+        }
+      }
+    }
+  }
+});
+
+const getSegsForChromosome = (id, bins, binSize = 500000) => {
   const convertBinsToSegs = (currSeg, allSegs, bins) => {
     if (bins.length === 0) {
       return [...allSegs, currSeg];
@@ -312,15 +479,17 @@ const getSegsForChromosome = (id, bins) => {
 
   const hasSameState = (seg, bin) => seg.state === getBinState(bin);
 
+  const getBinEnd = bin => (bin.end ? bin.end.value : bin.key + binSize);
+
   const mergeSegs = (seg, bin) => ({
     ...seg,
-    end: bin.key + 500000
+    end: getBinEnd(bin)
   });
 
   const convertToSeg = bin => ({
     chrom_number: id,
-    start: bin.key === 0 ? bin.key : bin.key + 1,
-    end: bin.key + 500000,
+    start: bin.key === 0 || bin.end ? bin.key : bin.key + 1,
+    end: getBinEnd(bin),
     state: getBinState(bin)
   });
   const [firstBin, ...restBin] = bins;
@@ -7,6 +7,7 @@ export const schema = gql`
     treeRoot(analysis: String!): Node
     treeNode(analysis: String!, id: [String!], index: Int): Node
     treeNodes(analysis: String!, range: [Int!]!): [Node]
+    treeSummaries(analysis: String!, range: [Int!]!, rows: Int!): [NodeSummary]
   }
 
   type Node {
@@ -18,6 +19,15 @@ export const schema = gql`
     children: [NodeChild!]!
   }
 
+  type NodeSummary {
+    id: [String!]!
+    index: Int!
+    maxIndex: Int!
+    maxHeight: Int!
+    numLeafs: Int!
+    numClades: Int!
+  }
+
   type NodeChild {
     id: [String!]!
     index: Int!
@@ -28,6 +38,12 @@ export const schema = gql`
 
 const formatIdStringToList = idStr => idStr.split(",").map(item => item.trim());
 
+// Level k of the level-of-detail index holds up to 4 ** k leaves per row
+const LOD_FACTOR = 4;
+
+const getLodLevel = (numLeafs, rows) =>
+  Math.ceil(Math.log(numLeafs / rows) / Math.log(LOD_FACTOR));
+
 const getHeatmapIndex = record => record.hasOwnProperty("heatmap_order") ? record.heatmap_order : record.min_index;
 
 export const resolvers = {
@@ -97,6 +113,53 @@ export const resolvers = {
       });
 
       return results.hits.hits;
+    },
+
+    async treeSummaries(_, { analysis, range, rows }) {
+      const [minIndex, maxIndex] = range;
+      const level = getLodLevel(maxIndex - minIndex + 1, rows);
+
+      // Every leaf fits on screen, so show the leaves themselves
+      if (level < 1) {
+        const leaves = await resolvers.Query.treeNodes(_, { analysis, range });
+        return leaves.map(leaf => ({
+          ...leaf["_source"],
+          min_index: leaf["_source"].heatmap_order,
+          max_index: leaf["_source"].heatmap_order,
+          num_leafs: 1,
+          num_clades: 1
+        }));
+      }
+
+      const results = await client.search({
+        index: `ce00_${analysis.toLowerCase()}_tree_lod`,
+        body: {
+          size: 50000,
+          sort: [
+            {
+              min_index: {
+                order: "asc"
+              }
+            }
+          ],
+          query: {
+            bool: {
+              filter: [
+                { term: { level: level } },
+                { range: { max_index: { gte: minIndex } } },
+                { range: { min_index: { lte: maxIndex } } }
+              ]
+            }
+          }
+        }
+      });
+
+      // Past the top level, the top level's single row covers everything
+      if (results.hits.hits.length === 0 && level > 1) {
+        return resolvers.Query.treeSummaries(_, { analysis, range, rows: rows * LOD_FACTOR });
+      }
+
+      return results.hits.hits.map(hit => hit["_source"]);
     }
   },
   Node: {
@@ -106,6 +169,11 @@ export const resolvers = {
     maxIndex: root => root["_source"].max_index,
     maxHeight: root => root["_source"].max_height,
     children: root => {
+      // Newer tree indices embed a summary of each child in the parent document
+      if (root["_source"].hasOwnProperty("child_summaries")) {
+        return root["_source"].child_summaries;
+      }
+
       return root["_source"].children.map(async child => {
         const results = await client.search({
           index: root["_index"],
@@ -123,6 +191,15 @@ export const resolvers = {
     }
   },
 
+  NodeSummary: {
+    id: root => formatIdStringToList(root.cell_id),
+    index: root => root.min_index,
+    maxIndex: root => root.max_index,
+    maxHeight: root => root.max_height,
+    numLeafs: root => root.num_leafs,
+    numClades: root => root.num_clades
+  },
+
   NodeChild: {
     id: root => formatIdStringToList(root.cell_id),
     index: root => getHeatmapIndex(root),
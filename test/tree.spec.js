@@ -118,3 +118,24 @@ it("test treeNodes query", async () => {
   });
   expect(res).toMatchSnapshot();
 });
+
+it("test treeSummaries query", async () => {
+  const TREESUMMARIES_QUERY = gql`
+    query {
+      treeSummaries {
+        id
+        index
+        maxIndex
+        maxHeight
+        numLeafs
+        numClades
+      }
+    }
+  `;
+
+  const res = await query({
+    query: TREESUMMARIES_QUERY,
+    variables: { analysis: ANALYSIS_ID, range: [0, 2], rows: 1 }
+  });
+  expect(res).toMatchSnapshot();
+});